@@ -0,0 +1,146 @@
+"""Frame cost of dragging a box and of hit-testing, against the number of boxes on the image.
+
+    python benchmarks/bench_canvas.py             # real Tk canvas, needs a display
+    python benchmarks/bench_canvas.py --offscreen # counts canvas calls instead
+
+Compares the old redraw (delete every box item and create it again on each
+motion event) with BoxLayer.move, and a linear hit-test scan with the
+BoxLayer grid.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import client
+from client import BoxLayer
+
+W, H = 4000, 3000
+
+
+class CountingCanvas:
+    """Stands in for tk.Canvas without a display; counts the calls a frame makes."""
+    def __init__(self):
+        self.calls = 0
+        self.next_id = 0
+
+    def _create(self, *args, **kwargs):
+        self.calls += 1
+        self.next_id += 1
+        return self.next_id
+
+    create_rectangle = create_text = _create
+
+    def coords(self, *args):
+        self.calls += 1
+
+    def itemconfig(self, *args, **kwargs):
+        self.calls += 1
+
+    def delete(self, *args):
+        self.calls += 1
+
+    def update_idletasks(self):
+        pass
+
+    def destroy(self):
+        pass
+
+
+def old_redraw(canvas, boxes, view):
+    canvas.delete("bbox")
+    for label, b in boxes:
+        x1, y1 = view.image_to_screen(b[0], b[1])
+        x2, y2 = view.image_to_screen(b[2], b[3])
+        canvas.create_rectangle(x1, y1, x2, y2, outline="red", width=2, tags="bbox")
+        canvas.create_text(x1, y1 - 12, text=label, fill="red", anchor="sw", tags="bbox")
+
+
+def linear_hit(boxes, x, y, pad):
+    for i in range(len(boxes) - 1, -1, -1):
+        x1, y1, x2, y2 = boxes[i][1]
+        if abs(x - x1) < pad and abs(y - y1) < pad or x1 <= x <= x2 and y1 <= y <= y2:
+            return i
+
+
+def grid_hit(layer, boxes, x, y, pad):
+    for i in reversed(layer.candidates(x, y, pad)):
+        x1, y1, x2, y2 = boxes[i][1]
+        if abs(x - x1) < pad and abs(y - y1) < pad or x1 <= x <= x2 and y1 <= y <= y2:
+            return i
+
+
+def random_boxes(n, rng):
+    boxes = []
+    for _ in range(n):
+        x, y = rng.uniform(0, W - 80), rng.uniform(0, H - 80)
+        boxes.append(("item", [x, y, x + rng.uniform(20, 80), y + rng.uniform(20, 80)]))
+    return boxes
+
+
+def time_frames(canvas, frame, frames):
+    t = time.perf_counter()
+    for _ in range(frames):
+        frame()
+        canvas.update_idletasks() # lets Tk lay out and draw what the frame changed
+    return (time.perf_counter() - t) / frames * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 100, 300, 1000, 3000])
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--offscreen", action="store_true")
+    args = parser.parse_args()
+
+    if args.offscreen:
+        make_canvas = CountingCanvas
+    else:
+        root = client.tk.Tk()
+        def make_canvas():
+            canvas = client.tk.Canvas(root, width=1200, height=900)
+            canvas.pack()
+            return canvas
+    view = types.SimpleNamespace(image_to_screen=lambda x, y: (x * 0.3, y * 0.3))
+
+    for n in args.counts:
+        rng = random.Random(n)
+        boxes = random_boxes(n, rng)
+
+        canvas = make_canvas()
+        old_ms = time_frames(canvas, lambda: old_redraw(canvas, boxes, view), args.frames)
+        old_calls = canvas.calls / args.frames if args.offscreen else None
+        canvas.destroy()
+
+        canvas = make_canvas()
+        layer = BoxLayer(canvas)
+        layer.draw(boxes, view, {}, 0, (W, H))
+        calls_before = getattr(canvas, "calls", 0)
+
+        def drag():
+            b = boxes[0][1]
+            b[0] += 1; b[2] += 1
+            layer.move(0, "item", b, view, "red", True)
+        new_ms = time_frames(canvas, drag, args.frames)
+        new_calls = (canvas.calls - calls_before) / args.frames if args.offscreen else None
+        canvas.destroy()
+
+        points = [(rng.uniform(0, W), rng.uniform(0, H)) for _ in range(2000)]
+        t = time.perf_counter()
+        linear = [linear_hit(boxes, x, y, 10) for x, y in points]
+        linear_us = (time.perf_counter() - t) / len(points) * 1e6
+        t = time.perf_counter()
+        grid = [grid_hit(layer, boxes, x, y, 10) for x, y in points]
+        grid_us = (time.perf_counter() - t) / len(points) * 1e6
+        assert linear == grid
+
+        calls = f" ({old_calls:.0f} vs {new_calls:.0f} canvas calls)" if args.offscreen else ""
+        print(f"{n:5} boxes  drag frame: redraw all {old_ms:7.3f} ms, move one {new_ms:6.3f} ms{calls}   "
+              f"hit-test: linear {linear_us:6.1f} us, grid {grid_us:5.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Bytes downloaded for a labeling session, with and without ETag revalidation and the client caches.
+
+    python benchmarks/bench_image_bandwidth.py --images 60
+
+Starts the server in-process on a temporary pool of noisy JPEGs (no model),
+then replays one session twice through client.Transport:
+- first views of every image,
+- two back-steps every five images,
+- three client restarts that each reopen the last 20 images.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import uvicorn
+from PIL import Image
+
+import client
+import server
+from server import server_state
+
+
+def session(names, restarts=3):
+    visits = []
+    for i, name in enumerate(names):
+        visits.append(name)
+        if i % 5 == 4:
+            visits += [names[i - 1], names[i - 2], names[i - 1], name]
+    return visits, [names[-20:]] * restarts
+
+
+def replay(transport, received, visits, restarts, max_side, use_cache):
+    received[0] = 0
+    disk = client.DiskImageCache(tempfile.mkdtemp())
+
+    def fetch(cache, name):
+        params = {"filename": name, "max_side": max_side}
+        if not use_cache:
+            transport.get("get_image_specific", params=params).content
+        elif cache.get(name) is None:
+            _, image, size = cache.download(transport, "get_image_specific", params)
+            cache.put(name, image, size, [])
+
+    cache = client.ImageCache(disk=disk)
+    for name in visits:
+        fetch(cache, name)
+    for names in restarts:
+        cache = client.ImageCache(disk=disk) # a restart keeps only the disk cache
+        for name in names:
+            fetch(cache, name)
+    return received[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=60)
+    parser.add_argument("--max-side", type=int, default=1600)
+    parser.add_argument("--port", type=int, default=8730)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    random.seed(1)
+    names = [f"img{i:03d}.jpg" for i in range(args.images)]
+    for name in names:
+        Image.effect_noise((2400, 1800), 60).convert("RGB").save(os.path.join(folder, name), quality=90)
+    server_state.log = lambda message: None
+    server_state.start(server.load_config(image_folder=folder, model=os.path.join(folder, "none.pt")))
+    threading.Thread(target=lambda: uvicorn.run(server_state.app, port=args.port, log_level="error"), daemon=True).start()
+
+    transport = client.Transport(f"http://127.0.0.1:{args.port}")
+    for _ in range(50):
+        try:
+            transport.get("")
+            break
+        except Exception:
+            time.sleep(0.1)
+    received = [0]
+    transport.session.hooks["response"].append(lambda r, *a, **k: received.__setitem__(0, received[0] + len(r.content)))
+
+    visits, restarts = session(names)
+    views = len(visits) + sum(len(r) for r in restarts)
+    before = replay(transport, received, visits, restarts, args.max_side, use_cache=False)
+    after = replay(transport, received, visits, restarts, args.max_side, use_cache=True)
+    print(f"{views} image views: {before / 1e6:.1f} MB without validation, {after / 1e6:.1f} MB with ETag + client caches "
+          f"({100 * (1 - after / before):.0f}% saved)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Hand-out cost of /next_image: folder listing per call vs the in-memory WorkQueue.
+
+    python benchmarks/bench_pool.py --sizes 1000 10000 100000
+
+Builds a temporary pool of tiny PNGs with half of them labeled, times the old
+list-and-scan selection against `next_image_name` (leasing included, file
+streaming not), and reports the one-off index build at startup.
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PIL import Image
+
+import server
+from server import server_state
+
+
+def old_next(user, in_progress):
+    """The selection next_image used before the WorkQueue: list both folders on every call."""
+    completed = {os.path.splitext(f)[0] for f in os.listdir(server_state.label_folder) if f.endswith(".txt")}
+    assigned = set(in_progress.values())
+    selected = None
+    for img in os.listdir(server_state.image_folder):
+        if img.lower().endswith(server.IMAGE_EXTENSIONS) and os.path.splitext(img)[0] not in completed and img not in assigned:
+            selected = img
+            break
+    in_progress[user] = selected
+
+
+def make_pool(n):
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buf, "PNG")
+    folder = tempfile.mkdtemp()
+    server_state.set_folder(folder)
+    for i in range(n):
+        with open(os.path.join(folder, f"img{i:06d}.png"), "wb") as f:
+            f.write(buf.getvalue())
+    for i in range(n // 2):
+        with open(os.path.join(server_state.label_folder, f"img{i:06d}.txt"), "w") as f:
+            f.write("cat 0.5 0.5 0.1 0.1\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+    server_state.log = lambda message: None
+
+    for n in args.sizes:
+        make_pool(n)
+        in_progress, k = {}, 20
+        t = time.perf_counter()
+        for i in range(k):
+            old_next(f"u{i}", in_progress)
+        before = (time.perf_counter() - t) / k
+
+        t = time.perf_counter()
+        server_state.labels = server.FileLabelStore()
+        server_state.labels.open(server_state.label_folder)
+        server_state.image_index.open(server_state.image_folder, os.path.join(server_state.label_folder, ".cache", "image_index.sqlite"))
+        server_state.work_queue.start(server_state.image_folder, server_state.label_folder)
+        server_state.leases.start()
+        startup = time.perf_counter() - t
+
+        t = time.perf_counter()
+        for i in range(args.calls):
+            server.next_image_name(f"u{i}")
+        after = (time.perf_counter() - t) / args.calls
+        server_state.work_queue.stop()
+        server_state.leases.stop()
+        print(f"N={n:>7}: before {before * 1000:8.3f} ms/call   after {after * 1000:7.4f} ms/call   "
+              f"(one-off index {startup * 1000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,653 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog, ttk
 from PIL import Image, ImageTk
 import requests
+import geometry
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlencode
+from collections import OrderedDict, deque
+import gzip
+import hashlib
 import io
 import json
+import math
 import os
+import queue
+import threading
+import time
+
+DUPLICATE_IOU = 0.7 # a prediction overlapping an existing box this much is not added again
+
+class Transport:
+    """One pooled HTTP session shared by every client call.
+
+    Connections are kept alive across the requests made per image, each
+    endpoint gets its own timeout, idempotent GETs are retried with backoff,
+    label submissions are gzipped and every request's latency is recorded.
+    """
+    TIMEOUTS = {"": 3, "heartbeat": 3, "release": 2, "get_current_labels": 10, "next_batch": 10,
+                "submit_label": 15, "next_image": 30, "get_image_specific": 30, "predict": 60}
+
+    def __init__(self, server_url, pool_size=8):
+        self.server_url = server_url
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=frozenset(["GET"]))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.latency = {} # endpoint -> deque of seconds
+
+    def request(self, method, endpoint, gzip_data=False, **kwargs):
+        kwargs.setdefault("timeout", self.TIMEOUTS.get(endpoint, 10))
+        if gzip_data:
+            kwargs["data"] = gzip.compress(urlencode(kwargs["data"]).encode(), compresslevel=5)
+            kwargs["headers"] = {**kwargs.get("headers", {}), "Content-Encoding": "gzip",
+                                 "Content-Type": "application/x-www-form-urlencoded"}
+        start = time.perf_counter()
+        try:
+            return self.session.request(method, f"{self.server_url}/{endpoint}", **kwargs)
+        finally:
+            with self.lock:
+                self.latency.setdefault(endpoint or "health", deque(maxlen=200)).append(time.perf_counter() - start)
+
+    def get(self, endpoint, **kwargs):
+        return self.request("GET", endpoint, **kwargs)
+
+    def post(self, endpoint, **kwargs):
+        return self.request("POST", endpoint, **kwargs)
+
+    def latency_summary(self):
+        """Median / p90 latency in ms per endpoint, slowest first."""
+        with self.lock:
+            samples = {k: sorted(v) for k, v in self.latency.items() if v}
+        rows = [(k, v[len(v) // 2] * 1000, v[int(len(v) * 0.9)] * 1000, len(v)) for k, v in samples.items()]
+        return sorted(rows, key=lambda r: -r[1])
+
+    def close(self):
+        self.session.close()
+
+class ImagePrefetcher:
+    """Background thread that keeps a bounded queue of decoded images ready.
+
+    It leases a batch through `/next_batch` (metadata, labels and cached
+    predictions in one response), downloads and decodes the images it has not
+    queued yet, and blocks once `depth` images are waiting.
+    """
+    def __init__(self, transport, user_name, cache, depth=3, max_side=0):
+        self.transport = transport
+        self.cache = cache
+        self.user_name = user_name
+        self.depth = depth
+        self.max_side = max_side
+        self.queue = queue.Queue(maxsize=depth)
+        self.seen = set()
+        self.done = threading.Event()
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get_nowait(self):
+        return self.queue.get_nowait()
+
+    def pending_names(self):
+        return [item["image_name"] for item in list(self.queue.queue)]
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.queue.full():
+                self._stop.wait(0.05)
+                continue
+            try:
+                # +2: the image on screen and the one being submitted still hold leases
+                resp = self.transport.get("next_batch", params={"user_name": self.user_name, "k": self.depth + 2})
+                data = resp.json()
+            except Exception as e:
+                print(f"Prefetch error: {e}")
+                self._stop.wait(2)
+                continue
+
+            if data.get("status") != "ok":
+                if data.get("status") == "done": self.done.set()
+                self._stop.wait(2)
+                continue
+            self.done.clear()
+
+            fresh = [item for item in data["images"] if item["image_name"] not in self.seen]
+            if not fresh:
+                self._stop.wait(0.5)
+                continue
+            for item in fresh:
+                if self._stop.is_set(): return
+                try:
+                    _, image, _ = self.cache.download(self.transport, "get_image_specific", {"filename": item["image_name"], "max_side": self.max_side})
+                except Exception as e:
+                    print(f"Prefetch error for {item['image_name']}: {e}")
+                    break
+                item["image"] = image
+                self.cache.put(item["image_name"], image, (item["width"], item["height"]), item["labels"])
+                self.cache.prepare(item["image_name"])
+                self.seen.add(item["image_name"])
+                while not self._stop.is_set():
+                    try:
+                        self.queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+
+class DiskImageCache:
+    """Encoded image files as the server sent them, with their ETag and original size.
+
+    Keyed by image name and rendition size; the folder is trimmed back to
+    `max_bytes` by evicting the least recently used files.
+    """
+    def __init__(self, folder, max_bytes=2 * 1024 ** 3):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+        self.lock = threading.Lock()
+        entries = sorted((f.stat().st_mtime, f.name[:-4], f.stat().st_size) for f in os.scandir(folder) if f.name.endswith(".img"))
+        self.files = OrderedDict((key, size) for _, key, size in entries) # key -> bytes, least recently used first
+        self.total = sum(self.files.values())
+
+    def _key(self, image_name, max_side):
+        return hashlib.sha1(f"{image_name}\0{max_side}".encode()).hexdigest()
+
+    def lookup(self, image_name, max_side):
+        """{"key", "etag", "width", "height"} of the stored copy, or None."""
+        key = self._key(image_name, max_side)
+        try:
+            with open(os.path.join(self.folder, key + ".json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self.lock:
+            if key not in self.files: return None
+            self.files.move_to_end(key)
+        return dict(meta, key=key)
+
+    def read(self, meta):
+        path = os.path.join(self.folder, meta["key"] + ".img")
+        os.utime(path)
+        with open(path, "rb") as f:
+            return f.read()
+
+    def store(self, image_name, max_side, data, etag, width, height):
+        key = self._key(image_name, max_side)
+        path = os.path.join(self.folder, key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path + ".img")
+        with open(tmp, "w") as f:
+            json.dump({"etag": etag, "width": width, "height": height}, f)
+        os.replace(tmp, path + ".json")
+        with self.lock:
+            self.total += len(data) - self.files.pop(key, 0)
+            self.files[key] = len(data)
+            while self.total > self.max_bytes and len(self.files) > 1:
+                old, size = self.files.popitem(last=False)
+                self.total -= size
+                for ext in (".img", ".json"):
+                    try: os.remove(os.path.join(self.folder, old + ext))
+                    except OSError: pass
+
+class ImageCache:
+    """Decoded images, their zoom pyramids and display-size copies, and label state for recently visited images.
+
+    Bounded by the bytes of decoded pixels (default: an eighth of physical
+    memory, at most 1 GB), least recently used out first, so walking back and
+    forth through the history window needs no network. With a `disk` cache a
+    miss becomes a conditional GET that the server can answer with 304.
+    """
+    def __init__(self, max_bytes=None, disk=None):
+        self.max_bytes = max_bytes or self.default_budget()
+        self.disk = disk
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # image_name -> {"image", "size", "levels", "display", "labels", "submitted", "bytes"}
+        self.total = 0
+        self.hits = self.misses = 0
+        self.canvas_size = None # set by the Tk thread, so display copies can be made ahead of time elsewhere
+
+    @staticmethod
+    def default_budget():
+        try:
+            return min(1024 ** 3, os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 8)
+        except (AttributeError, ValueError, OSError):
+            return 512 * 1024 ** 2
+
+    @staticmethod
+    def nbytes(image):
+        return image.width * image.height * len(image.getbands()) if image is not None else 0
+
+    @staticmethod
+    def fit(size, canvas_size):
+        """Scale and pixel size of an image of original `size` fitted into the canvas."""
+        ratio = min(canvas_size[0] / size[0], canvas_size[1] / size[1])
+        return ratio, (max(1, int(size[0] * ratio)), max(1, int(size[1] * ratio)))
+
+    def _evict(self):
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.total -= entry["bytes"]
+
+    def get(self, image_name):
+        with self.lock:
+            entry = self.entries.get(image_name)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(image_name)
+            return entry
+
+    def put(self, image_name, image, size, labels):
+        entry = {"image": image, "size": size, "levels": None, "display": None, "labels": list(labels), "submitted": None, "bytes": self.nbytes(image)}
+        with self.lock:
+            old = self.entries.pop(image_name, None)
+            if old is not None:
+                self.total -= old["bytes"]
+                entry["submitted"] = old["submitted"]
+            self.entries[image_name] = entry
+            self.total += entry["bytes"]
+            self._evict()
+
+    def set_labels(self, image_name, labels, submitted=False):
+        with self.lock:
+            entry = self.entries.get(image_name)
+            if entry is not None:
+                entry["labels"] = list(labels)
+                if submitted: entry["submitted"] = entry["labels"]
+
+    def submitted(self, image_name):
+        """The labels last sent for this image, or None."""
+        with self.lock:
+            entry = self.entries.get(image_name)
+            return entry["submitted"] if entry else None
+
+    def display(self, image_name, image, target):
+        """`image` resized to `target` pixels, reusing the copy made for the last visit or by `prepare`."""
+        with self.lock:
+            entry = self.entries.get(image_name)
+            if entry and entry["image"] is image and entry["display"] is not None and entry["display"].size == target:
+                return entry["display"]
+        resized = image.resize(target, Image.Resampling.LANCZOS)
+        with self.lock:
+            if entry and self.entries.get(image_name) is entry:
+                entry["bytes"] += self.nbytes(resized) - self.nbytes(entry["display"])
+                self.total += self.nbytes(resized) - self.nbytes(entry["display"])
+                entry["display"] = resized
+                self._evict()
+        return resized
+
+    def levels(self, image_name, image):
+        """The zoom pyramid of `image`, kept with its entry."""
+        with self.lock:
+            entry = self.entries.get(image_name)
+            if entry and entry["image"] is image and entry["levels"]:
+                return entry["levels"]
+        levels = Viewport.pyramid(image)
+        with self.lock:
+            if entry and self.entries.get(image_name) is entry and not entry["levels"]:
+                added = sum(self.nbytes(level) for level in levels[1:])
+                entry["levels"] = levels
+                entry["bytes"] += added
+                self.total += added
+                self._evict()
+        return levels
+
+    def prepare(self, image_name):
+        """Makes the pyramid and the display copy for the current canvas size, off the Tk thread."""
+        with self.lock:
+            entry = self.entries.get(image_name)
+            canvas_size = self.canvas_size
+        if entry:
+            self.levels(image_name, entry["image"])
+        if entry and canvas_size:
+            self.display(image_name, entry["image"], self.fit(entry["size"], canvas_size)[1])
+
+    def download(self, transport, endpoint, params):
+        """GETs an image endpoint, revalidating the disk copy by ETag when there is one.
+
+        Returns (image_name, image, (width, height)), or the server's JSON reply when it sent no image.
+        """
+        name, max_side = params.get("filename"), params.get("max_side", 0)
+        cached = self.disk.lookup(name, max_side) if self.disk and name else None
+        resp = transport.get(endpoint, params=params, headers={"If-None-Match": cached["etag"]} if cached else {})
+        if resp.status_code == 304 and cached:
+            data, width, height = self.disk.read(cached), cached["width"], cached["height"]
+        elif resp.headers.get("content-type") == "application/json":
+            return resp.json()
+        else:
+            data = resp.content
+            name = resp.headers.get("filename", name or "unknown.jpg")
+            width, height = int(resp.headers.get("X-Image-Width", 0)), int(resp.headers.get("X-Image-Height", 0))
+            if self.disk and resp.headers.get("ETag"):
+                self.disk.store(name, max_side, data, resp.headers["ETag"], width, height)
+        image = Image.open(io.BytesIO(data))
+        image.load() # decode here, not on the Tk thread
+        return name, image, (width or image.width, height or image.height)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.total, "hits": self.hits, "misses": self.misses}
+
+class Viewport:
+    """Zoom and pan state of the canvas, and rendering of the visible part of the image.
+
+    Coordinates are original-image pixels: `scale` is screen pixels per image
+    pixel and `offset_x/offset_y` is where the image origin lands on the
+    canvas. The source is a pyramid of successive halvings, so a render
+    resamples only the visible region of the smallest level that still has
+    at least one pixel per screen pixel.
+    """
+    MAX_SCALE = 16 # screen pixels per image pixel at the deepest zoom
+    MIN_LEVEL_SIDE = 256
+
+    def __init__(self):
+        self.image_size = (1, 1)
+        self.canvas_size = (1, 1)
+        self.levels = []
+        self.scale = 1.0
+        self.offset_x = self.offset_y = 0.0
+        self.fitted = True
+
+    @classmethod
+    def pyramid(cls, image):
+        levels = [image]
+        while max(levels[-1].size) // 2 >= cls.MIN_LEVEL_SIDE:
+            levels.append(levels[-1].reduce(2)) # box filter, a few ms even for large images
+        return levels
+
+    def set_source(self, levels, image_size):
+        self.levels = levels
+        self.image_size = image_size
+
+    def fit_scale(self):
+        return min(self.canvas_size[0] / self.image_size[0], self.canvas_size[1] / self.image_size[1])
+
+    def fit(self):
+        self.scale = self.fit_scale()
+        self.offset_x = (self.canvas_size[0] - self.image_size[0] * self.scale) // 2
+        self.offset_y = (self.canvas_size[1] - self.image_size[1] * self.scale) // 2
+        self.fitted = True
+
+    def resize(self, canvas_size):
+        """Keeps a fitted view fitted, and otherwise the image point at the canvas centre where it is."""
+        cx, cy = self.screen_to_image(self.canvas_size[0] / 2, self.canvas_size[1] / 2)
+        self.canvas_size = canvas_size
+        if self.fitted or self.scale < self.fit_scale():
+            self.fit()
+            return
+        self.offset_x = canvas_size[0] / 2 - cx * self.scale
+        self.offset_y = canvas_size[1] / 2 - cy * self.scale
+        self._clamp()
+
+    def zoom_at(self, sx, sy, factor):
+        """Zooms by `factor` keeping the image point under (sx, sy) in place."""
+        scale = min(max(self.scale * factor, self.fit_scale()), self.MAX_SCALE)
+        if scale <= self.fit_scale():
+            self.fit()
+            return
+        ix, iy = self.screen_to_image(sx, sy)
+        self.scale = scale
+        self.offset_x, self.offset_y = sx - ix * scale, sy - iy * scale
+        self.fitted = False
+        self._clamp()
+
+    def pan(self, dx, dy):
+        if self.fitted: return
+        self.offset_x += dx
+        self.offset_y += dy
+        self._clamp()
+
+    def _clamp(self):
+        """No empty margin on an axis where the image is larger than the canvas; centred where it is smaller."""
+        for axis in (0, 1):
+            view, size = self.canvas_size[axis], self.image_size[axis] * self.scale
+            offset = (view - size) / 2 if size <= view else min(0, max(view - size, self.offset_y if axis else self.offset_x))
+            if axis: self.offset_y = offset
+            else: self.offset_x = offset
+
+    def screen_to_image(self, sx, sy): return (sx - self.offset_x) / self.scale, (sy - self.offset_y) / self.scale
+    def image_to_screen(self, ix, iy): return ix * self.scale + self.offset_x, iy * self.scale + self.offset_y
+
+    def needs_more_pixels(self):
+        """True when the user has zoomed in past the largest level's resolution.
+
+        A fitted view never asks for more, even on a canvas larger than the
+        rendition; the original is only worth downloading once zoomed.
+        """
+        return bool(self.levels) and not self.fitted and self.scale * self.image_size[0] / self.levels[0].width > 1.01
+
+    def render(self, fast):
+        """(image, x, y) covering the visible part of the canvas, or None if the image is out of view.
+
+        `fast` trades the LANCZOS filter for NEAREST while the user is zooming,
+        panning or resizing (the level is at most 2x the screen size, so this
+        stays readable); magnified pixels are always drawn NEAREST.
+        """
+        W, H = self.image_size
+        sx0, sy0 = max(0, math.floor(self.offset_x)), max(0, math.floor(self.offset_y))
+        sx1 = min(self.canvas_size[0], math.ceil(self.offset_x + W * self.scale))
+        sy1 = min(self.canvas_size[1], math.ceil(self.offset_y + H * self.scale))
+        if sx1 <= sx0 or sy1 <= sy0 or not self.levels: return None
+        level = self.levels[0]
+        for candidate in self.levels[1:]:
+            if self.scale * W / candidate.width > 1: break
+            level = candidate
+        fx, fy = W / level.width, H / level.height
+        (ix0, iy0), (ix1, iy1) = self.screen_to_image(sx0, sy0), self.screen_to_image(sx1, sy1)
+        box = (max(0, ix0 / fx), max(0, iy0 / fy), min(level.width, ix1 / fx), min(level.height, iy1 / fy))
+        resample = Image.Resampling.NEAREST if fast or self.scale * fx > 2 else Image.Resampling.LANCZOS
+        return level.resize((sx1 - sx0, sy1 - sy0), resample, box=box), sx0, sy0
+
+class BoxLayer:
+    """Retained canvas items for the boxes of the image on screen, and a grid index for hit-testing.
+
+    Every box keeps its rectangle and caption item for as long as it exists;
+    a redraw moves them and restyles only what changed, and a drag moves the
+    items of the one box being edited. The grid buckets boxes by the
+    image-space cells they overlap, so a hit-test looks at the few boxes near
+    the cursor instead of all of them.
+    """
+    FONT = ("Arial", 10, "bold")
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.items = [] # per box index: [rect id, text id, style]
+        self.source = None # the box list the index was built from
+        self.cell = 64.0
+        self.grid = {} # (cx, cy) -> set of box indices
+        self.cells_of = [] # per box index: the cells it is filed under
+
+    def _cells(self, box):
+        c = self.cell
+        return [(cx, cy) for cx in range(int(box[0] // c), int(box[2] // c) + 1)
+                         for cy in range(int(box[1] // c), int(box[3] // c) + 1)]
+
+    def _file(self, i, box):
+        cells = self._cells(box)
+        for key in cells:
+            self.grid.setdefault(key, set()).add(i)
+        return cells
+
+    def reindex(self, boxes, image_size):
+        """Rebuilds the grid; needed whenever boxes are added, removed or the list is replaced."""
+        self.source = boxes
+        self.cell = max(32.0, max(image_size) / 32) # about 32x32 cells per image
+        self.grid = {}
+        self.cells_of = [self._file(i, box) for i, (_, box) in enumerate(boxes)]
+
+    def sync_index(self, boxes, image_size):
+        if boxes is not self.source or len(boxes) != len(self.cells_of):
+            self.reindex(boxes, image_size)
+
+    def candidates(self, x, y, pad=0):
+        """Indices of the boxes filed within `pad` image pixels of (x, y), in ascending order."""
+        c, found = self.cell, set()
+        for cx in range(int((x - pad) // c), int((x + pad) // c) + 1):
+            for cy in range(int((y - pad) // c), int((y + pad) // c) + 1):
+                found.update(self.grid.get((cx, cy), ()))
+        return sorted(found)
+
+    def place(self, i, label, box, view, color, selected):
+        rect, text, style = self.items[i]
+        x1, y1 = view.image_to_screen(box[0], box[1])
+        x2, y2 = view.image_to_screen(box[2], box[3])
+        self.canvas.coords(rect, x1, y1, x2, y2)
+        self.canvas.coords(text, x1, y1 - 12)
+        if style != (label, color, selected):
+            self.canvas.itemconfig(rect, outline=color, width=3 if selected else 2, dash=(4, 2) if selected else "")
+            self.canvas.itemconfig(text, text=label, fill=color)
+            self.items[i][2] = (label, color, selected)
+
+    def draw(self, boxes, view, colors, selected=None, image_size=(1, 1)):
+        """Brings the items in line with `boxes`, creating or deleting only the difference in count."""
+        self.sync_index(boxes, image_size)
+        for i, (label, box) in enumerate(boxes):
+            if i == len(self.items):
+                self.items.append([self.canvas.create_rectangle(0, 0, 0, 0, tags="bbox"),
+                                   self.canvas.create_text(0, 0, anchor=tk.SW, font=self.FONT, tags="bbox"), None])
+            self.place(i, label, box, view, colors.get(label, "red"), selected == i)
+        for rect, text, _ in self.items[len(boxes):]:
+            self.canvas.delete(rect, text)
+        del self.items[len(boxes):]
+
+    def move(self, i, label, box, view, color, selected):
+        """One box changed geometry: move its items and refile it in the grid."""
+        for key in self.cells_of[i]:
+            self.grid[key].discard(i)
+        self.cells_of[i] = self._file(i, box)
+        self.place(i, label, box, view, color, selected)
+
+class NetworkWorker:
+    """Runs blocking network calls off the Tk thread.
+
+    `submit(fn, on_done, on_error)` queues `fn`; its result (or exception) is
+    handed back on the Tk thread through `root.after`.
+    """
+    def __init__(self, root, threads=2):
+        self.root = root
+        self.tasks = queue.Queue()
+        for _ in range(threads):
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, fn, on_done=None, on_error=None):
+        self.tasks.put((fn, on_done, on_error))
+
+    def _run(self):
+        while True:
+            fn, on_done, on_error = self.tasks.get()
+            try:
+                result = fn()
+            except Exception as e:
+                if on_error: self.root.after(0, on_error, e)
+                else: print(f"Network error: {e}")
+                continue
+            if on_done: self.root.after(0, on_done, result)
+
+class SubmissionOutbox:
+    """Durable, ordered queue of label submissions.
+
+    Every submission is written to its own file before it is sent. A sender
+    thread posts them oldest first and deletes a file only once the server
+    accepted it; network and server errors are retried with backoff, and
+    submissions the server rejects are moved to `failed/` and reported.
+    """
+    def __init__(self, folder, transport, on_status=None):
+        self.folder = folder
+        self.failed_folder = os.path.join(folder, "failed")
+        os.makedirs(self.failed_folder, exist_ok=True)
+        self.transport = transport
+        self.on_status = on_status
+        self.lock = threading.Lock()
+        self.pending = {} # image_name -> number of queued submissions
+        self.seq = 0
+        for fname in self._files():
+            self.seq = max(self.seq, int(fname.split(".")[0]))
+            with open(os.path.join(self.folder, fname)) as f:
+                name = json.load(f)["image_name"]
+            self.pending[name] = self.pending.get(name, 0) + 1
+        self.wakeup = threading.Event()
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _files(self):
+        return sorted(f for f in os.listdir(self.folder) if f.endswith(".json"))
+
+    def put(self, payload):
+        with self.lock:
+            self.seq += 1
+            path = os.path.join(self.folder, f"{self.seq:010d}.json")
+            with open(path + ".tmp", "w") as f:
+                json.dump(payload, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            self.pending[payload["image_name"]] = self.pending.get(payload["image_name"], 0) + 1
+        self.wakeup.set()
+
+    def is_pending(self, image_name):
+        with self.lock:
+            return image_name in self.pending
+
+    def size(self):
+        with self.lock:
+            return sum(self.pending.values())
+
+    def stop(self):
+        self._stop.set()
+        self.wakeup.set()
+
+    def _done(self, fname, payload, failed=False):
+        path = os.path.join(self.folder, fname)
+        if failed: os.replace(path, os.path.join(self.failed_folder, fname))
+        else: os.remove(path)
+        with self.lock:
+            name = payload["image_name"]
+            self.pending[name] -= 1
+            if not self.pending[name]: del self.pending[name]
+
+    def _report(self, message):
+        if self.on_status: self.on_status(message)
+
+    def _run(self):
+        backoff = 1
+        while not self._stop.is_set():
+            files = self._files()
+            if not files:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            fname = files[0]
+            with open(os.path.join(self.folder, fname)) as f:
+                payload = json.load(f)
+            try:
+                resp = self.transport.post("submit_label", data=payload, gzip_data=True)
+                if 400 <= resp.status_code < 500:
+                    rejected = True # also when the body is not JSON, e.g. from a proxy
+                else:
+                    rejected = resp.status_code < 500 and resp.json().get("status") != "success"
+                if rejected:
+                    # The server will never accept this one; keep it, but stop retrying
+                    self._done(fname, payload, failed=True)
+                    self._report(f"Submission for {payload['image_name']} rejected: {resp.text[:200]}")
+                    continue
+                resp.raise_for_status()
+            except Exception as e:
+                self._report(f"Submit failed, retrying in {backoff}s ({self.size()} queued): {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            if backoff > 1: self._report(f"Server reachable again, {self.size() - 1} submissions still queued")
+            backoff = 1
+            self._done(fname, payload)
 
 class NetworkClientApp:
     def __init__(self, root):
@@ -14,6 +658,7 @@ class NetworkClientApp:
         
         # --- Network State ---
         self.server_url = ""
+        self.transport = None
         self.user_name = ""
         self.current_image_name = None
         self.is_connected = False
@@ -28,6 +673,10 @@ class NetworkClientApp:
         self.label_list = ["object"]
         self.label_colors = {"object": "#FF0000"}
         self.raw_image = None
+        self.image_size = (1, 1) # original size on the server; labels use these pixel coordinates
+        self.max_side = 1600 # long edge of the rendition the server sends us (0 = original file)
+        self.disk_cache_bytes = 2 * 1024 ** 3 # encoded images kept on disk across restarts (0 = off)
+        self.image_cache = ImageCache()
         
         # Interaction State
         self.edit_mode = False
@@ -39,16 +688,28 @@ class NetworkClientApp:
             "resize_handle": None # 'tl', 'tr', 'bl', 'br'
         }
         
-        self.scale_factor = 1.0
-        self.offset_x = 0
-        self.offset_y = 0
+        self.view = Viewport()
+        self.image_item = None # canvas item showing the rendered view, reused across renders
+        self._fast_job = self._hq_job = None
+        self.pan_start = None
+        self.full_res_for = None # image whose original file has been requested for deep zoom
         self.selected_bbox_index = None
 
         self.auto_label_enabled = False
 
+        self.heartbeat_interval = 60000 # ms, server lease TTL is a few minutes
+        self.prefetcher = None
+        self.waiting_for_image = False
+        self.outbox = None
+        self.worker = NetworkWorker(root)
+        self.nav_token = 0 # identifies the latest navigation request; older replies are dropped
+
         self.setup_ui()
         self.setup_bindings()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         self.root.after(100, self.connect_dialog)
+        self.root.after(self.heartbeat_interval, self.send_heartbeat)
+        self.root.after(5000, self.update_net_stats)
 
     def setup_ui(self):
         self.main_container = tk.Frame(self.root)
@@ -62,6 +723,8 @@ class NetworkClientApp:
 
         self.canvas = tk.Canvas(self.center_pane, bg="#2e2e2e", highlightthickness=0)
         self.canvas.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.box_layer = BoxLayer(self.canvas)
+        self.crosshair = None # the two guide lines, moved on every motion event
 
         self.status_var = tk.StringVar(value="Not Connected")
         self.status_bar = tk.Label(self.root, textvariable=self.status_var, bd=1, relief=tk.SUNKEN, anchor=tk.W)
@@ -103,8 +766,13 @@ class NetworkClientApp:
         self.next_btn = tk.Button(nav_frame, text="Next (D) >", command=self.submit_and_next, bg="#90ee90", state=tk.DISABLED)
         self.next_btn.pack(side=tk.RIGHT, expand=True, fill=tk.X, padx=2)
         
+        tk.Label(self.sidebar, text="Network (median / p90)", font=("Arial", 9, "bold"), bg="#f0f0f0").pack(pady=(10, 0))
+        self.net_lbl = tk.Label(self.sidebar, text="", fg="gray", bg="#f0f0f0", justify=tk.LEFT, font=("Courier", 8))
+        self.net_lbl.pack(padx=10, anchor="w")
+
         self.mode_label = tk.Label(self.sidebar, text="Hold Ctrl to Edit/Resize", fg="gray", bg="#f0f0f0")
         self.mode_label.pack(side=tk.BOTTOM, pady=10)
+        tk.Label(self.sidebar, text="Wheel: zoom, middle drag: pan, F: fit", fg="gray", bg="#f0f0f0").pack(side=tk.BOTTOM)
 
     def setup_bindings(self):
         self.canvas.bind("<ButtonPress-1>", self.on_mouse_down)
@@ -113,6 +781,12 @@ class NetworkClientApp:
         self.canvas.bind("<Motion>", self.on_mouse_move)
         self.canvas.bind("<Button-3>", self.on_right_click)
         self.canvas.bind("<Configure>", self.on_resize)
+        self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-4>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-5>", self.on_mouse_wheel)
+        self.canvas.bind("<ButtonPress-2>", self.on_pan_start)
+        self.canvas.bind("<B2-Motion>", self.on_pan_drag)
+        self.root.bind("<f>", self.fit_view)
         
         self.root.bind("<Control_L>", self.enable_edit_mode)
         self.root.bind("<KeyRelease-Control_L>", self.disable_edit_mode)
@@ -129,156 +803,309 @@ class NetworkClientApp:
         if not user: return
         self.server_url = f"http://{ip}:8000"
         self.user_name = user
-        try:
-            resp = requests.get(f"{self.server_url}/", timeout=3)
-            if resp.status_code == 200:
-                self.is_connected = True
-                self.user_lbl.config(text=f"User: {self.user_name}", fg="green")
-                self.status_var.set("Connected.")
-                self.next_btn.config(state=tk.NORMAL)
-                self.load_next_image()
-            else: messagebox.showerror("Error", "Server error.")
-        except: messagebox.showerror("Error", "Connection Failed.")
+        if self.transport: self.transport.close()
+        self.transport = Transport(self.server_url)
+        self.status_var.set("Connecting...")
+        self.worker.submit(lambda: self.transport.get(""),
+                           self.on_connected, lambda e: messagebox.showerror("Error", "Connection Failed."))
+
+    def on_connected(self, resp):
+        if resp.status_code != 200:
+            messagebox.showerror("Error", "Server error.")
+            return
+        self.is_connected = True
+        self.user_lbl.config(text=f"User: {self.user_name}", fg="green")
+        self.status_var.set("Connected.")
+        self.next_btn.config(state=tk.NORMAL)
+        if self.outbox: self.outbox.stop()
+        host = self.server_url.split("//")[1].replace(":", "_")
+        outbox_dir = os.path.join(os.path.expanduser("~"), ".yolo_team_labeler", "outbox", f"{host}_{self.user_name}")
+        self.outbox = SubmissionOutbox(outbox_dir, self.transport, on_status=lambda m: self.root.after(0, self.status_var.set, m))
+        if self.outbox.size(): self.status_var.set(f"Resending {self.outbox.size()} queued submissions...")
+        cache_dir = os.path.join(os.path.expanduser("~"), ".yolo_team_labeler", "cache", host)
+        self.image_cache = ImageCache(disk=DiskImageCache(cache_dir, self.disk_cache_bytes) if self.disk_cache_bytes else None)
+        if self.prefetcher: self.prefetcher.stop()
+        self.prefetcher = ImagePrefetcher(self.transport, self.user_name, self.image_cache, max_side=self.max_side)
+        self.prefetcher.start()
+        self.sync_classes()
+        self.load_next_image()
+
+    def sync_classes(self):
+        """Takes the class list (and its order) from the server's registry."""
+        def done(data):
+            server_names = [c["name"] for c in data.get("classes", [])]
+            self.label_list = server_names + [l for l in self.label_list if l not in server_names and not data.get("strict")]
+            for name in self.label_list:
+                if name not in self.label_colors: self.label_colors[name] = self.get_random_color()
+            self.update_label_listbox()
+        self.worker.submit(lambda: self.transport.get("classes").json(), done, lambda e: print(f"Class sync failed: {e}"))
+
+    def update_net_stats(self):
+        if self.transport:
+            rows = self.transport.latency_summary()[:4]
+            c = self.image_cache.stats()
+            self.net_lbl.config(text="\n".join([f"{name}: {med:.0f} / {p90:.0f} ms" for name, med, p90, _ in rows]
+                                               + [f"cache: {c['entries']} img, {c['bytes'] >> 20} MB, {c['hits']}/{c['hits'] + c['misses']} hits"]))
+        self.root.after(5000, self.update_net_stats)
+
+    def send_heartbeat(self):
+        """Keeps the server-side leases of this user alive while the client is open."""
+        if self.is_connected:
+            def beat():
+                return self.transport.post("heartbeat", data={"user_name": self.user_name}).json()
+            def done(data):
+                if data.get("ttl"): self.heartbeat_interval = max(5000, int(data["ttl"] * 1000 / 3))
+            self.worker.submit(beat, done, lambda e: print(f"Heartbeat failed: {e}"))
+        self.root.after(self.heartbeat_interval, self.send_heartbeat)
+
+    def on_close(self):
+        # Hand the unfinished image back instead of waiting for the lease to expire
+        if self.is_connected:
+            unfinished = [self.current_image_name] if self.current_image_name else []
+            if self.prefetcher:
+                self.prefetcher.stop()
+                unfinished += self.prefetcher.pending_names()
+            for name in unfinished:
+                if self.outbox and self.outbox.is_pending(name): continue # finished, just not delivered yet
+                try: self.transport.post("release", data={"image_name": name, "user_name": self.user_name})
+                except Exception: pass
+        self.root.destroy()
 
     def fetch_image_and_labels(self, endpoint, params={}):
-        try:
-            self.status_var.set("Fetching...")
-            self.root.update_idletasks()
-            resp = requests.get(f"{self.server_url}/{endpoint}", params=params)
-            
-            if resp.headers.get("content-type") == "application/json":
-                data = resp.json()
-                if data.get("status") == "done":
-                    messagebox.showinfo("Done", "No more images!")
-                    return False
-                return False
-
-            self.current_image_name = resp.headers.get("filename", "unknown.jpg")
-            image_data = resp.content
-            self.raw_image = Image.open(io.BytesIO(image_data))
-            self.labels[self.current_image_name] = []
-            
-            lbl_resp = requests.get(f"{self.server_url}/get_current_labels", params={"image_name": self.current_image_name})
+        self.nav_token += 1
+        token = self.nav_token
+        self.status_var.set("Fetching...")
+
+        def fetch():
+            result = self.image_cache.download(self.transport, endpoint, {**params, "max_side": self.max_side})
+            if isinstance(result, dict):
+                return result
+            image_name, image, size = result
+            labels = []
+            lbl_resp = self.transport.get("get_current_labels", params={"image_name": image_name})
             if lbl_resp.status_code == 200:
-                server_labels = lbl_resp.json().get("labels", [])
-                for cls, box in server_labels:
-                    if cls not in self.label_list:
-                        self.label_list.append(cls)
-                        self.label_colors[cls] = self.get_random_color()
-                    self.labels[self.current_image_name].append((cls, box))
-                self.update_label_listbox()
-            
-            self.display_image()
-            if self.auto_label_enabled and not self.labels[self.current_image_name]:
-                self.run_server_inference()
-            self.status_var.set(f"Labeling: {self.current_image_name}")
-            return True
-        except Exception as e:
-            messagebox.showerror("Error", f"Network Error: {e}")
-            return False
+                labels = lbl_resp.json().get("labels", [])
+            self.image_cache.put(image_name, image, size, labels)
+            self.image_cache.prepare(image_name)
+            return image_name, image, labels, size
+
+        def done(result):
+            if token != self.nav_token: return
+            if isinstance(result, dict):
+                if result.get("status") == "done": messagebox.showinfo("Done", "No more images!")
+                else: self.status_var.set(f"Server: {result.get('message', result)}")
+                return
+            image_name, image, labels, size = result
+            if self.outbox and self.outbox.is_pending(image_name):
+                # Our own edits have not reached the server yet; they are newer than its copy
+                labels = self.labels.get(image_name, labels)
+            self.show_image(image_name, image, labels, size=size)
+
+        def failed(e):
+            if token == self.nav_token: messagebox.showerror("Error", f"Network Error: {e}")
+
+        self.worker.submit(fetch, done, failed)
+
+    def show_image(self, image_name, image, labels, predictions=None, size=None):
+        self.current_image_name = image_name
+        self.raw_image = image
+        self.image_size = size or image.size
+        self.labels[image_name] = []
+        for cls, box in labels:
+            if cls not in self.label_list:
+                self.label_list.append(cls)
+                self.label_colors[cls] = self.get_random_color()
+            self.labels[image_name].append((cls, box))
+        self.image_cache.set_labels(image_name, self.labels[image_name])
+        self.update_label_listbox()
+
+        self.view.set_source(self.image_cache.levels(image_name, image), self.image_size)
+        self.view.fit()
+        self.full_res_for = None
+        self.display_image()
+        if self.auto_label_enabled and not self.labels[image_name]:
+            if predictions is not None: self.apply_predictions(predictions)
+            else: self.run_server_inference()
+        self.status_var.set(f"Labeling: {image_name}")
 
     def load_next_image(self):
         if not self.is_connected: return
-        success = self.fetch_image_and_labels("next_image", {"user_name": self.user_name})
-        if success:
-            if not self.image_history or self.image_history[-1] != self.current_image_name:
-                self.image_history.append(self.current_image_name)
-                self.history_index = len(self.image_history) - 1
-            self.update_nav_buttons()
+        try:
+            item = self.prefetcher.get_nowait()
+        except queue.Empty:
+            if self.prefetcher.done.is_set():
+                self.waiting_for_image = False
+                messagebox.showinfo("Done", "No more images!")
+                return
+            # Poll instead of blocking the Tk loop until the prefetcher catches up
+            self.waiting_for_image = True
+            self.status_var.set("Fetching...")
+            self.root.after(50, self.load_next_image)
+            return
+        self.waiting_for_image = False
+        self.nav_token += 1 # a history fetch still in flight must not replace this image
+        self.show_image(item["image_name"], item["image"], item["labels"], item.get("predictions"), (item["width"], item["height"]))
+        if not self.image_history or self.image_history[-1] != self.current_image_name:
+            self.image_history.append(self.current_image_name)
+            self.history_index = len(self.image_history) - 1
+        self.update_nav_buttons()
 
     def go_back(self, event=None):
         if not self.is_connected or self.history_index <= 0: return
         self.submit_labels_only() 
         self.history_index -= 1
-        prev_img_name = self.image_history[self.history_index]
-        success = self.fetch_image_and_labels("get_image_specific", {"filename": prev_img_name})
-        if success: self.update_nav_buttons()
+        self.open_history_image(self.image_history[self.history_index])
+        self.update_nav_buttons()
+
+    def open_history_image(self, image_name):
+        entry = self.image_cache.get(image_name)
+        if entry is None:
+            self.fetch_image_and_labels("get_image_specific", {"filename": image_name})
+            return
+        self.nav_token += 1 # a fetch still in flight must not replace this image
+        self.show_image(image_name, entry["image"], entry["labels"], size=entry["size"])
 
     def update_nav_buttons(self):
         self.prev_btn.config(state=tk.NORMAL if self.history_index > 0 else tk.DISABLED)
 
     def submit_labels_only(self):
-        if not self.current_image_name: return
+        if not self.current_image_name or not self.outbox: return
         current_data = self.labels.get(self.current_image_name, [])
+        if self.image_cache.submitted(self.current_image_name) == current_data:
+            return # unchanged since it was last sent, so revisits cost no request
+        self.image_cache.set_labels(self.current_image_name, current_data, submitted=True)
         payload = {"image_name": self.current_image_name, "user_name": self.user_name, "labels": json.dumps(current_data)}
-        try: requests.post(f"{self.server_url}/submit_label", data=payload)
-        except: pass
+        self.outbox.put(payload)
 
     def submit_and_next(self, event=None):
         if not self.current_image_name: return
         self.submit_labels_only()
         if self.history_index < len(self.image_history) - 1:
             self.history_index += 1
-            next_img_name = self.image_history[self.history_index]
-            self.fetch_image_and_labels("get_image_specific", {"filename": next_img_name})
+            self.open_history_image(self.image_history[self.history_index])
             self.update_nav_buttons()
-        else:
+        elif not self.waiting_for_image:
             self.load_next_image()
 
     def run_server_inference(self):
         if not self.raw_image: return
         self.status_var.set("AI predicting...")
-        self.root.update_idletasks()
-        img_byte_arr = io.BytesIO()
-        if self.raw_image.mode in ("RGBA", "P"): self.raw_image.convert("RGB").save(img_byte_arr, format='JPEG')
-        else: self.raw_image.save(img_byte_arr, format='JPEG')
-        img_byte_arr.seek(0)
-        try:
-            resp = requests.post(f"{self.server_url}/predict", files={'file': img_byte_arr})
-            if resp.status_code == 200:
-                predictions = resp.json()["predictions"]
-                for label, bbox in predictions:
-                    if label not in self.label_list:
-                        self.label_list.append(label)
-                        self.label_colors[label] = self.get_random_color()
-                        self.update_label_listbox()
-                    if not self.is_duplicate(bbox):
-                        self.labels[self.current_image_name].append((label, bbox))
-                self.redraw_labels()
-                self.status_var.set(f"Labeling: {self.current_image_name} (AI Applied)")
-        except Exception as e: print(e)
+        image_name = self.current_image_name
+
+        def predict():
+            # The server already has the file; naming it avoids re-encoding and re-uploading
+            resp = self.transport.post("predict", data={"image_name": image_name})
+            resp.raise_for_status()
+            return resp.json()["predictions"]
+
+        def done(predictions):
+            if image_name == self.current_image_name: self.apply_predictions(predictions)
+
+        self.worker.submit(predict, done, lambda e: self.status_var.set(f"AI prediction failed: {e}"))
+
+    def apply_predictions(self, predictions):
+        for label, _ in predictions:
+            if label not in self.label_list:
+                self.label_list.append(label)
+                self.label_colors[label] = self.get_random_color()
+                self.update_label_listbox()
+        # Predictions that overlap an existing box, or an earlier prediction, are duplicates
+        boxes = self.labels[self.current_image_name]
+        keep = geometry.dedupe([bbox for _, bbox in predictions], [bbox for _, bbox in boxes], DUPLICATE_IOU)
+        boxes.extend((label, bbox) for (label, bbox), kept in zip(predictions, keep) if kept)
+        self.redraw_labels()
+        self.status_var.set(f"Labeling: {self.current_image_name} (AI Applied)")
 
     # --- Canvas & Interaction Logic ---
-    def display_image(self):
+    RENDER_IDLE_MS = 150 # the high-quality redraw waits until zooming, panning or resizing pauses this long
+
+    def display_image(self, fast=False):
+        """Draws the visible part of the image into one reused canvas item.
+
+        The fitted view comes from the display copy in the image cache; zoomed
+        views are cropped from the pyramid by the viewport.
+        """
         if not self.raw_image: return
-        self.canvas.delete("all")
         c_w, c_h = self.canvas.winfo_width(), self.canvas.winfo_height()
-        i_w, i_h = self.raw_image.size
         if c_w < 10: return
-        ratio = min(c_w/i_w, c_h/i_h)
-        new_w, new_h = int(i_w*ratio), int(i_h*ratio)
-        self.scale_factor = ratio
-        self.offset_x = (c_w-new_w)//2
-        self.offset_y = (c_h-new_h)//2
-        resized = self.raw_image.resize((new_w, new_h), Image.Resampling.LANCZOS)
-        self.tk_image = ImageTk.PhotoImage(resized)
-        self.canvas.create_image(self.offset_x, self.offset_y, anchor=tk.NW, image=self.tk_image)
+        if (c_w, c_h) != self.view.canvas_size: self.view.resize((c_w, c_h))
+        self.image_cache.canvas_size = (c_w, c_h)
+        if self.view.fitted and not fast:
+            # the raw image may be a smaller rendition; the fit is computed against the original size
+            image = self.image_cache.display(self.current_image_name, self.raw_image, ImageCache.fit(self.image_size, (c_w, c_h))[1])
+            x, y = self.view.offset_x, self.view.offset_y
+        else:
+            rendered = self.view.render(fast)
+            if rendered is None: return
+            image, x, y = rendered
+        self.tk_image = ImageTk.PhotoImage(image)
+        if self.image_item is None:
+            self.image_item = self.canvas.create_image(x, y, anchor=tk.NW, image=self.tk_image)
+        else:
+            self.canvas.coords(self.image_item, x, y)
+            self.canvas.itemconfig(self.image_item, image=self.tk_image)
+        self.canvas.tag_lower(self.image_item)
         self.redraw_labels()
+        if self.view.needs_more_pixels(): self.load_full_resolution()
+
+    def request_render(self):
+        """Coalesces redraws while the view changes: fast renders once per idle loop, LANCZOS once input settles."""
+        if self._fast_job is None:
+            self._fast_job = self.root.after_idle(self._render_fast)
+        if self._hq_job: self.root.after_cancel(self._hq_job)
+        self._hq_job = self.root.after(self.RENDER_IDLE_MS, self._render_hq)
+
+    def _render_fast(self):
+        self._fast_job = None
+        self.display_image(fast=True)
+
+    def _render_hq(self):
+        self._hq_job = None
+        self.display_image()
+
+    def load_full_resolution(self):
+        """Zoomed in past the rendition's pixels: fetch the original once and make it the pyramid base."""
+        name = self.current_image_name
+        if self.full_res_for == name or self.raw_image.size == tuple(self.image_size) or not self.transport: return
+        self.full_res_for = name
+        self.status_var.set(f"Loading full resolution of {name}...")
+
+        def fetch():
+            _, image, _ = self.image_cache.download(self.transport, "get_image_specific", {"filename": name, "max_side": 0})
+            return Viewport.pyramid(image)
+
+        def done(levels):
+            if name != self.current_image_name: return
+            self.view.set_source(levels, self.image_size)
+            self.status_var.set(f"Labeling: {name} (full resolution)")
+            self.display_image()
+
+        self.worker.submit(fetch, done, lambda e: self.status_var.set(f"Full resolution failed: {e}"))
 
     def redraw_labels(self):
-        self.canvas.delete("bbox")
         if not self.current_image_name: return
-        for i, (label, bbox) in enumerate(self.labels.get(self.current_image_name, [])):
-            x1, y1 = self.image_to_screen(bbox[0], bbox[1])
-            x2, y2 = self.image_to_screen(bbox[2], bbox[3])
-            color = self.label_colors.get(label, "red")
-            
-            # Highlight selected box
-            width = 3 if (self.edit_mode and self.selected_bbox_index == i) else 2
-            dash = (4,2) if (self.edit_mode and self.selected_bbox_index == i) else None
-            
-            self.canvas.create_rectangle(x1, y1, x2, y2, outline=color, width=width, dash=dash, tags="bbox")
-            self.canvas.create_text(x1, y1-12, text=label, fill=color, anchor=tk.SW, font=("Arial", 10, "bold"), tags="bbox")
+        selected = self.selected_bbox_index if self.edit_mode else None
+        self.box_layer.draw(self.labels.get(self.current_image_name, []), self.view, self.label_colors, selected, self.image_size)
+
+    def restyle_selection(self, previous):
+        """Redraws only the boxes whose highlight changed."""
+        boxes = self.labels.get(self.current_image_name, [])
+        for i in {previous, self.selected_bbox_index} - {None}:
+            if i < len(boxes) and i < len(self.box_layer.items):
+                label, bbox = boxes[i]
+                self.box_layer.place(i, label, bbox, self.view, self.label_colors.get(label, "red"),
+                                     self.edit_mode and i == self.selected_bbox_index)
 
     # --- Mouse Events ---
     def get_bbox_at(self, x, y):
         """Returns (index, handle_type) if x,y is near a box or its corners."""
         img_x, img_y = self.screen_to_image(x, y)
         boxes = self.labels.get(self.current_image_name, [])
-        threshold = 10 / self.scale_factor # 10 pixel threshold
+        threshold = 10 / self.view.scale # 10 pixel threshold
+        self.box_layer.sync_index(boxes, self.image_size)
         
-        # Search backwards (top boxes first)
-        for i in range(len(boxes) - 1, -1, -1):
+        # Search backwards (top boxes first), among the boxes near the cursor only
+        for i in reversed(self.box_layer.candidates(img_x, img_y, threshold)):
             _, bbox = boxes[i]
             x1, y1, x2, y2 = bbox
             
@@ -301,13 +1128,13 @@ class NetworkClientApp:
             index, handle = self.get_bbox_at(event.x, event.y)
             
             if index is not None:
-                self.selected_bbox_index = index
+                previous, self.selected_bbox_index = self.selected_bbox_index, index
                 self.drag_data["mode"] = 'resize' if handle in ['tl','tr','bl','br'] else 'move'
                 self.drag_data["box_index"] = index
                 self.drag_data["resize_handle"] = handle
                 self.drag_data["x"] = event.x
                 self.drag_data["y"] = event.y
-                self.redraw_labels()
+                self.restyle_selection(previous)
                 return
 
         # Default: Create New Box
@@ -331,8 +1158,8 @@ class NetworkClientApp:
             x1, y1, x2, y2 = bbox
             
             # Convert movement to image scale
-            dx = (event.x - self.drag_data["x"]) / self.scale_factor
-            dy = (event.y - self.drag_data["y"]) / self.scale_factor
+            dx = (event.x - self.drag_data["x"]) / self.view.scale
+            dy = (event.y - self.drag_data["y"]) / self.view.scale
             
             if mode == 'move':
                 new_bbox = [x1+dx, y1+dy, x2+dx, y2+dy]
@@ -353,8 +1180,10 @@ class NetworkClientApp:
                 self.labels[self.current_image_name][idx] = (label, [min(nx1,nx2), min(ny1,ny2), max(nx1,nx2), max(ny1,ny2)])
                 self.drag_data["x"] = event.x
                 self.drag_data["y"] = event.y
-                
-            self.redraw_labels()
+            
+            # Only the edited box moves; the other items stay untouched
+            label, bbox = self.labels[self.current_image_name][idx]
+            self.box_layer.move(idx, label, bbox, self.view, self.label_colors.get(label, "red"), self.edit_mode and idx == self.selected_bbox_index)
 
     def on_mouse_up(self, event):
         mode = self.drag_data["mode"]
@@ -368,13 +1197,12 @@ class NetworkClientApp:
             if abs(bbox[2]-bbox[0]) > 5 and abs(bbox[3]-bbox[1]) > 5:
                 self.labels[self.current_image_name].append((self.current_label, bbox))
                 self.selected_bbox_index = len(self.labels[self.current_image_name]) - 1
+                self.redraw_labels()
         
         self.drag_data["mode"] = None
-        self.redraw_labels()
 
     def on_mouse_move(self, event):
         if not self.raw_image: return
-        self.canvas.delete("crosshair")
         
         # Cursor feedback for Edit Mode
         if self.edit_mode:
@@ -387,14 +1215,20 @@ class NetworkClientApp:
             self.canvas.config(cursor="cross") # Draw cursor
 
         w, h = self.canvas.winfo_width(), self.canvas.winfo_height()
-        self.canvas.create_line(0, event.y, w, event.y, fill="gray", dash=(4,4), tags="crosshair")
-        self.canvas.create_line(event.x, 0, event.x, h, fill="gray", dash=(4,4), tags="crosshair")
+        if self.crosshair is None:
+            self.crosshair = (self.canvas.create_line(0, event.y, w, event.y, fill="gray", dash=(4,4), tags="crosshair"),
+                              self.canvas.create_line(event.x, 0, event.x, h, fill="gray", dash=(4,4), tags="crosshair"))
+        else:
+            self.canvas.coords(self.crosshair[0], 0, event.y, w, event.y)
+            self.canvas.coords(self.crosshair[1], event.x, 0, event.x, h)
 
     def on_right_click(self, event):
         if not self.raw_image: return
         img_x, img_y = self.screen_to_image(event.x, event.y)
         boxes = self.labels.get(self.current_image_name, [])
-        for i, (label, bbox) in enumerate(boxes):
+        self.box_layer.sync_index(boxes, self.image_size)
+        for i in self.box_layer.candidates(img_x, img_y):
+            bbox = boxes[i][1]
             if bbox[0] <= img_x <= bbox[2] and bbox[1] <= img_y <= bbox[3]:
                 boxes.pop(i)
                 self.selected_bbox_index = None
@@ -402,21 +1236,46 @@ class NetworkClientApp:
                 return
 
     # --- Utils ---
-    def screen_to_image(self, sx, sy): return (sx - self.offset_x)/self.scale_factor, (sy - self.offset_y)/self.scale_factor
-    def image_to_screen(self, ix, iy): return (ix * self.scale_factor)+self.offset_x, (iy * self.scale_factor)+self.offset_y
-    def is_duplicate(self, new_box):
-        for _, ex in self.labels.get(self.current_image_name, []):
-             if abs(ex[0]-new_box[0]) < 2 and abs(ex[1]-new_box[1]) < 2: return True
-        return False
+    def screen_to_image(self, sx, sy): return self.view.screen_to_image(sx, sy)
+    def image_to_screen(self, ix, iy): return self.view.image_to_screen(ix, iy)
     def on_resize(self, event): 
-        if self.raw_image: self.display_image()
+        if not self.raw_image: return
+        self.view.resize((event.width, event.height))
+        self.request_render()
+    def on_mouse_wheel(self, event):
+        if not self.raw_image: return
+        zoom_in = event.num == 4 or event.delta > 0
+        self.view.zoom_at(event.x, event.y, 1.25 if zoom_in else 0.8)
+        self.request_render()
+    def on_pan_start(self, event): self.pan_start = (event.x, event.y)
+    def on_pan_drag(self, event):
+        if not self.raw_image or not self.pan_start: return
+        self.view.pan(event.x - self.pan_start[0], event.y - self.pan_start[1])
+        self.pan_start = (event.x, event.y)
+        self.request_render()
+    def fit_view(self, event=None):
+        if not self.raw_image: return
+        self.view.fit()
+        self.display_image()
     def toggle_model(self):
         self.auto_label_enabled = not self.auto_label_enabled
         self.model_btn.config(bg="lightgreen" if self.auto_label_enabled else "#dddddd")
         if self.auto_label_enabled: self.run_server_inference()
     def add_label(self):
         name = simpledialog.askstring("Class", "New Class Name:")
-        if name and name not in self.label_list:
+        if not name or name in self.label_list: return
+        def added(resp):
+            if resp.status_code != 200:
+                messagebox.showerror("Class", resp.json().get("detail", resp.text))
+                return
+            self.label_list.append(name)
+            self.label_colors[name] = self.get_random_color()
+            self.update_label_listbox()
+        if self.is_connected:
+            # Register on the server first so every annotator gets the same name and id
+            self.worker.submit(lambda: self.transport.post("classes", data={"name": name}), added,
+                               lambda e: messagebox.showerror("Class", f"Could not register class: {e}"))
+        else:
             self.label_list.append(name)
             self.label_colors[name] = self.get_random_color()
             self.update_label_listbox()
@@ -441,12 +1300,12 @@ class NetworkClientApp:
     def enable_edit_mode(self, e): 
         self.edit_mode = True
         self.mode_label.config(text="Mode: EDIT (Drag box to move, corners to resize)", fg="red")
-        self.redraw_labels()
+        self.restyle_selection(None)
     def disable_edit_mode(self, e): 
         self.edit_mode = False
         self.mode_label.config(text="Hold Ctrl to Edit/Resize", fg="gray")
-        self.selected_bbox_index = None
-        self.redraw_labels()
+        previous, self.selected_bbox_index = self.selected_bbox_index, None
+        self.restyle_selection(previous)
     def get_random_color(self): import random; return "#{:06x}".format(random.randint(0, 0xFFFFFF))
 
 if __name__ == "__main__":
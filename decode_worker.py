@@ -0,0 +1,27 @@
+"""Image decoding for the bulk pre-annotation pool, run in worker processes.
+
+The function lives outside server.py so it pickles by a module name. That
+does not keep the children light under `python server.py`: spawn re-runs the
+main script as __mp_main__ in each one, so they also import FastAPI and Tk and
+build an idle ServerState (about a second, nothing is started). Launched
+through the uvicorn CLI, they import only this module and Pillow.
+"""
+import math
+
+from PIL import Image
+
+
+def decode_for_inference(path, target):
+    """Decodes an image at no less than `target` on its long side.
+
+    JPEGs are decoded at a reduced DCT scale (Image.draft), which is several
+    times faster than a full decode; the model letterboxes to its input size
+    anyway. Returns (image, (sx, sy)) where sx/sy map decoded pixels back to
+    original pixels.
+    """
+    with Image.open(path) as im:
+        w, h = im.size
+        fit = target / max(w, h)
+        im.draft("RGB", (math.ceil(w * fit), math.ceil(h * fit)))
+        img = im.convert("RGB")
+    return img, (w / img.width, h / img.height)
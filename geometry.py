@@ -0,0 +1,91 @@
+"""Box geometry shared by server.py and client.py, vectorized with NumPy.
+
+Boxes are float arrays of shape (N, 4): pixel corners `xyxy` as the client
+draws them, or normalized `cxcywh` as YOLO label files store them.
+"""
+import numpy as np
+
+
+def as_boxes(boxes):
+    """Any sequence of 4-number boxes (or None) as an (N, 4) float array."""
+    return np.asarray(boxes if boxes is not None and len(boxes) else np.empty((0, 4)), dtype=np.float64).reshape(-1, 4)
+
+
+def xyxy_to_cxcywh(boxes, size):
+    """Pixel corners to normalized centre/size for an image of size (w, h)."""
+    b = as_boxes(boxes)
+    scale = np.array(size * 2, dtype=np.float64)
+    return np.concatenate([(b[:, :2] + b[:, 2:]) / 2, b[:, 2:] - b[:, :2]], axis=1) / scale
+
+
+def cxcywh_to_xyxy(boxes, size):
+    """Normalized centre/size to pixel corners for an image of size (w, h)."""
+    b = as_boxes(boxes)
+    half = b[:, 2:] / 2
+    return np.concatenate([b[:, :2] - half, b[:, :2] + half], axis=1) * np.array(size * 2, dtype=np.float64)
+
+
+def clip_xyxy(boxes, size):
+    """Orders each box's corners and clips them to the image bounds (0..w, 0..h)."""
+    b = as_boxes(boxes)
+    lo, hi = np.minimum(b[:, :2], b[:, 2:]), np.maximum(b[:, :2], b[:, 2:])
+    bound = np.array(size, dtype=np.float64)
+    return np.concatenate([np.clip(lo, 0, bound), np.clip(hi, 0, bound)], axis=1)
+
+
+def clip_cxcywh(boxes):
+    """Clips normalized boxes to the unit square, keeping them in cxcywh form."""
+    return xyxy_to_cxcywh(clip_xyxy(cxcywh_to_xyxy(boxes, (1, 1)), (1, 1)), (1, 1))
+
+
+def areas(boxes):
+    b = as_boxes(boxes)
+    return np.maximum(b[:, 2] - b[:, 0], 0) * np.maximum(b[:, 3] - b[:, 1], 0)
+
+
+def iou_matrix(a, b):
+    """IoU of every box in `a` against every box in `b`, shape (len(a), len(b))."""
+    a, b = as_boxes(a), as_boxes(b)
+    iw = np.minimum(a[:, 2, None], b[:, 2]) - np.maximum(a[:, 0, None], b[:, 0])
+    ih = np.minimum(a[:, 3, None], b[:, 3]) - np.maximum(a[:, 1, None], b[:, 1])
+    inter = np.maximum(iw, 0) * np.maximum(ih, 0)
+    union = areas(a)[:, None] + areas(b) - inter
+    return inter / np.maximum(union, 1e-12) # empty boxes get 0, not nan
+
+
+def dedupe(boxes, existing=None, iou=0.7):
+    """NMS-style de-duplication; returns a boolean keep mask over `boxes`.
+
+    A box is dropped if it overlaps a kept box (or any of `existing`) by more
+    than `iou`. Earlier boxes win, so pass them in priority order, e.g. by
+    descending confidence.
+    """
+    b = as_boxes(boxes)
+    keep = np.ones(len(b), dtype=bool)
+    if not len(b):
+        return keep
+    if existing is not None and len(existing):
+        keep &= ~(iou_matrix(b, existing) > iou).any(axis=1)
+    overlap = np.triu(iou_matrix(b, b) > iou, k=1)
+    for i in np.flatnonzero(overlap.any(axis=1)):
+        if keep[i]:
+            keep[overlap[i]] = False
+    return keep
+
+
+def parse_yolo(lines):
+    """YOLO label lines to (class names, normalized cxcywh array); short lines are skipped."""
+    rows = [parts for parts in (line.split() for line in lines or ()) if len(parts) >= 5]
+    return [parts[0] for parts in rows], as_boxes([parts[1:5] for parts in rows])
+
+
+def format_yolo(classes, boxes):
+    return [f"{cls} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}" for cls, (cx, cy, w, h) in zip(classes, as_boxes(boxes).tolist())]
+
+
+def valid_cxcywh(boxes):
+    """Mask of normalized boxes that are finite, non-empty and inside the image."""
+    b = as_boxes(boxes)
+    half = b[:, 2:] / 2
+    return (np.isfinite(b).all(axis=1) & (b[:, 2:] > 0).all(axis=1)
+            & (b[:, :2] - half >= -1e-6).all(axis=1) & (b[:, :2] + half <= 1 + 1e-6).all(axis=1))
@@ -0,0 +1,49 @@
+"""Imports an existing labels_collected/ folder into the SQLite label store.
+
+    python migrate_labels.py path/to/images/labels_collected
+
+The .txt files are left untouched, so the server can still be started with
+the file backend. Starting the server with the sqlite backend on a folder
+that has no labels.sqlite yet performs the same import automatically.
+"""
+import argparse
+import os
+import sys
+
+from server import SQLiteLabelStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import YOLO .txt labels into labels.sqlite")
+    parser.add_argument("label_folder", help="the labels_collected folder to import")
+    parser.add_argument("--reimport", action="store_true",
+                        help="import again even if labels.sqlite already has labels (adds a new version per image)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.label_folder):
+        sys.exit(f"Not a folder: {args.label_folder}")
+
+    store = SQLiteLabelStore()
+    store.open(args.label_folder) # imports on first open
+    if args.reimport:
+        print(f"Re-imported {store.import_folder(args.label_folder)} label files")
+
+    # Verify: every .txt must read back with the same boxes
+    mismatched = 0
+    files = sorted(f for f in os.listdir(args.label_folder) if f.endswith(".txt"))
+    for f in files:
+        with open(os.path.join(args.label_folder, f)) as src:
+            expected = SQLiteLabelStore._parse(src)
+        stored = SQLiteLabelStore._parse(store.read(f[:-4]) or [])
+        if len(expected) != len(stored) or any(a[0] != b[0] or max(abs(x - y) for x, y in zip(a[1:], b[1:])) > 1e-6
+                                               for a, b in zip(expected, stored)):
+            mismatched += 1
+            print(f"Mismatch: {f}")
+    counts = store.class_counts()
+    print(f"{len(files)} label files, {len(store.labeled_bases())} images in {store.db_path}, "
+          f"{sum(counts.values())} boxes in {len(counts)} classes, {mismatched} mismatched")
+    sys.exit(1 if mismatched else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,52 +2,2510 @@
 import os
 import json
 import threading
+import queue
+import asyncio
+import itertools
+import heapq
+import math
+import struct
+import sqlite3
+import uuid
+import multiprocessing
 import socket  
-import tkinter as tk
-from tkinter import filedialog, messagebox, scrolledtext, ttk
-from fastapi import FastAPI, UploadFile, Form, HTTPException
-from fastapi.responses import FileResponse
-from ultralytics import YOLO
+import argparse
+try:
+    import tomllib
+except ImportError: # Python < 3.11
+    import tomli as tomllib
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+try:
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, scrolledtext, simpledialog, ttk
+except ImportError: # headless install; only `serve` is available
+    tk = None
+from fastapi import FastAPI, Request, Response, UploadFile, Form, Header, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+import requests
 import uvicorn
 from PIL import Image
+import decode_worker
+import geometry
 import io
+import gzip
+import hashlib
+try:
+    import fcntl
+except ImportError: # Windows: no reflinks or flock
+    fcntl = None
 import shutil
 import yaml
+import time
+from collections import OrderedDict, Counter, namedtuple, deque
 from datetime import datetime
+from typing import Optional
 
 # --- 1. SERVER STATE & API ---
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+class Metrics:
+    """Counters and histograms kept in process, rendered in the Prometheus text format at /metrics.
+
+    Gauges (queue depths, active leases, ...) are registered as functions and
+    read at scrape time, so the hot paths only ever pay for `inc`/`observe`.
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = {}       # name -> (type, help, buckets)
+        self.values = {}     # (name, labels) -> counter value, or [bucket counts..., sum, count]
+        self.gauges = {}     # name -> function returning {labels: value}
+        self.submissions = deque() # (time, user) of label submissions in the last hour
+
+    def describe(self, name, kind, text, buckets=None):
+        self.meta[name] = (kind, text, buckets or self.BUCKETS)
+
+    def gauge(self, name, text, fn):
+        self.meta[name] = ("gauge", text, None)
+        self.gauges[name] = fn
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.meta[name][2]
+        with self.lock:
+            h = self.values.get(key)
+            if h is None:
+                h = self.values[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def labeled(self, user_name):
+        now = time.time()
+        with self.lock:
+            self.submissions.append((now, user_name))
+            while self.submissions and self.submissions[0][0] < now - 3600:
+                self.submissions.popleft()
+        self.inc("yolo_labels_submitted_total", user=user_name)
+
+    def labeled_last_hour(self):
+        cutoff = time.time() - 3600
+        with self.lock:
+            return Counter(user for t, user in self.submissions if t >= cutoff)
+
+    def histogram(self, name, **labels):
+        """(count, sum, p50, p95) of one histogram, quantiles interpolated from the buckets."""
+        with self.lock:
+            h = list(self.values.get((name, tuple(sorted(labels.items()))), []))
+        if not h or not h[-1]:
+            return 0, 0.0, None, None
+        buckets = self.meta[name][2]
+
+        def quantile(q):
+            rank, prev_count, prev_bound = q * h[-1], 0, 0.0
+            for bound, count in zip(buckets, h):
+                if count >= rank:
+                    return prev_bound + (bound - prev_bound) * (rank - prev_count) / max(count - prev_count, 1)
+                prev_count, prev_bound = count, bound
+            return buckets[-1]
+        return h[-1], h[-2], quantile(0.5), quantile(0.95)
+
+    def series(self, name):
+        with self.lock:
+            return [dict(labels) for (n, labels) in self.values if n == name]
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ""
+        esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+    def render(self):
+        with self.lock:
+            values = {k: (list(v) if isinstance(v, list) else v) for k, v in self.values.items()}
+        out = []
+        for name, (kind, text, buckets) in sorted(self.meta.items()):
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+            if kind == "gauge":
+                try:
+                    samples = self.gauges[name]()
+                except Exception:
+                    continue
+                for labels, value in samples.items():
+                    out.append(f"{name}{self._labels(labels)} {value}")
+                continue
+            for (n, labels), v in values.items():
+                if n != name:
+                    continue
+                if kind == "counter":
+                    out.append(f"{name}{self._labels(labels)} {v}")
+                else:
+                    for bound, count in zip(buckets, v):
+                        out.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+                    out.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {v[-1]}")
+                    out.append(f"{name}_sum{self._labels(labels)} {v[-2]}")
+                    out.append(f"{name}_count{self._labels(labels)} {v[-1]}")
+        return "\n".join(out) + "\n"
+
+class WorkQueue:
+    """In-memory index of the image pool.
+
+    The folders are listed once at startup; after that `submit_label` keeps the
+    sets current and a background delta scan picks up files added or removed
+    behind the server's back, so handing out an image never touches the disk.
+    """
+    def __init__(self, rescan_interval=30):
+        self.rescan_interval = rescan_interval
+        self.lock = threading.Lock()
+        self.image_folder = ""
+        self.label_folder = ""
+        self.images = set()          # every image file in the pool
+        self.pending = OrderedDict() # image_name -> None, in hand-out order
+        self.completed = set()       # base names that have a label file
+        self.scores = {}             # image_name -> priority, for pending images that have one
+        self._heap = []              # (-score, image_name); stale entries are skipped lazily
+        self._stop = threading.Event()
+        self._scanner = None
+
+    def start(self, image_folder, label_folder):
+        self.stop()
+        with self.lock:
+            self.image_folder = image_folder
+            self.label_folder = label_folder
+            self.images.clear()
+            self.pending.clear()
+            self.completed.clear()
+            self.scores.clear()
+            self._heap = []
+        self.scan()
+        self._stop.clear()
+        self._scanner = threading.Thread(target=self._scan_loop, daemon=True)
+        self._scanner.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._scanner:
+            self._scanner.join(timeout=5)
+            self._scanner = None
+
+    def _scan_loop(self):
+        while not self._stop.wait(self.rescan_interval):
+            try:
+                self.scan()
+            except Exception as e:
+                server_state.log(f"Work queue rescan failed: {e}")
+
+    def scan(self):
+        """Delta scan: only the difference to the current index is applied."""
+        images = {f for f in os.listdir(self.image_folder) if f.lower().endswith(IMAGE_EXTENSIONS)}
+        labels = server_state.labels.labeled_bases()
+
+        with self.lock:
+            added = images - self.images
+            removed = self.images - images
+            self.images = images
+            self.completed.update(labels)
+            for img in removed:
+                self.pending.pop(img, None)
+                self.scores.pop(img, None)
+            # Labels written outside of submit_label also retire pending images
+            for img in [i for i in self.pending if os.path.splitext(i)[0] in labels]:
+                del self.pending[img]
+                self.scores.pop(img, None)
+            for img in added:
+                if os.path.splitext(img)[0] not in labels:
+                    self.pending[img] = None
+        if added or removed:
+            server_state.log(f"Work queue: +{len(added)} / -{len(removed)} images, {len(self.pending)} pending")
+        server_state.image_index.sync(images)
+
+    def _live(self, entry):
+        neg_score, img = entry
+        return img in self.pending and self.scores.get(img) == -neg_score
+
+    def pop_pending(self):
+        """Takes the next unlabeled image off the queue (None when the pool is done).
+
+        Images with a priority score come first, highest score first; the rest
+        follow in scan order.
+        """
+        with self.lock:
+            while self._heap:
+                entry = heapq.heappop(self._heap)
+                if self._live(entry):
+                    img = entry[1]
+                    del self.pending[img]
+                    del self.scores[img]
+                    if os.path.splitext(img)[0] not in self.completed:
+                        return img
+            while self.pending:
+                img, _ = self.pending.popitem(last=False)
+                self.scores.pop(img, None)
+                if os.path.splitext(img)[0] not in self.completed:
+                    return img
+            return None
+
+    def peek(self, n):
+        """The next n images that will be handed out, without taking them."""
+        with self.lock:
+            out = []
+            # Walk the heap in order through its first levels instead of sorting it
+            frontier = [(self._heap[0], 0)] if self._heap else []
+            while frontier and len(out) < n:
+                entry, i = heapq.heappop(frontier)
+                if self._live(entry):
+                    out.append(entry[1])
+                for child in (2 * i + 1, 2 * i + 2):
+                    if child < len(self._heap):
+                        heapq.heappush(frontier, (self._heap[child], child))
+            for img in self.pending:
+                if len(out) >= n:
+                    break
+                if img not in self.scores:
+                    out.append(img)
+            return out
+
+    def prioritize(self, scores):
+        """Sets hand-out priorities ({image_name: score}, higher first) for pending images."""
+        with self.lock:
+            for img, score in scores.items():
+                if img in self.pending and self.scores.get(img) != score:
+                    self.scores[img] = score
+                    heapq.heappush(self._heap, (-score, img))
+            if len(self._heap) > 2 * len(self.scores) + 1024:
+                self._heap = [(-score, img) for img, score in self.scores.items()]
+                heapq.heapify(self._heap)
+
+    def pending_images(self):
+        with self.lock:
+            return list(self.pending)
+
+    def requeue(self, image_name):
+        """Puts an image that was handed out but not labeled back at the front."""
+        with self.lock:
+            if image_name in self.images and os.path.splitext(image_name)[0] not in self.completed:
+                self.pending[image_name] = None
+                self.pending.move_to_end(image_name, last=False)
+                self.scores[image_name] = float("inf")
+                heapq.heappush(self._heap, (float("-inf"), image_name))
+
+    def labeled_images(self):
+        """Image names that have a label file, one per base name (.jpg before .png before .jpeg)."""
+        rank = {".jpg": 0, ".png": 1, ".jpeg": 2}
+        with self.lock:
+            best = {}
+            for img in self.images:
+                base, ext = os.path.splitext(img)
+                if base in self.completed and (base not in best or rank.get(ext.lower(), 3) < rank.get(os.path.splitext(best[base])[1].lower(), 3)):
+                    best[base] = img
+            return list(best.values())
+
+    def is_completed(self, image_name):
+        with self.lock:
+            return os.path.splitext(image_name)[0] in self.completed or image_name not in self.images
+
+    def mark_completed(self, image_name):
+        with self.lock:
+            self.completed.add(os.path.splitext(image_name)[0])
+            self.pending.pop(image_name, None)
+            self.scores.pop(image_name, None)
+
+    def stats(self):
+        with self.lock:
+            return {"images": len(self.images), "pending": len(self.pending), "completed": len(self.completed),
+                    "prioritized": len(self.scores)}
+
+class Lease:
+    __slots__ = ("image_name", "user_name", "claimed_at", "expires_at")
+
+    def __init__(self, image_name, user_name, ttl):
+        self.image_name = image_name
+        self.user_name = user_name
+        self.claimed_at = time.time()
+        self.expires_at = self.claimed_at + ttl
+
+class LeaseManager:
+    """Time-limited image assignments on top of the WorkQueue.
+
+    Claim, renew and release all run under one lock, so an image popped from the
+    queue is leased to exactly one user. Leases that are not renewed (the client
+    heartbeats) expire and their images go back to the front of the queue.
+    """
+    def __init__(self, work_queue, ttl=300, reap_interval=10):
+        self.work_queue = work_queue
+        self.ttl = ttl
+        self.reap_interval = reap_interval
+        self.lock = threading.Lock()
+        self.leases = {}   # image_name -> Lease
+        self.by_user = {}  # user -> OrderedDict(image_name -> None), oldest first
+        self._stop = threading.Event()
+        self._reaper = None
+
+    def start(self):
+        self.stop()
+        with self.lock:
+            self.leases.clear()
+            self.by_user.clear()
+        self._stop.clear()
+        self._reaper = threading.Thread(target=self._reap_loop, daemon=True)
+        self._reaper.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._reaper:
+            self._reaper.join(timeout=5)
+            self._reaper = None
+
+    def _reap_loop(self):
+        while not self._stop.wait(self.reap_interval):
+            expired = self.reap()
+            if expired:
+                server_state.log(f"Reclaimed {len(expired)} expired lease(s): {', '.join(expired[:5])}")
+
+    def _drop(self, lease):
+        del self.leases[lease.image_name]
+        held = self.by_user.get(lease.user_name)
+        if held is not None:
+            held.pop(lease.image_name, None)
+            if not held:
+                del self.by_user[lease.user_name]
+
+    def claim(self, user_name):
+        """Returns the user's oldest live lease, or leases the next pending image."""
+        now = time.time()
+        with self.lock:
+            for img in list(self.by_user.get(user_name, ())):
+                lease = self.leases[img]
+                if self.work_queue.is_completed(img):
+                    self._drop(lease)
+                    continue
+                lease.expires_at = now + self.ttl
+                return img
+            img = self.work_queue.pop_pending()
+            if img is None:
+                return None
+            self.leases[img] = Lease(img, user_name, self.ttl)
+            self.by_user.setdefault(user_name, OrderedDict())[img] = None
+            return img
+
+    def claim_batch(self, user_name, k):
+        """Tops the user's live leases up to k images and returns them, oldest first."""
+        now = time.time()
+        with self.lock:
+            held = []
+            for img in list(self.by_user.get(user_name, ())):
+                if self.work_queue.is_completed(img):
+                    self._drop(self.leases[img])
+                    continue
+                self.leases[img].expires_at = now + self.ttl
+                held.append(img)
+            while len(held) < k:
+                img = self.work_queue.pop_pending()
+                if img is None:
+                    break
+                self.leases[img] = Lease(img, user_name, self.ttl)
+                self.by_user.setdefault(user_name, OrderedDict())[img] = None
+                held.append(img)
+            return held[:k]
+
+    def renew(self, user_name):
+        """Heartbeat: extends every lease the user holds and returns their image names."""
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            held = list(self.by_user.get(user_name, ()))
+            for img in held:
+                self.leases[img].expires_at = expires_at
+            return held
+
+    def release(self, image_name, user_name=None, completed=False):
+        """Ends a lease and returns it (None if there was none). Completed images are retired, others go back to the queue."""
+        with self.lock:
+            lease = self.leases.get(image_name)
+            if lease and (completed or lease.user_name == user_name):
+                self._drop(lease)
+            else:
+                lease = None
+            if completed:
+                self.work_queue.mark_completed(image_name)
+            elif lease:
+                self.work_queue.requeue(image_name)
+            return lease
+
+    def reap(self):
+        now = time.time()
+        with self.lock:
+            expired = [l for l in self.leases.values() if l.expires_at < now]
+            for lease in expired:
+                self._drop(lease)
+                self.work_queue.requeue(lease.image_name)
+        return [l.image_name for l in expired]
+
+    def leased_images(self):
+        with self.lock:
+            return list(self.leases)
+
+    def holder(self, image_name):
+        with self.lock:
+            lease = self.leases.get(image_name)
+            return lease.user_name if lease else None
+
+    def stats(self):
+        with self.lock:
+            return {"leases": len(self.leases), "users": len(self.by_user), "ttl": self.ttl}
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+ImageMeta = namedtuple("ImageMeta", "width height size mtime sha1 format")
+
+class ImageIndex:
+    """Persistent per-image metadata: dimensions, file size, mtime, content hash, format.
+
+    Rows live in SQLite next to the labels and are mirrored in a dict, so
+    endpoints get width/height without opening the image. `sync` re-probes only
+    files whose mtime or size changed, in parallel; content hashes are filled
+    in by a background pass (or on first use).
+    """
+    def __init__(self, workers=8):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.meta = {} # image_name -> ImageMeta
+        self.image_folder = ""
+        self.db = None
+        self._hasher = None
+
+    def open(self, image_folder, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self.lock:
+            self.image_folder = image_folder
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS images (
+                name TEXT PRIMARY KEY, width INTEGER, height INTEGER, size INTEGER,
+                mtime REAL, sha1 TEXT, format TEXT)""")
+            self.meta = {row[0]: ImageMeta(*row[1:]) for row in self.db.execute("SELECT * FROM images")}
+
+    def _probe(self, name):
+        path = os.path.join(self.image_folder, name)
+        st = os.stat(path)
+        with Image.open(path) as img: # reads the header only
+            return name, ImageMeta(img.width, img.height, st.st_size, st.st_mtime, None, img.format)
+
+    def _store(self, rows):
+        with self.lock:
+            for name, meta in rows:
+                self.meta[name] = meta
+            self.db.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                [(name, *meta) for name, meta in rows])
+            self.db.commit()
+
+    def sync(self, names):
+        """Brings the index in line with the given pool; returns the number of (re)probed files."""
+        def is_stale(name):
+            meta = self.meta.get(name)
+            if meta is None:
+                return True
+            try:
+                st = os.stat(os.path.join(self.image_folder, name))
+            except OSError:
+                return False
+            return st.st_mtime != meta.mtime or st.st_size != meta.size
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            names = list(names)
+            stale = [n for n, bad in zip(names, pool.map(is_stale, names, chunksize=256)) if bad]
+
+            def probe(name):
+                try:
+                    return self._probe(name)
+                except Exception as e:
+                    server_state.log(f"Index: cannot read {name}: {e}")
+                    return None
+            rows = [r for r in pool.map(probe, stale, chunksize=64) if r]
+
+        gone = set(self.meta) - set(names)
+        if rows:
+            self._store(rows)
+        if gone:
+            with self.lock:
+                for name in gone:
+                    self.meta.pop(name, None)
+                self.db.executemany("DELETE FROM images WHERE name = ?", [(n,) for n in gone])
+                self.db.commit()
+        if rows and (self._hasher is None or not self._hasher.is_alive()):
+            self._hasher = threading.Thread(target=self._hash_missing, daemon=True)
+            self._hasher.start()
+        return len(rows)
+
+    def _hash_missing(self):
+        with self.lock:
+            todo = [n for n, m in self.meta.items() if m.sha1 is None]
+        with ThreadPoolExecutor(self.workers) as pool:
+            for start in range(0, len(todo), 256):
+                chunk = todo[start:start + 256]
+                hashes = list(pool.map(lambda n: self._hash(n, store=False), chunk))
+                self._store([(n, self.meta[n]._replace(sha1=h)) for n, h in zip(chunk, hashes) if h and n in self.meta])
+
+    def _hash(self, name, store=True):
+        try:
+            digest = file_sha1(os.path.join(self.image_folder, name))
+        except OSError:
+            return None
+        if store and name in self.meta:
+            self._store([(name, self.meta[name]._replace(sha1=digest))])
+        return digest
+
+    def get(self, name):
+        meta = self.meta.get(name)
+        if meta is None:
+            row = self._probe(name)
+            self._store([row])
+            meta = row[1]
+        return meta
+
+    def size(self, name):
+        meta = self.get(name)
+        return meta.width, meta.height
+
+    def sha1(self, name):
+        meta = self.get(name)
+        return meta.sha1 or self._hash(name)
+
+    def stats(self):
+        with self.lock:
+            return {"indexed": len(self.meta), "hashed": sum(1 for m in self.meta.values() if m.sha1)}
+
+class PredictionCache:
+    """LRU of model outputs keyed by (image hash, model hash, confidence).
+
+    With `disk_folder` set, entries are also written as small JSON files so
+    they survive restarts and LRU evictions. That tier holds at most
+    `max_disk_entries` files: mtime is its LRU clock, and once it is full the
+    oldest quarter is removed. Folders of models the registry no longer knows
+    are dropped by `prune`.
+    """
+    def __init__(self, max_entries=5000, disk_folder=None, max_disk_entries=200000):
+        self.max_entries = max_entries
+        self.disk_folder = disk_folder
+        self.max_disk_entries = max_disk_entries
+        self.lock = threading.Lock()
+        self.disk_lock = threading.Lock() # one eviction or prune at a time
+        self.entries = OrderedDict()
+        self.disk_entries = None # file count, scanned on the first write
+        self.hits = 0
+        self.misses = 0
+
+    def open(self, disk_folder, max_disk_entries):
+        """Enables the disk tier in `disk_folder`, or disables it for a falsy folder or bound."""
+        with self.disk_lock:
+            self.disk_folder = disk_folder if max_disk_entries else None
+            self.max_disk_entries = max_disk_entries
+            self.disk_entries = None
+
+    @staticmethod
+    def key(image_hash, model_hash, conf):
+        return (image_hash, model_hash, round(float(conf), 3))
+
+    def _disk_path(self, key):
+        image_hash, model_hash, conf = key
+        return os.path.join(self.disk_folder, model_hash[:16], f"{conf:.3f}", image_hash + ".json")
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        if self.disk_folder:
+            try:
+                path = self._disk_path(key)
+                with open(path) as f:
+                    preds = json.load(f)
+                os.utime(path)
+                self._remember(key, preds)
+                with self.lock:
+                    self.hits += 1
+                return preds
+            except (OSError, ValueError):
+                pass
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, preds):
+        self._remember(key, preds)
+        if self.disk_folder:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            existed = os.path.exists(path)
+            with open(tmp, "w") as f:
+                json.dump(preds, f)
+            os.replace(tmp, path)
+            if not existed:
+                self._count_disk_entry()
+
+    def _disk_files(self):
+        """(mtime, path) of every file in the disk tier."""
+        out = []
+        for root, _, files in os.walk(self.disk_folder):
+            for fname in files:
+                path = os.path.join(root, fname)
+                try:
+                    out.append((os.stat(path).st_mtime, path))
+                except OSError:
+                    pass
+        return out
+
+    def _count_disk_entry(self):
+        with self.disk_lock:
+            if self.disk_entries is None:
+                self.disk_entries = len(self._disk_files())
+            self.disk_entries += 1
+            if self.disk_entries <= self.max_disk_entries:
+                return
+            files = sorted(self._disk_files())
+            for _, path in files[:len(files) - self.max_disk_entries * 3 // 4]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.disk_entries = min(len(files), self.max_disk_entries * 3 // 4)
+
+    def prune(self, model_hashes):
+        """Removes the disk entries of every model not in `model_hashes`."""
+        if not self.disk_folder or not os.path.isdir(self.disk_folder):
+            return
+        keep = {h[:16] for h in model_hashes}
+        with self.disk_lock:
+            for name in os.listdir(self.disk_folder):
+                if name not in keep:
+                    shutil.rmtree(os.path.join(self.disk_folder, name), ignore_errors=True)
+            self.disk_entries = None
+
+    def _remember(self, key, preds):
+        with self.lock:
+            self.entries[key] = preds
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def contains(self, key):
+        with self.lock:
+            if key in self.entries:
+                return True
+        return bool(self.disk_folder) and os.path.exists(self._disk_path(key))
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+class DecodedImageCache:
+    """LRU of decoded RGB images, bounded by their in-memory size.
+
+    Keyed on (path, mtime, size) so a replaced file is decoded again.
+    """
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # key -> PIL image
+        self.total = 0
+
+    def get(self, path):
+        st = os.stat(path)
+        key = (path, st.st_mtime, st.st_size)
+        with self.lock:
+            img = self.entries.get(key)
+            if img is not None:
+                self.entries.move_to_end(key)
+                return img
+        started = time.perf_counter()
+        with Image.open(path) as f:
+            img = f.convert("RGB")
+        server_state.metrics.observe("yolo_image_decode_seconds", time.perf_counter() - started, source="pool")
+        nbytes = img.width * img.height * 3
+        with self.lock:
+            if key not in self.entries and nbytes <= self.max_bytes:
+                self.entries[key] = img
+                self.total += nbytes
+                while self.total > self.max_bytes:
+                    _, old = self.entries.popitem(last=False)
+                    self.total -= old.width * old.height * 3
+        return img
+
+class EngineBusy(Exception):
+    pass
+
+class InferenceEngine:
+    """Dynamic micro-batching in front of the model.
+
+    Annotator requests and the pre-inference worker submit single images and
+    get a Future back. One worker thread collects up to `max_batch` requests,
+    waiting at most `max_wait` seconds after the first one arrives, runs one
+    forward pass per confidence value and resolves the futures. Interactive
+    requests are served before background ones; once `max_queue` interactive
+    requests are waiting, further interactive submits fail fast with
+    EngineBusy. Background producers (pre-inference, pre-annotation, active
+    learning) block on their own `max_background` slots instead, so a bulk
+    pass can never take the room reserved for annotators.
+    """
+    INTERACTIVE, BACKGROUND = 0, 1
+
+    def __init__(self, max_batch=8, max_wait=0.01, max_queue=64, max_background=16):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.max_background = max_background
+        self.queue = queue.PriorityQueue(maxsize=max_queue + max_background)
+        self.background_slots = threading.BoundedSemaphore(max_background) # released when the entry leaves the queue
+        self.interactive_waiting = 0
+        self.admission_lock = threading.Lock()
+        self._seq = itertools.count()
+        self.stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.queue_wait = 0.0
+        self.forward_time = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def submit(self, img, conf, priority=INTERACTIVE, handle=None, with_conf=False):
+        """Queues one image; it runs on `handle` (default: the model active right now) even if a swap happens meanwhile.
+
+        With `with_conf` the result is (predictions, confidences) instead of predictions.
+        """
+        handle = handle or server_state.models.active
+        if handle is None or handle.model is None:
+            raise RuntimeError("No model loaded")
+        future = Future()
+        entry = (priority, next(self._seq), img, float(conf), time.perf_counter(), future, handle, with_conf)
+        if priority == self.INTERACTIVE:
+            with self.admission_lock:
+                if self.interactive_waiting >= self.max_queue:
+                    raise EngineBusy(f"Inference queue full ({self.max_queue} waiting)")
+                self.interactive_waiting += 1
+        else:
+            self.background_slots.acquire()
+        self.queue.put_nowait(entry) # cannot be full: both kinds are bounded above
+        return future
+
+    def _get(self, timeout):
+        entry = self.queue.get(timeout=timeout)
+        if entry[0] == self.INTERACTIVE:
+            with self.admission_lock:
+                self.interactive_waiting -= 1
+        else:
+            self.background_slots.release()
+        return entry
+
+    def infer(self, img, conf, priority=INTERACTIVE, handle=None):
+        return self.submit(img, conf, priority, handle).result()
+
+    def _collect(self):
+        try:
+            batch = [self._get(0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._get(remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            started = time.perf_counter()
+            metrics = server_state.metrics
+            groups = {}
+            for entry in batch:
+                metrics.observe("yolo_inference_queue_wait_seconds", started - entry[4], priority="interactive" if entry[0] == self.INTERACTIVE else "background")
+                groups.setdefault((entry[6], entry[3]), []).append(entry)
+            for (handle, conf), entries in groups.items():
+                try:
+                    model = handle.model
+                    if model is None:
+                        raise RuntimeError(f"Model v{handle.version} was unloaded")
+                    forward_started = time.perf_counter()
+                    results = model([e[2] for e in entries], conf=conf)
+                    metrics.observe("yolo_inference_batch_seconds", time.perf_counter() - forward_started)
+                    metrics.observe("yolo_inference_batch_size", len(entries))
+                    for entry, r in zip(entries, results):
+                        for stage, ms in (getattr(r, "speed", None) or {}).items():
+                            if ms is not None:
+                                metrics.observe("yolo_inference_stage_seconds", ms / 1000, stage=stage)
+                        preds = [(handle.names[int(box.cls[0])], box.xyxy[0].tolist()) for box in r.boxes]
+                        entry[5].set_result((preds, [float(box.conf[0]) for box in r.boxes]) if entry[7] else preds)
+                except Exception as e:
+                    for entry in entries:
+                        if not entry[5].done():
+                            entry[5].set_exception(e)
+            with self.stats_lock:
+                self.batches += 1
+                self.requests += len(batch)
+                self.queue_wait += sum(started - e[4] for e in batch)
+                self.forward_time += time.perf_counter() - started
+
+    def stats(self):
+        with self.stats_lock:
+            batches, requests = max(self.batches, 1), max(self.requests, 1)
+            return {"batches": self.batches, "requests": self.requests,
+                    "avg_batch_size": round(self.requests / batches, 2),
+                    "batch_fill_rate": round(self.requests / batches / self.max_batch, 3),
+                    "avg_queue_wait_ms": round(self.queue_wait / requests * 1000, 2),
+                    "avg_forward_ms": round(self.forward_time / batches * 1000, 2),
+                    "queue_depth": self.queue.qsize(), "max_batch": self.max_batch,
+                    "max_wait_ms": self.max_wait * 1000, "max_queue": self.max_queue,
+                    "interactive_waiting": self.interactive_waiting, "max_background": self.max_background}
+
+class ModelVersion:
+    __slots__ = ("version", "path", "hash", "model", "names", "loaded_at", "warmup_ms", "validation")
+
+    def __init__(self, version, path, model_hash, model):
+        self.version = version
+        self.path = path
+        self.hash = model_hash
+        self.model = model
+        self.names = dict(model.names)
+        self.loaded_at = time.time()
+        self.warmup_ms = 0.0
+        self.validation = None
+
+    def info(self):
+        return {"version": self.version, "path": self.path, "hash": self.hash[:12], "loaded_at": self.loaded_at,
+                "warmup_ms": round(self.warmup_ms, 1), "validation": self.validation, "loaded": self.model is not None}
+
+class ModelRejected(Exception):
+    pass
+
+class ModelRegistry:
+    """Versioned model handles with off-path loading and atomic promotion.
+
+    A candidate is loaded, warmed up and scored on a holdout of labeled images
+    on a loader thread; promotion then swaps a single reference. Requests take
+    the active handle when they start and keep it, so a swap never changes the
+    model (or its class names) under an in-flight request. The last `keep`
+    versions stay in memory for instant rollback.
+    """
+    def __init__(self, keep=3, holdout_size=32, max_f1_drop=0.05):
+        self.keep = keep
+        self.holdout_size = holdout_size
+        self.max_f1_drop = max_f1_drop
+        self.lock = threading.Lock()
+        self.versions = OrderedDict() # version -> ModelVersion, oldest first
+        self.active = None
+        self.pending = None # path of the candidate being prepared
+        self.last_error = None # outcome of the last failed promotion, for API clients polling /models
+        self._seq = itertools.count(1)
+        self._loader = ThreadPoolExecutor(max_workers=1)
+
+    def promote(self, path, check_holdout=True, force=False):
+        """Prepares `path` on the loader thread and makes it active; returns a Future of the ModelVersion."""
+        return self._loader.submit(self._promote, path, check_holdout, force)
+
+    def _promote(self, path, check_holdout, force):
+        self.pending = path
+        try:
+            server_state.log(f"Loading model: {path}...")
+            from ultralytics import YOLO # deferred: importing it pulls in torch, seconds of startup
+            candidate = ModelVersion(None, path, file_sha1(path) if os.path.exists(path) else hashlib.sha1(path.encode()).hexdigest(), YOLO(path))
+            holdout = self.holdout() if check_holdout else []
+            started = time.perf_counter()
+            warm = server_state.image_cache.get(os.path.join(server_state.image_folder, holdout[0])) if holdout else Image.new("RGB", (640, 640))
+            for _ in range(2):
+                candidate.model([warm], conf=server_state.conf_threshold, verbose=False)
+            candidate.warmup_ms = (time.perf_counter() - started) * 1000
+
+            if holdout:
+                candidate.validation = self.score(candidate, holdout)
+                current = self.active
+                if current is not None and current.model is not None:
+                    if current.validation is None or current.validation["images"] != len(holdout):
+                        current.validation = self.score(current, holdout, serving=True)
+                    drop = current.validation["f1"] - candidate.validation["f1"]
+                    if drop > self.max_f1_drop and not force:
+                        raise ModelRejected(f"F1 on {len(holdout)} holdout images fell from {current.validation['f1']} to {candidate.validation['f1']}")
+            self._activate(candidate)
+            self.last_error = None
+            with self.lock:
+                known = [v.hash for v in self.versions.values()]
+            server_state.prediction_cache.prune(known)
+            server_state.log(f"SUCCESS: Switched to {os.path.basename(path)} (v{candidate.version}, warm-up {candidate.warmup_ms:.0f} ms"
+                             + (f", holdout F1 {candidate.validation['f1']})" if candidate.validation else ")"))
+            return candidate
+        except Exception as e:
+            server_state.log(f"Error loading model: {e}")
+            self.last_error = {"path": path, "message": str(e), "rejected": isinstance(e, ModelRejected)}
+            raise
+        finally:
+            self.pending = None
+
+    def _activate(self, handle):
+        with self.lock:
+            handle.version = next(self._seq) # rejected candidates do not use up a version number
+            self.versions[handle.version] = handle
+            self.active = handle
+            server_state.model_path = handle.path
+            loaded = [v for v in self.versions.values() if v.model is not None and v is not handle]
+            for old in loaded[:max(0, len(loaded) - (self.keep - 1))]:
+                old.model = None # dropped from memory, rollback reloads it from disk
+
+    def rollback(self, version=None):
+        """Reactivates `version` (default: the one before the active one); returns a Future of the ModelVersion."""
+        with self.lock:
+            if version is None:
+                earlier = [v for v in self.versions if self.active and v < self.active.version]
+                if not earlier:
+                    raise KeyError("No earlier version")
+                version = earlier[-1]
+            handle = self.versions[version]
+            if handle.model is not None:
+                self.active = handle
+                server_state.model_path = handle.path
+                self.versions.move_to_end(version)
+                server_state.log(f"Rolled back to v{version} ({os.path.basename(handle.path)})")
+                done = Future()
+                done.set_result(handle)
+                return done
+        return self.promote(handle.path, check_holdout=False)
+
+    def holdout(self):
+        """A fixed sample of labeled images (lowest name hashes), so every version is scored on the same set.
+
+        Training jobs leave these images out of their dataset, so the score is not training-set F1;
+        it is capped at a fifth of the labels so a small pool still has most of them to train on.
+        """
+        names = server_state.work_queue.labeled_images()
+        return sorted(names, key=lambda n: hashlib.sha1(n.encode()).hexdigest())[:min(self.holdout_size, len(names) // 5)]
+
+    def score(self, handle, holdout, serving=False):
+        """Precision/recall/F1 at IoU 0.5 with matching class names, against the submitted labels.
+
+        A `serving` handle is in use by the engine thread, so its passes queue there as background work.
+        """
+        tp = n_pred = n_true = 0
+        images = [server_state.image_cache.get(os.path.join(server_state.image_folder, name)) for name in holdout]
+        if serving:
+            futures = [server_state.engine.submit(img, server_state.conf_threshold, InferenceEngine.BACKGROUND, handle) for img in images]
+        for i, (name, img) in enumerate(zip(holdout, images)):
+            truth = read_labels(name, img.size)
+            if serving:
+                preds = futures[i].result()
+            else:
+                r = handle.model([img], conf=server_state.conf_threshold, verbose=False)[0]
+                preds = [(handle.names[int(box.cls[0])], box.xyxy[0].tolist()) for box in r.boxes]
+            n_pred += len(preds)
+            n_true += len(truth)
+            unmatched = list(truth)
+            for cls, box in preds:
+                best = max(((box_iou(box, t[1]), t) for t in unmatched if t[0] == cls), default=(0, None), key=lambda x: x[0])
+                if best[0] >= 0.5:
+                    unmatched.remove(best[1])
+                    tp += 1
+        precision, recall = tp / max(n_pred, 1), tp / max(n_true, 1)
+        return {"images": len(holdout), "precision": round(precision, 4), "recall": round(recall, 4),
+                "f1": round(2 * precision * recall / max(precision + recall, 1e-9), 4)}
+
+    def listing(self):
+        with self.lock:
+            return {"active": self.active.version if self.active else None, "pending": self.pending, "last_error": self.last_error,
+                    "versions": [v.info() for v in self.versions.values()]}
+
+def box_iou(a, b):
+    iw = min(a[2], b[2]) - max(a[0], b[0])
+    ih = min(a[3], b[3]) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = iw * ih
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+class RenditionCache:
+    """Display-size copies of pool images, generated on first request and kept on disk.
+
+    File names carry the content hash, so an edited image never serves a stale
+    rendition. The folder is trimmed back to `max_bytes` by evicting the least
+    recently served files. The folder itself is the index: a file's mtime is
+    its last-served time, so the primary and the front workers share one LRU
+    and one size cap, and only one process at a time (under a file lock)
+    trims it.
+    """
+    LOCK_FILE = ".evict.lock"
+
+    def __init__(self, max_bytes=2 * 1024 ** 3, quality=85, fmt="JPEG"):
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.fmt = fmt # "JPEG" or "WEBP"
+        self.folder = ""
+        self.lock = threading.Lock()
+        self.total = 0 # folder size at the last scan plus what this process added since
+        self._building = {} # file name -> Lock, so each rendition is generated once
+
+    def open(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        with self.lock:
+            self.folder = folder
+            self.total = self._scan()[1]
+
+    def _scan(self):
+        """The folder's renditions as [(mtime, name, size)], least recently served first, and their total size."""
+        entries = []
+        for f in os.scandir(self.folder):
+            if f.is_file() and not f.name.startswith(".") and not f.name.endswith(".tmp"):
+                try:
+                    st = f.stat()
+                except OSError: # evicted by another process meanwhile
+                    continue
+                entries.append((st.st_mtime, f.name, st.st_size))
+        entries.sort()
+        return entries, sum(e[2] for e in entries)
+
+    def get(self, image_name, max_side):
+        """Path of a rendition whose long edge is at most max_side (the original if already small)."""
+        original = os.path.join(server_state.image_folder, image_name)
+        meta = server_state.image_index.get(image_name)
+        if max(meta.width, meta.height) <= max_side:
+            return original
+        ext = "webp" if self.fmt == "WEBP" else "jpg"
+        fname = f"{server_state.image_index.sha1(image_name)}_{max_side}_q{self.quality}.{ext}"
+        path = os.path.join(self.folder, fname)
+        try:
+            os.utime(path) # a hit: mark it recently served (and check it was not evicted by another process)
+            return path
+        except FileNotFoundError:
+            pass
+        with self.lock:
+            build_lock = self._building.setdefault(fname, threading.Lock())
+        built = 0
+        with build_lock:
+            if not os.path.exists(path):
+                with Image.open(original) as img:
+                    img.draft("RGB", (max_side, max_side)) # JPEG: let the decoder downscale by 1/2..1/8
+                    img = img.convert("RGB")
+                    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=3.0)
+                    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    img.save(tmp, format=self.fmt, quality=self.quality)
+                os.replace(tmp, path)
+                built = os.path.getsize(path)
+        with self.lock:
+            self._building.pop(fname, None)
+            self.total += built
+            if self.total > self.max_bytes:
+                self._evict(keep=fname)
+        return path
+
+    def _evict(self, keep=None):
+        with open(os.path.join(self.folder, self.LOCK_FILE), "w") as lock_file:
+            if fcntl is not None: # without it two workers may evict at once; removals already tolerate that
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries, total = self._scan()
+            for _, fname, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if fname == keep:
+                    continue
+                try:
+                    os.remove(os.path.join(self.folder, fname))
+                except OSError:
+                    continue
+                total -= size
+        self.total = total
+
+    def stats(self):
+        with self.lock:
+            entries, total = self._scan()
+        return {"renditions": len(entries), "bytes": total}
+
+class PreInferenceWorker:
+    """Runs the model ahead of the annotators.
+
+    Images already leased to a client (prefetched, about to be shown) go first,
+    then the next images the work queue will hand out, so `/predict` and
+    `/next_batch` normally find their predictions in the cache.
+    """
+    def __init__(self, lookahead=16, idle_wait=0.5):
+        self.lookahead = lookahead
+        self.idle_wait = idle_wait
+        self.enabled = True
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.stop()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def _uncached(self, handle, n):
+        conf = server_state.conf_threshold
+        out = []
+        for name in server_state.leases.leased_images() + server_state.work_queue.peek(self.lookahead):
+            try:
+                key = PredictionCache.key(server_state.image_index.sha1(name), handle.hash, conf)
+            except OSError:
+                continue
+            if not server_state.prediction_cache.contains(key) and (name, key) not in out:
+                out.append((name, key))
+                if len(out) >= n:
+                    break
+        return out
+
+    def _run(self):
+        engine = server_state.engine
+        while not self._stop.is_set():
+            handle = server_state.models.active
+            if not (self.enabled and handle):
+                self._stop.wait(self.idle_wait)
+                continue
+            try:
+                todo = self._uncached(handle, engine.max_batch)
+                if not todo:
+                    self._stop.wait(self.idle_wait)
+                    continue
+                # Submit a whole batch at once so the engine can run it as one forward pass
+                futures = [(key, engine.submit(server_state.image_cache.get(os.path.join(server_state.image_folder, name)),
+                                               key[2], InferenceEngine.BACKGROUND, handle)) for name, key in todo]
+                for key, future in futures:
+                    server_state.prediction_cache.put(key, future.result())
+            except Exception as e:
+                server_state.log(f"Pre-inference error: {e}")
+                self._stop.wait(5)
+
+class PreAnnotator:
+    """Offline pass of one model over every unlabeled image.
+
+    Images are decoded in a process pool at roughly the model's input size and
+    batched through the engine at background priority. Results go to one
+    SQLite file per model (.cache/preannotations/<model hash>.sqlite), boxes
+    packed as 22-byte records with their confidence, so any serving threshold
+    at or above `conf` can be answered from it. Each committed batch is a
+    checkpoint: a run that is stopped or crashes skips everything already
+    stored when it starts again, and a run that was active when the server
+    went down resumes on startup.
+    """
+    BOX = struct.Struct("<H5f") # class id, x1, y1, x2, y2, confidence
+
+    def __init__(self, conf=0.05, imgsz=640, decode_workers=None, window=64):
+        self.conf = conf
+        self.imgsz = imgsz
+        self.decode_workers = decode_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.window = window
+        self.lock = threading.Lock()
+        self.folder = ""
+        self.stores = {} # model hash -> sqlite connection
+        self.progress = {"status": "idle"}
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def open(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _store(self, model_hash, create=False):
+        with self.lock:
+            db = self.stores.get(model_hash)
+            if db is None:
+                path = os.path.join(self.folder, model_hash[:16] + ".sqlite")
+                if not self.folder or (not create and not os.path.exists(path)):
+                    return None
+                db = sqlite3.connect(path, check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("CREATE TABLE IF NOT EXISTS preds (name TEXT PRIMARY KEY, sha1 TEXT, boxes BLOB)")
+                db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+                db.commit()
+                self.stores[model_hash] = db
+            return db
+
+    def raw(self, image_name, handle, min_conf):
+        """(predictions, confidences) stored for this image and model, or None."""
+        if handle is None or min_conf < self.conf:
+            return None
+        db = self._store(handle.hash)
+        if db is None:
+            return None
+        with self.lock:
+            row = db.execute("SELECT sha1, boxes FROM preds WHERE name = ?", (image_name,)).fetchone()
+        if row is None or row[0] != server_state.image_index.sha1(image_name):
+            return None
+        preds, confs = [], []
+        for cls, x1, y1, x2, y2, c in self.BOX.iter_unpack(row[1]):
+            if c >= min_conf:
+                preds.append((handle.names[cls], [x1, y1, x2, y2]))
+                confs.append(c)
+        return preds, confs
+
+    def lookup(self, image_name, handle, conf):
+        found = self.raw(image_name, handle, conf)
+        return found[0] if found else None
+
+    def start(self, handle=None):
+        handle = handle or server_state.models.active
+        if handle is None:
+            raise RuntimeError("No model loaded")
+        if self._thread and self._thread.is_alive():
+            raise RuntimeError("A pre-annotation run is already active")
+        db = self._store(handle.hash, create=True)
+        with self.lock:
+            db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                           [("state", "running"), ("model", handle.path), ("conf", str(self.conf))])
+            db.commit()
+        self._cancel.clear()
+        self._thread = threading.Thread(target=self._run, args=(handle, db), daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def resume(self):
+        """Restarts an interrupted run for the active model, if there was one."""
+        handle = server_state.models.active
+        db = self._store(handle.hash) if handle else None
+        if db is not None and db.execute("SELECT value FROM meta WHERE key = 'state'").fetchone() == ("running",):
+            server_state.log("Resuming interrupted pre-annotation run")
+            self.start(handle)
+
+    def _run(self, handle, db):
+        engine = server_state.engine
+        with self.lock:
+            stored = dict(db.execute("SELECT name, sha1 FROM preds"))
+        todo = []
+        for name in server_state.work_queue.pending_images():
+            try:
+                if stored.get(name) != server_state.image_index.sha1(name):
+                    todo.append(name)
+            except OSError:
+                pass
+        started = time.perf_counter()
+        self.progress = {"status": "running", "model": handle.path, "total": len(todo), "done": 0, "failed": 0,
+                         "skipped": len(stored), "images_per_sec": 0.0, "eta_sec": None, "started": time.time()}
+        server_state.log(f"Pre-annotating {len(todo)} images with v{handle.version} ({len(stored)} already stored)")
+        names = iter(todo)
+        decoding = deque()
+        batches = deque()
+        batch = []
+        last_log = started
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.decode_workers, mp_context=ctx) as pool:
+            def fill():
+                while len(decoding) < self.window:
+                    name = next(names, None)
+                    if name is None:
+                        return
+                    decoding.append((name, pool.submit(decode_worker.decode_for_inference,
+                                                       os.path.join(server_state.image_folder, name), self.imgsz)))
+            fill()
+            while (decoding or batch or batches) and not self._cancel.is_set():
+                if decoding:
+                    name, decoded = decoding.popleft()
+                    fill()
+                    try:
+                        img, scale = decoded.result()
+                        batch.append((name, scale, engine.submit(img, self.conf, InferenceEngine.BACKGROUND, handle, with_conf=True)))
+                    except Exception as e:
+                        server_state.log(f"Pre-annotation skipped {name}: {e}")
+                        self.progress["failed"] += 1
+                if batch and (len(batch) >= engine.max_batch or not decoding):
+                    batches.append(batch)
+                    batch = []
+                # Keep a couple of batches queued in the engine while committing the oldest
+                while batches and (len(batches) > 2 or not decoding):
+                    self._commit(db, handle, batches.popleft())
+                done = self.progress["done"]
+                rate = done / max(time.perf_counter() - started, 1e-9)
+                self.progress.update(images_per_sec=round(rate, 1), eta_sec=round((len(todo) - done) / rate) if rate else None)
+                if time.perf_counter() - last_log > 30:
+                    last_log = time.perf_counter()
+                    server_state.log(f"Pre-annotation: {done}/{len(todo)} images, {rate:.1f} img/s")
+            for _, decoded in decoding:
+                decoded.cancel()
+
+        finished = not self._cancel.is_set()
+        with self.lock:
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('state', ?)", ("done" if finished else "stopped",))
+            db.commit()
+        self.progress["status"] = "done" if finished else "stopped"
+        server_state.log(f"Pre-annotation {self.progress['status']}: {self.progress['done']} images in "
+                         f"{time.perf_counter() - started:.0f} s ({self.progress['images_per_sec']} img/s)")
+
+    def _commit(self, db, handle, batch):
+        ids = {name: cls for cls, name in handle.names.items()}
+        rows = []
+        for name, (sx, sy), future in batch:
+            try:
+                preds, confs = future.result()
+            except Exception as e:
+                server_state.log(f"Pre-annotation failed on {name}: {e}")
+                self.progress["failed"] += 1
+                continue
+            boxes = b"".join(self.BOX.pack(ids[cls], x1 * sx, y1 * sy, x2 * sx, y2 * sy, c)
+                             for (cls, (x1, y1, x2, y2)), c in zip(preds, confs))
+            rows.append((name, server_state.image_index.sha1(name), boxes))
+        with self.lock:
+            db.executemany("INSERT OR REPLACE INTO preds VALUES (?, ?, ?)", rows)
+            db.commit()
+        self.progress["done"] += len(rows)
+
+    def stats(self):
+        progress = dict(self.progress)
+        handle = server_state.models.active
+        db = self._store(handle.hash) if handle else None
+        if db is not None:
+            with self.lock:
+                progress["stored_for_active_model"] = db.execute("SELECT COUNT(*) FROM preds").fetchone()[0]
+        return progress
+
+class ClassRegistry:
+    """Server-owned list of class names with stable integer IDs and live instance counts.
+
+    IDs are assigned once and never reused, so exported indices do not shift
+    when a class is added. Counts are kept current by `submit_label`; the label
+    folder is only scanned once, to bootstrap a registry that does not exist
+    yet. With `strict` set, submissions using unregistered names are rejected
+    instead of silently creating a new class.
+
+    Count changes are written at most every `save_interval` seconds. A marker
+    file exists while some are unsaved, so after a crash the counts are taken
+    from the labels again instead of drifting.
+    """
+    def __init__(self, strict=False, save_interval=5.0):
+        self.strict = strict
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.path = ""
+        self.ids = {}      # name -> id
+        self.counts = Counter()
+        self._flush_timer = None
+
+    def open(self, label_folder):
+        self.path = os.path.join(label_folder, "classes.json")
+        with self.lock:
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            self.ids, self.counts = {}, Counter()
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    data = json.load(f)
+                for c in data["classes"]:
+                    self.ids[c["name"]] = c["id"]
+                    self.counts[c["name"]] = c.get("count", 0)
+                if not os.path.exists(self.path + ".dirty"):
+                    return
+                self.counts = Counter()
+                for name, count in server_state.labels.class_counts().items():
+                    self.ids.setdefault(name, max(self.ids.values(), default=-1) + 1)
+                    self.counts[name] = count
+                self._save()
+                os.remove(self.path + ".dirty")
+                server_state.log("Class counts recounted from the labels after an unclean shutdown")
+                return
+            # First start on this folder: discover classes from the existing labels once
+            for name, count in server_state.labels.class_counts().items():
+                self.ids.setdefault(name, len(self.ids))
+                self.counts[name] = count
+            self._save()
+        server_state.log(f"Class registry bootstrapped with {len(self.ids)} classes")
+
+    def _save(self):
+        data = {"classes": [{"id": i, "name": n, "count": self.counts[n]} for n, i in sorted(self.ids.items(), key=lambda x: x[1])]}
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(data, f, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+    def register(self, name):
+        name = name.strip()
+        if not name or any(ch.isspace() for ch in name):
+            raise ValueError(f"Invalid class name: {name!r}")
+        with self.lock:
+            if name not in self.ids:
+                self.ids[name] = max(self.ids.values(), default=-1) + 1
+                self._save()
+                server_state.log(f"New class '{name}' registered with id {self.ids[name]}")
+            return self.ids[name]
+
+    def check(self, names):
+        """Registers unknown names in the order they first appear, or raises ValueError for them in strict mode."""
+        unknown = [n for n in dict.fromkeys(names) if n not in self.ids]
+        if unknown and self.strict:
+            raise ValueError(f"Unknown classes: {', '.join(unknown)}")
+        for name in unknown:
+            self.register(name)
+
+    def update_counts(self, old, new):
+        """Applies the instance-count change of one label file rewrite (two Counters)."""
+        if old == new:
+            return
+        with self.lock:
+            self.counts.update(new)
+            self.counts.subtract(old)
+            if self._flush_timer is None:
+                open(self.path + ".dirty", "w").close()
+                self._flush_timer = threading.Timer(self.save_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self):
+        with self.lock:
+            self._flush_timer = None
+            self._save()
+            if os.path.exists(self.path + ".dirty"):
+                os.remove(self.path + ".dirty")
+
+    def id_map(self):
+        with self.lock:
+            return dict(self.ids)
+
+    def names(self):
+        """Names indexed by id; ids that were never assigned stay as placeholders."""
+        with self.lock:
+            out = [f"unused_{i}" for i in range(max(self.ids.values(), default=-1) + 1)]
+            for name, i in self.ids.items():
+                out[i] = name
+            return out
+
+    def listing(self):
+        with self.lock:
+            return [{"id": i, "name": n, "count": self.counts[n]} for n, i in sorted(self.ids.items(), key=lambda x: x[1])]
+
+def read_label_classes(txt_path):
+    """Counter of class names in one label file (empty if it does not exist)."""
+    counts = Counter()
+    try:
+        with open(txt_path) as f:
+            for line in f:
+                parts = line.split()
+                if parts:
+                    counts[parts[0]] += 1
+    except FileNotFoundError:
+        pass
+    return counts
+
+class LabelStore:
+    """Common part of the label backends: per-image locking and a group-committing writer.
+
+    `write` serializes writers of the same image with striped locks (keyed by
+    base name, as img.jpg and img.png share labels), hands the record to one
+    committer thread and returns once it is durable. The committer takes every
+    record that queued up meanwhile and makes them durable together, so one
+    fsync covers a whole burst of submissions. Backends implement `_commit`
+    and the read side.
+    """
+    STRIPES = 256
+
+    def __init__(self):
+        self.folder = ""
+        self.stripes = [threading.Lock() for _ in range(self.STRIPES)]
+        self.pending = queue.Queue() # (record, Future) waiting for the committer
+        self.stats_lock = threading.Lock()
+        self.records = 0
+        self.commits = 0
+        self.commit_time = 0.0
+        self._thread = None
+
+    @staticmethod
+    def base(image_name):
+        return os.path.splitext(image_name)[0]
+
+    def _start_committer(self):
+        if not self._thread:
+            self._thread = threading.Thread(target=self._commit_loop, daemon=True)
+            self._thread.start()
+
+    def write(self, image_name, user_name, lines):
+        """Durably replaces the labels of one image; returns the previous lines (None if there were none)."""
+        with self.stripes[hash(self.base(image_name)) % self.STRIPES]:
+            previous = self.read(image_name)
+            record = {"seq": 0, "time": time.time(), "user": user_name, "image": image_name,
+                      "labels": lines, "previous": previous}
+            future = Future()
+            self.pending.put((record, future))
+            future.result()
+            self._after_commit(record)
+            return previous
+
+    def _after_commit(self, record):
+        pass
+
+    def _commit_loop(self):
+        while True:
+            group = [self.pending.get()]
+            while True:
+                try:
+                    group.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            started = time.perf_counter()
+            try:
+                self._commit([record for record, _ in group])
+                for _, future in group:
+                    future.set_result(None)
+            except Exception as e:
+                for _, future in group:
+                    future.set_exception(e)
+            with self.stats_lock:
+                self.records += len(group)
+                self.commits += 1
+                self.commit_time += time.perf_counter() - started
+
+    def stats(self):
+        with self.stats_lock:
+            commits = max(self.commits, 1)
+            return {"backend": self.NAME, "records": self.records, "commits": self.commits,
+                    "records_per_commit": round(self.records / commits, 2),
+                    "avg_commit_ms": round(self.commit_time / commits * 1000, 2)}
+
+class FileLabelStore(LabelStore):
+    """YOLO .txt files in labels_collected/, made crash-safe by a write-ahead journal.
+
+    A submission is appended to .journal/labels.journal (user, time, new and
+    previous lines) and fsynced, then the label file is replaced through a
+    temp file and os.replace, so readers and the work queue only ever see a
+    complete file. On startup, records from the last session are replayed
+    onto any label file that does not match them and stray temp files are
+    removed. Aggregate queries scan the folder.
+    """
+    NAME = "files"
+
+    def __init__(self, max_journal_bytes=64 * 1024 ** 2):
+        super().__init__()
+        self.max_journal_bytes = max_journal_bytes
+        self.journal = None
+        self.journal_path = ""
+        self.seq = 0
+
+    def path(self, image_name):
+        return os.path.join(self.folder, self.base(image_name) + ".txt")
+
+    def open(self, label_folder):
+        self.folder = label_folder
+        journal_dir = os.path.join(label_folder, ".journal")
+        os.makedirs(journal_dir, exist_ok=True)
+        self.journal_path = os.path.join(journal_dir, "labels.journal")
+        self.recover(self.journal_path, os.path.join(journal_dir, "checkpoint"))
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > self.max_journal_bytes:
+            os.replace(self.journal_path, os.path.join(journal_dir, f"labels-{datetime.now():%Y%m%d_%H%M%S}.journal"))
+        self.journal = open(self.journal_path, "ab")
+        self._start_committer()
+
+    def _journal_records(self, path):
+        try:
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        return # torn last append: that submission was never acknowledged
+        except FileNotFoundError:
+            return
+
+    def recover(self, journal_path, checkpoint_path):
+        for f in os.listdir(self.folder):
+            if f.endswith(".tmp"):
+                os.remove(os.path.join(self.folder, f))
+        try:
+            with open(checkpoint_path) as f:
+                checkpoint = int(f.read() or 0)
+        except (OSError, ValueError):
+            checkpoint = 0
+        latest = {}
+        for record in self._journal_records(journal_path):
+            self.seq = max(self.seq, record["seq"])
+            if record["seq"] > checkpoint:
+                latest[record["image"]] = record["labels"]
+        repaired = 0
+        for image_name, lines in latest.items():
+            if self.read(image_name) != lines:
+                self._replace(image_name, lines, sync=True)
+                repaired += 1
+            else:
+                # Matching files may still only be in the page cache after a process restart
+                with open(self.path(image_name), "rb+") as f: # Windows only fsyncs handles opened for writing
+                    os.fsync(f.fileno())
+        if os.name != "nt": # directories cannot be opened for an fsync on Windows
+            fd = os.open(self.folder, os.O_RDONLY)
+            os.fsync(fd)
+            os.close(fd)
+        if latest:
+            server_state.log(f"Label journal: checked {len(latest)} files from the last session, repaired {repaired}")
+        with open(checkpoint_path + ".tmp", "w") as f:
+            f.write(str(self.seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+    def read(self, image_name):
+        """Lines of the label file, or None if the image has no labels."""
+        try:
+            with open(self.path(image_name)) as f:
+                return [line.rstrip("\n") for line in f if line.strip()]
+        except FileNotFoundError:
+            return None
+
+    def _replace(self, image_name, lines, sync=False):
+        path = self.path(image_name)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            f.writelines(line + "\n" for line in lines)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _commit(self, records):
+        data = b""
+        for record in records:
+            self.seq += 1
+            record["seq"] = self.seq
+            data += json.dumps(record).encode() + b"\n"
+        self.journal.write(data)
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def _after_commit(self, record):
+        self._replace(record["image"], record["labels"])
+
+    def labeled_bases(self):
+        if not os.path.isdir(self.folder):
+            return set()
+        return {f[:-4] for f in os.listdir(self.folder) if f.endswith(".txt")}
+
+    def version(self, image_name):
+        try:
+            st = os.stat(self.path(image_name))
+        except OSError:
+            return None
+        return [st.st_mtime, st.st_size]
+
+    def class_counts(self):
+        counts = Counter()
+        for base in sorted(self.labeled_bases()):
+            counts.update(read_label_classes(os.path.join(self.folder, base + ".txt")))
+        return counts
+
+    def images_with_class(self, name):
+        return sorted(base for base in self.labeled_bases() if name in read_label_classes(os.path.join(self.folder, base + ".txt")))
+
+    def history(self, image_name):
+        journals = sorted(f for f in os.listdir(os.path.dirname(self.journal_path)) if f.endswith(".journal") and f != "labels.journal")
+        out = []
+        for path in [os.path.join(os.path.dirname(self.journal_path), f) for f in journals] + [self.journal_path]:
+            out += [{"user": r["user"], "time": r["time"], "labels": r["labels"]}
+                    for r in self._journal_records(path) if self.base(r["image"]) == self.base(image_name)]
+        return out
+
+    def stats(self):
+        return dict(super().stats(), last_seq=self.seq)
+
+class SQLiteLabelStore(LabelStore):
+    """Labels in labels_collected/labels.sqlite (WAL, synchronous=FULL).
+
+    Boxes, per-image state and every previous version live in indexed
+    tables, so completion checks, class counts and per-class queries do not
+    touch the file system; the YOLO .txt tree only exists in exports. Each
+    group of submissions is one transaction. On first open of a folder that
+    already has .txt labels, they are imported (see `import_folder`).
+    """
+    NAME = "sqlite"
+
+    def __init__(self):
+        super().__init__()
+        self.db = None
+        self.db_path = ""
+        self.local = threading.local() # read connection per thread
+
+    def open(self, label_folder):
+        self.folder = label_folder
+        self.db_path = os.path.join(label_folder, "labels.sqlite")
+        self.local = threading.local()
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS images (base TEXT PRIMARY KEY, image TEXT, version INTEGER, user TEXT, updated REAL);
+            CREATE TABLE IF NOT EXISTS boxes (base TEXT, cls TEXT, cx REAL, cy REAL, w REAL, h REAL);
+            CREATE INDEX IF NOT EXISTS boxes_base ON boxes (base);
+            CREATE INDEX IF NOT EXISTS boxes_cls ON boxes (cls, base);
+            CREATE TABLE IF NOT EXISTS history (base TEXT, version INTEGER, user TEXT, time REAL, labels TEXT,
+                                                PRIMARY KEY (base, version));
+        """)
+        self.db.commit()
+        if self.db.execute("SELECT COUNT(*) FROM images").fetchone()[0] == 0:
+            imported = self.import_folder(label_folder)
+            if imported:
+                server_state.log(f"Imported {imported} label files from {label_folder} into {self.db_path}")
+        self._start_committer()
+
+    def _reader(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        return db
+
+    @staticmethod
+    def _parse(lines):
+        boxes = []
+        for line in lines:
+            parts = line.split()
+            if len(parts) >= 5:
+                boxes.append((parts[0], *map(float, parts[1:5])))
+        return boxes
+
+    def read(self, image_name):
+        db = self._reader()
+        base = self.base(image_name)
+        if db.execute("SELECT 1 FROM images WHERE base = ?", (base,)).fetchone() is None:
+            return None
+        return [f"{cls} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}"
+                for cls, cx, cy, w, h in db.execute("SELECT cls, cx, cy, w, h FROM boxes WHERE base = ? ORDER BY rowid", (base,))]
+
+    def _commit(self, records, db=None):
+        db = db or self.db
+        with db:
+            for record in records:
+                base = self.base(record["image"])
+                row = db.execute("SELECT version FROM images WHERE base = ?", (base,)).fetchone()
+                version = (row[0] if row else 0) + 1
+                db.execute("DELETE FROM boxes WHERE base = ?", (base,))
+                db.executemany("INSERT INTO boxes VALUES (?, ?, ?, ?, ?, ?)", [(base, *box) for box in self._parse(record["labels"])])
+                db.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?)", (base, record["image"], version, record["user"], record["time"]))
+                db.execute("INSERT INTO history VALUES (?, ?, ?, ?, ?)", (base, version, record["user"], record["time"], json.dumps(record["labels"])))
+
+    def import_folder(self, label_folder, user_name="import"):
+        """Migration: loads every .txt in a labels_collected/ folder; returns the number of files imported."""
+        records = []
+        for f in sorted(os.listdir(label_folder)):
+            if f.endswith(".txt"):
+                path = os.path.join(label_folder, f)
+                with open(path) as src:
+                    lines = [line.rstrip("\n") for line in src if line.strip()]
+                records.append({"image": f[:-4], "user": user_name, "time": os.path.getmtime(path), "labels": lines})
+        for i in range(0, len(records), 5000):
+            self._commit(records[i:i + 5000])
+        return len(records)
+
+    def labeled_bases(self):
+        return {row[0] for row in self._reader().execute("SELECT base FROM images")}
+
+    def version(self, image_name):
+        row = self._reader().execute("SELECT version, updated FROM images WHERE base = ?", (self.base(image_name),)).fetchone()
+        return list(row) if row else None
+
+    def class_counts(self):
+        return Counter(dict(self._reader().execute("SELECT cls, COUNT(*) FROM boxes GROUP BY cls ORDER BY MIN(rowid)")))
+
+    def images_with_class(self, name):
+        return [row[0] for row in self._reader().execute("SELECT DISTINCT base FROM boxes WHERE cls = ? ORDER BY base", (name,))]
+
+    def history(self, image_name):
+        return [{"user": u, "time": t, "labels": json.loads(labels), "version": v}
+                for v, u, t, labels in self._reader().execute(
+                    "SELECT version, user, time, labels FROM history WHERE base = ? ORDER BY version", (self.base(image_name),))]
+
+LABEL_BACKENDS = {"files": FileLabelStore, "sqlite": SQLiteLabelStore}
+
+FICLONE = 0x40049409 # Linux ioctl: share extents between two files (btrfs, xfs)
+
+def place_file(src, dst, mode):
+    """Puts src at dst without copying bytes where possible; returns the method used."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+        return "symlink"
+    if mode in ("auto", "hardlink"):
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            if mode == "hardlink":
+                raise
+    if fcntl is not None:
+        try:
+            with open(src, "rb") as fs, open(dst, "wb") as fd:
+                fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+            return "reflink"
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+class DatasetExporter:
+    """Keeps one materialized YOLO dataset in sync with labels_collected/.
+
+    A manifest in the target records, per image, the label and image file
+    stats it was built from. A sync rewrites (in parallel) only labels that
+    changed, places only images that are new or replaced, and removes entries
+    whose labels are gone. Images are hardlinked where the filesystem allows,
+    then reflinked, then copied; `link_mode="symlink"` writes the whole layout
+    without copying any image bytes.
+    """
+    MODES = ("auto", "hardlink", "symlink", "copy")
+    MANIFEST = ".export_manifest.json"
+
+    def __init__(self, workers=8):
+        self.workers = workers
+        self.lock = threading.Lock() # one sync at a time (export tab and training share it)
+
+    def _load_manifest(self, target_path):
+        try:
+            with open(os.path.join(target_path, self.MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"entries": {}, "classes": []}
+
+    def sync(self, target_path, link_mode="auto", exclude=()):
+        """Brings target_path up to date, leaving out the `exclude` images; returns (yaml_path, image_count, changed_count)."""
+        if link_mode not in self.MODES:
+            raise ValueError(f"link_mode must be one of {self.MODES}")
+        with self.lock:
+            img_dir = os.path.join(target_path, "images")
+            lbl_dir = os.path.join(target_path, "labels")
+            os.makedirs(img_dir, exist_ok=True)
+            os.makedirs(lbl_dir, exist_ok=True)
+            manifest = self._load_manifest(target_path)
+            old = manifest["entries"]
+
+            def stat_pair(img):
+                label_version = server_state.labels.version(img)
+                try:
+                    ims = os.stat(os.path.join(server_state.image_folder, img))
+                except OSError:
+                    return None
+                if label_version is None:
+                    return None
+                return img, {"label": label_version, "image": [ims.st_mtime, ims.st_size]}
+
+            with ThreadPoolExecutor(self.workers) as pool:
+                exclude = set(exclude)
+                labeled = [img for img in server_state.work_queue.labeled_images() if img not in exclude]
+                current = dict(r for r in pool.map(stat_pair, labeled, chunksize=256) if r)
+                changed_labels = [img for img, st in current.items() if img not in old or old[img]["label"] != st["label"]]
+
+                # Registry ids are stable, so new classes do not shift existing indices; only a
+                # registry that no longer extends the one this export was built with forces a full rewrite
+                class_list = server_state.classes.names()
+                previous = manifest["classes"]
+                rewrite = changed_labels if class_list[:len(previous)] == previous else list(current)
+                dropped = sum(pool.map(lambda img: self._write_label(img, lbl_dir), rewrite))
+                class_list = server_state.classes.names() # _write_label may have registered stray names
+
+                place = [img for img, st in current.items()
+                         if img not in old or old[img]["image"] != st["image"] or old[img].get("mode") != link_mode]
+                methods = list(pool.map(lambda img: place_file(os.path.join(server_state.image_folder, img),
+                                                               os.path.join(img_dir, img), link_mode), place))
+            for img, method in zip(place, methods):
+                current[img]["placed"] = method
+            for img, st in current.items():
+                st["mode"] = link_mode
+                st.setdefault("placed", old.get(img, {}).get("placed"))
+
+            for img in set(old) - set(current):
+                for path in (os.path.join(img_dir, img), os.path.join(lbl_dir, os.path.splitext(img)[0] + ".txt")):
+                    if os.path.lexists(path):
+                        os.remove(path)
+
+            tmp = os.path.join(target_path, self.MANIFEST + ".tmp")
+            with open(tmp, "w") as f:
+                json.dump({"entries": current, "classes": class_list}, f)
+            os.replace(tmp, os.path.join(target_path, self.MANIFEST))
+
+            yaml_content = {'path': os.path.abspath(target_path), 'train': 'images', 'val': 'images', 'nc': len(class_list), 'names': class_list}
+            yaml_path = os.path.join(target_path, "data.yaml")
+            with open(yaml_path, 'w') as yf:
+                yaml.dump(yaml_content, yf)
+
+            server_state.log(f"Export sync {target_path}: {len(current)} images, {len(rewrite)} labels rewritten, "
+                             f"{len(place)} images placed, {len(set(old) - set(current))} removed"
+                             + (f", {dropped} invalid boxes dropped" if dropped else ""))
+            return yaml_path, len(current), len(rewrite) + len(place)
+
+    def _write_label(self, img, lbl_dir):
+        """Writes one label file with class ids; returns how many boxes were dropped as invalid.
+
+        Ultralytics discards every label of an image that has a box outside
+        0..1, so boxes are clipped to the image and empty ones dropped here.
+        """
+        tname = os.path.splitext(img)[0] + ".txt"
+        remap = server_state.classes.id_map() # dict lookup per line instead of list.index
+        classes, boxes = geometry.parse_yolo(server_state.labels.read(img))
+        for cls in classes:
+            if cls not in remap: # label file written outside submit_label
+                remap[cls] = server_state.classes.register(cls)
+        boxes = geometry.clip_cxcywh(boxes)
+        keep = geometry.valid_cxcywh(boxes)
+        lines = geometry.format_yolo([remap[cls] for cls, kept in zip(classes, keep) if kept], boxes[keep])
+        tmp = os.path.join(lbl_dir, tname + ".tmp")
+        with open(tmp, "w") as dest_t:
+            dest_t.writelines(line + "\n" for line in lines)
+        os.replace(tmp, os.path.join(lbl_dir, tname))
+        return len(classes) - len(lines)
+
+class TrainingScheduler:
+    """Persistent queue of training jobs, run one at a time in a separate process.
+
+    Jobs are stored in labels_collected/.training/jobs.json, so queued jobs
+    survive a restart (a job that was running is queued again). The worker
+    process runs with a thread limit and raised niceness so training does not
+    starve the serving model, and reports per-epoch metrics that are kept on
+    the job for the GUI and the `/training/jobs/{id}/events` stream.
+    """
+    ACTIVE = ("preparing", "running")
+
+    def __init__(self, threads=None, nice=10):
+        self.threads = threads or max(1, (os.cpu_count() or 2) // 2)
+        self.nice = nice
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.jobs = OrderedDict() # id -> job dict
+        self.folder = ""
+        self.process = None
+        self.current = None
+        self.on_finished = [] # callbacks(job), called from the scheduler thread
+        self._thread = None
+
+    def open(self, label_folder):
+        self.folder = os.path.join(label_folder, ".training")
+        os.makedirs(self.folder, exist_ok=True)
+        with self.lock:
+            self.jobs = OrderedDict()
+            try:
+                with open(os.path.join(self.folder, "jobs.json")) as f:
+                    for job in json.load(f):
+                        if job["status"] in self.ACTIVE:
+                            job["status"] = "queued" # interrupted by a server restart
+                        self.jobs[job["id"]] = job
+            except (OSError, ValueError):
+                pass
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self.wakeup.set()
+
+    def _save(self):
+        path = os.path.join(self.folder, "jobs.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(list(self.jobs.values()), f, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def _update(self, job_id, **changes):
+        with self.lock:
+            self.jobs[job_id].update(changes)
+            self._save()
+
+    def submit(self, epochs, batch, imgsz=640, base_model=None, auto=False):
+        job = {"id": datetime.now().strftime("%Y%m%d_%H%M%S_") + uuid.uuid4().hex[:6], "status": "queued",
+               "epochs": int(epochs), "batch": int(batch), "imgsz": int(imgsz),
+               "base_model": base_model or server_state.model_path or "yolov8x.pt",
+               "created": time.time(), "started": None, "finished": None,
+               "metrics": [], "model": None, "error": None, "auto": auto}
+        with self.lock:
+            self.jobs[job["id"]] = job
+            self._save()
+        self.wakeup.set()
+        server_state.log(f"Training job {job['id']} queued ({epochs} epochs)")
+        return job
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] not in ("queued",) + self.ACTIVE:
+                return False
+            job["status"] = "cancelled"
+            job["finished"] = time.time()
+            self._save()
+            if self.current == job_id and self.process is not None:
+                self.process.terminate()
+        server_state.log(f"Training job {job_id} cancelled")
+        return True
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def listing(self):
+        with self.lock:
+            return [dict(j, metrics=j["metrics"][-1:]) for j in self.jobs.values()]
+
+    def _next_queued(self):
+        with self.lock:
+            return next((j["id"] for j in self.jobs.values() if j["status"] == "queued"), None)
+
+    def _run(self):
+        while True:
+            job_id = self._next_queued()
+            if job_id is None:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            try:
+                self._run_job(job_id)
+            except Exception as e:
+                self._update(job_id, status="failed", error=str(e), finished=time.time())
+                server_state.log(f"Training job {job_id} failed: {e}")
+            with self.lock:
+                self.current, self.process = None, None
+                job = dict(self.jobs[job_id])
+            for callback in self.on_finished:
+                try:
+                    callback(job)
+                except Exception as e:
+                    server_state.log(f"Training callback failed: {e}")
+
+    def _run_job(self, job_id):
+        import training_worker
+        self._update(job_id, status="preparing", started=time.time())
+        self.current = job_id
+        train_dir = os.path.join(server_state.image_folder, "server_train")
+        yaml_path, count, _ = server_state.exporter.sync(train_dir, exclude=server_state.models.holdout())
+        if count == 0:
+            raise RuntimeError("No labeled data found")
+
+        ctx = multiprocessing.get_context("spawn")
+        events = ctx.Queue()
+        with self.lock:
+            if self.jobs[job_id]["status"] == "cancelled":
+                return
+            job = dict(self.jobs[job_id], data=yaml_path, threads=self.threads, nice=self.nice,
+                       project=os.path.join(self.folder, "runs"))
+            self.process = ctx.Process(target=training_worker.run_training_job, args=(job, events), daemon=True)
+            self.process.start()
+            self.jobs[job_id]["status"] = "running"
+            self._save()
+        server_state.log(f"Training job {job_id} started on {count} images (pid {self.process.pid}, {self.threads} threads, nice {self.nice})")
+
+        outcome = None
+        while outcome is None:
+            try:
+                event = events.get(timeout=1)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    break
+                continue
+            if event["type"] == "epoch":
+                with self.lock:
+                    self.jobs[job_id]["metrics"].append({k: v for k, v in event.items() if k != "type"})
+                    self._save()
+            else:
+                outcome = event
+        self.process.join(timeout=10)
+
+        if self.get(job_id)["status"] == "cancelled":
+            return
+        if outcome and outcome["type"] == "done":
+            self._update(job_id, status="completed", model=outcome["model"], finished=time.time())
+            server_state.log(f"Training job {job_id} complete: {outcome['model']}")
+        else:
+            error = outcome["message"] if outcome else f"worker exited with code {self.process.exitcode}"
+            self._update(job_id, status="failed", error=error, finished=time.time())
+            server_state.log(f"Training job {job_id} failed: {error}")
+
+class ActiveLearning:
+    """Retrains every `retrain_every` submissions and hands out the most uncertain images first.
+
+    Every pending image is scored once per model version at a low confidence
+    threshold and the score is kept in SQLite with the model hash, so a restart
+    or a reorder never rescans what is already scored; only images the active
+    model has not seen go through the engine. Scores feed `WorkQueue.prioritize`.
+
+    Methods: "least_confidence" (1 - best box confidence, 1.0 for no boxes),
+    "entropy" (mean binary entropy of the box confidences) and "disagreement"
+    (share of boxes the previous loaded version does not match at IoU 0.5).
+    """
+    METHODS = ("least_confidence", "entropy", "disagreement")
+
+    def __init__(self, retrain_every=200, method="least_confidence", score_conf=0.05, epochs=50, batch=16):
+        self.enabled = True
+        self.retrain_every = retrain_every
+        self.method = method
+        self.score_conf = score_conf
+        self.epochs = epochs
+        self.batch = batch
+        self.lock = threading.Lock()
+        self.db = None
+        self.scored = {} # image_name -> hash of the model that scored it
+        self.since_retrain = 0
+        self.wakeup = threading.Event()
+        self._cursor = None # ((model hash, method), iterator over a pending-queue snapshot)
+        self._thread = None
+
+    def open(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self.lock:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS scores (name TEXT PRIMARY KEY, model TEXT, method TEXT, score REAL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'since_retrain'").fetchone()
+            self.since_retrain = int(row[0]) if row else 0
+            rows = self.db.execute("SELECT name, model, score FROM scores WHERE method = ?", (self.method,)).fetchall()
+            self.scored = {name: model for name, model, _ in rows}
+        # Scores from an older model still beat scan order until they are refreshed
+        server_state.work_queue.prioritize({name: score for name, _, score in rows})
+        if self.training_finished not in server_state.training.on_finished:
+            server_state.training.on_finished.append(self.training_finished)
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def note_submission(self):
+        # Test, queue and reset under one lock so two submissions crossing the threshold queue one job
+        with self.lock:
+            self.since_retrain += 1
+            due = self.enabled and self.retrain_every and self.since_retrain >= self.retrain_every
+            if due and not any(j["status"] in ("queued",) + TrainingScheduler.ACTIVE for j in server_state.training.listing()):
+                server_state.log(f"Active learning: {self.since_retrain} new labels, queueing retraining")
+                server_state.training.submit(self.epochs, self.batch, auto=True)
+                self.since_retrain = 0
+            self._save_counter()
+
+    def _save_counter(self):
+        # The queued job is already in jobs.json, so a crash here can at worst re-count, never re-queue
+        if self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('since_retrain', ?)", (str(self.since_retrain),))
+            self.db.commit()
+
+    def training_finished(self, job):
+        if job.get("auto") and job["status"] == "completed":
+            server_state.models.promote(job["model"]).add_done_callback(lambda f: self.wakeup.set())
+
+    def set_method(self, method):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown method {method!r}, expected one of {self.METHODS}")
+        with self.lock:
+            self.method = method
+            rows = self.db.execute("SELECT name, model, score FROM scores WHERE method = ?", (method,)).fetchall() if self.db else []
+            self.scored = {name: model for name, model, _ in rows}
+        server_state.work_queue.prioritize({name: score for name, _, score in rows})
+        self.wakeup.set()
+
+    def _todo(self, handle, n):
+        """Next `n` unscored images, walking one snapshot of the queue across calls."""
+        key = (handle.hash, self.method)
+        with self.lock:
+            for fresh in (False, True):
+                if fresh or self._cursor is None or self._cursor[0] != key:
+                    self._cursor = (key, iter(server_state.work_queue.pending_images()))
+                scored = self.scored
+                todo = list(itertools.islice((img for img in self._cursor[1] if scored.get(img) != handle.hash), n))
+                if todo:
+                    return todo
+            self._cursor = None
+            return []
+
+    def _run(self):
+        engine = server_state.engine
+        while True:
+            handle = server_state.models.active
+            todo = self._todo(handle, engine.max_batch * 4) if (self.enabled and handle) else []
+            if not todo:
+                self.wakeup.wait(30)
+                self.wakeup.clear()
+                continue
+            try:
+                self._score_batch(handle, todo)
+            except Exception as e:
+                server_state.log(f"Active learning scoring error: {e}")
+                self.wakeup.wait(5)
+
+    def _score_batch(self, handle, names):
+        engine, method, conf = server_state.engine, self.method, server_state.conf_threshold
+        previous = None
+        if method == "disagreement":
+            loaded = [v for v in server_state.models.versions.values() if v.model is not None and v is not handle]
+            previous = loaded[-1] if loaded else None
+
+        def submit(h):
+            futures = []
+            for n in names:
+                stored = server_state.preannotator.raw(n, h, self.score_conf)
+                if stored is None:
+                    futures.append(engine.submit(server_state.image_cache.get(os.path.join(server_state.image_folder, n)),
+                                                 self.score_conf, InferenceEngine.BACKGROUND, h, with_conf=True))
+                else:
+                    futures.append(Future())
+                    futures[-1].set_result(stored)
+            return futures
+        futures = submit(handle)
+        previous_futures = submit(previous) if previous else None
+        scores = {}
+        for i, (name, future) in enumerate(zip(names, futures)):
+            preds, confs = future.result()
+            if method == "entropy":
+                score = sum(-c * math.log(c) - (1 - c) * math.log(1 - c) for c in confs if 0 < c < 1) / max(len(confs), 1)
+            elif method == "disagreement":
+                score = disagreement(preds, previous_futures[i].result()[0]) if previous else (1 - max(confs, default=0.0))
+            else:
+                score = 1 - max(confs, default=0.0)
+            scores[name] = round(score, 5)
+            # Boxes above the serving threshold are exactly what a normal predict would return
+            try:
+                key = PredictionCache.key(server_state.image_index.sha1(name), handle.hash, conf)
+                server_state.prediction_cache.put(key, [p for p, c in zip(preds, confs) if c >= conf])
+            except OSError:
+                pass
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                                [(n, handle.hash, method, sc) for n, sc in scores.items()])
+            self.db.commit()
+            if method == self.method:
+                self.scored.update((n, handle.hash) for n in scores)
+        server_state.work_queue.prioritize(scores)
+
+    def stats(self):
+        handle = server_state.models.active
+        with self.lock:
+            current = sum(1 for model in self.scored.values() if handle and model == handle.hash)
+            return {"enabled": self.enabled, "method": self.method, "retrain_every": self.retrain_every,
+                    "since_retrain": self.since_retrain, "scored_by_active_model": current,
+                    "pending": len(server_state.work_queue.pending_images()), "next": server_state.work_queue.peek(5)}
+
+def disagreement(a, b):
+    """Share of boxes in either prediction set without a same-class partner at IoU 0.5 in the other."""
+    if not a and not b:
+        return 0.0
+    unmatched = list(b)
+    matched = 0
+    for cls, box in a:
+        best = max(((box_iou(box, o[1]), o) for o in unmatched if o[0] == cls), default=(0, None), key=lambda x: x[0])
+        if best[0] >= 0.5:
+            unmatched.remove(best[1])
+            matched += 1
+    return 1 - 2 * matched / (len(a) + len(b))
+
 class ServerState:
     def __init__(self):
         self.image_folder = ""
         self.label_folder = ""
         self.model_path = "yolov8x.pt"
-        self.model = None
+        self.export_roots = []
+        self.model_roots = []
+        self.models = ModelRegistry()
         self.conf_threshold = 0.25  # Default Confidence
-        self.in_progress = {} # {user: image_name}
+        self.image_index = ImageIndex()
+        self.work_queue = WorkQueue()
+        self.leases = LeaseManager(self.work_queue)
+        self.prediction_cache = PredictionCache()
+        self.image_cache = DecodedImageCache()
+        self.renditions = RenditionCache()
+        self.exporter = DatasetExporter()
+        self.classes = ClassRegistry()
+        self.labels = FileLabelStore()
+        self.training = TrainingScheduler()
+        self.active_learning = ActiveLearning()
+        self.engine = InferenceEngine()
+        self.preinference = PreInferenceWorker()
+        self.preannotator = PreAnnotator()
         self.app = FastAPI()
-        self.log_callback = None 
+        self.metrics = Metrics()
+        self.log_lines = deque(maxlen=2000) # (seq, time, message); the GUI drains it with root.after
+        self.log_seq = 0
+        self.log_lock = threading.Lock()
 
     def log(self, message):
+        """Thread-safe: prints and appends to a bounded buffer, never touches Tk."""
         print(message)
-        if self.log_callback:
-            self.log_callback(message)
+        with self.log_lock:
+            self.log_seq += 1
+            self.log_lines.append((self.log_seq, datetime.now(), message))
+
+    def logs_since(self, seq):
+        with self.log_lock:
+            return [entry for entry in self.log_lines if entry[0] > seq]
+
+    def load_model(self, path, check_holdout=True, force=False):
+        """Starts loading `path` in the background; returns a Future that resolves once it serves requests."""
+        return self.models.promote(path, check_holdout, force)
+
+    def set_folder(self, image_folder):
+        self.image_folder = image_folder
+        self.label_folder = os.path.join(image_folder, "labels_collected")
+        os.makedirs(self.label_folder, exist_ok=True)
+
+    def start(self, config):
+        """Opens the stores and starts the background workers; returns the Future of the initial model, or None."""
+        self.set_folder(config["image_folder"])
+        self.export_roots = [os.path.realpath(p) for p in config["export_roots"] or [self.image_folder]]
+        self.model_roots = [os.path.realpath(p) for p in config["model_roots"] or [self.image_folder, os.path.dirname(os.path.abspath(config["model"]))]]
+        self.conf_threshold = float(config["conf_threshold"])
+        self.classes.strict = bool(config["strict_classes"])
+        self.preinference.enabled = bool(config["preinference"])
+        self.training.threads = config["training"]["threads"] or self.training.threads
+        self.training.nice = config["training"]["nice"]
+        al = config["active_learning"]
+        if al["method"] not in ActiveLearning.METHODS:
+            raise ValueError(f"Unknown active learning method {al['method']!r}, expected one of {ActiveLearning.METHODS}")
+        self.active_learning.enabled, self.active_learning.retrain_every, self.active_learning.method = al["enabled"], al["retrain_every"], al["method"]
+        cache = os.path.join(self.label_folder, ".cache")
+        self.prediction_cache.open(os.path.join(cache, "predictions"), config["prediction_cache_files"]) # before the model load prunes it
+
+        model_loaded = None
+        if os.path.exists(config["model"]):
+            model_loaded = self.load_model(config["model"], check_holdout=False)
+        else:
+            self.log(f"Warning: model file {config['model']} not found. Server started without model.")
+
+        self.image_index.open(self.image_folder, os.path.join(cache, "image_index.sqlite"))
+        self.labels = LABEL_BACKENDS[config["label_backend"]]()
+        self.labels.open(self.label_folder)
+        self.classes.open(self.label_folder)
+        self.training.open(self.label_folder)
+        self.work_queue.start(self.image_folder, self.label_folder)
+        self.active_learning.open(os.path.join(cache, "active_learning.sqlite"))
+        self.leases.start()
+        self.renditions.open(os.path.join(cache, "renditions"))
+        self.engine.start()
+        self.preinference.start()
+        self.preannotator.open(os.path.join(cache, "preannotations"))
+        if model_loaded:
+            model_loaded.add_done_callback(lambda f: f.exception() is None and self.preannotator.resume())
+        self.log(f"Indexed pool: {self.work_queue.stats()}")
+        return model_loaded
+
+# --- HTTP MIDDLEWARE ---
+
+IMAGE_ROUTES = {"/next_image", "/get_image_specific"}
+
+class GzipRequestMiddleware:
+    """Accepts request bodies sent with `Content-Encoding: gzip` (client label submissions)."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (b"content-encoding", b"gzip") not in scope["headers"]:
+            await self.app(scope, receive, send)
+            return
+        body, more = b"", True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+        body = gzip.decompress(body)
+        headers = [(k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")]
+        headers.append((b"content-length", str(len(body)).encode()))
+        delivered = False
+
+        async def receive_decoded():
+            nonlocal delivered
+            if delivered:
+                return await receive()
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(dict(scope, headers=headers), receive_decoded, send)
+
+class JSONGZipMiddleware(GZipMiddleware):
+    """Gzips JSON responses; image bytes are already compressed and pass through untouched."""
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and (scope["path"] in IMAGE_ROUTES or scope["path"].endswith("/events")):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+class MetricsMiddleware:
+    """Times every request under its route template, so /training/jobs/{job_id}/cancel is one series."""
+    def __init__(self, app):
+        self.app = app
+        self.routes = {} # static path -> template
+
+    def route(self, scope):
+        template = self.routes.get(scope["path"])
+        if template is None:
+            template = "other"
+            for r in server_state.app.routes:
+                if r.matches(scope)[0] == Match.FULL:
+                    template = r.path
+                    break
+            if template == scope["path"]:
+                self.routes[scope["path"]] = template
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
 
-    def load_model(self, path):
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
         try:
-            self.log(f"Loading model: {path}...")
-            # Load new model
-            new_model = YOLO(path)
-            # Update state
-            self.model = new_model
-            self.model_path = path
-            self.log(f"SUCCESS: Switched to {os.path.basename(path)}")
-            return True
-        except Exception as e:
-            self.log(f"Error loading model: {e}")
-            return False
+            await self.app(scope, receive, send_status)
+        finally:
+            route, method = self.route(scope), scope["method"]
+            server_state.metrics.observe("yolo_http_request_duration_seconds", time.perf_counter() - started, route=route, method=method)
+            server_state.metrics.inc("yolo_http_requests_total", route=route, method=method, status=status)
+
+def register_metrics(state):
+    m = state.metrics
+    m.describe("yolo_http_request_duration_seconds", "histogram", "Request latency by route template.")
+    m.describe("yolo_http_requests_total", "counter", "Requests by route template and status.")
+    m.describe("yolo_image_decode_seconds", "histogram", "Image decode time (pool images and uploads).")
+    m.describe("yolo_inference_queue_wait_seconds", "histogram", "Time a request waited for the inference engine.")
+    m.describe("yolo_inference_batch_seconds", "histogram", "Wall time of one batched model call.")
+    m.describe("yolo_inference_batch_size", "histogram", "Images per model call.", buckets=(1, 2, 4, 8, 16, 32, 64))
+    m.describe("yolo_inference_stage_seconds", "histogram", "Per-image model time by stage (preprocess, inference, postprocess).")
+    m.describe("yolo_labels_submitted_total", "counter", "Label submissions by user.")
+    m.describe("yolo_time_to_label_seconds", "histogram", "Time from handing out an image to its labels being submitted.")
+    m.gauge("yolo_images_labeled_last_hour", "Submissions in the last hour by user.",
+            lambda: {(("user", u),): n for u, n in m.labeled_last_hour().items()})
+    m.gauge("yolo_work_queue_images", "Images in the pool by state.",
+            lambda: {(("state", k),): v for k, v in state.work_queue.stats().items()})
+    m.gauge("yolo_leases_active", "Images currently handed out.", lambda: {(): len(state.leases.leased_images())})
+    m.gauge("yolo_inference_queue_depth", "Requests waiting for the inference engine.", lambda: {(): state.engine.queue.qsize()})
+    m.gauge("yolo_label_store_queue_depth", "Label writes waiting for the committer.", lambda: {(): state.labels.pending.qsize()})
+    m.gauge("yolo_prediction_cache_entries", "Predictions held in memory.", lambda: {(): state.prediction_cache.stats()["entries"]})
+    m.gauge("yolo_training_jobs", "Training jobs by status.",
+            lambda: {(("status", k),): v for k, v in Counter(j["status"] for j in state.training.listing()).items()})
 
 server_state = ServerState()
+register_metrics(server_state)
+server_state.app.add_middleware(JSONGZipMiddleware, minimum_size=1024)
+server_state.app.add_middleware(GzipRequestMiddleware)
+server_state.app.add_middleware(MetricsMiddleware)
 
 # --- FASTAPI ENDPOINTS ---
 
@@ -55,132 +2513,630 @@ server_state = ServerState()
 def health_check():
     return {"status": "online", "model": os.path.basename(server_state.model_path)}
 
-@server_state.app.get("/next_image")
-def next_image(user_name: str):
-    if not server_state.image_folder:
-        return {"status": "error", "message": "Server not configured"}
+IMAGE_CACHE_CONTROL = "private, no-cache" # clients may keep images, but revalidate them by ETag
 
-    completed = set()
-    if os.path.exists(server_state.label_folder):
-        for f in os.listdir(server_state.label_folder):
-            if f.endswith(".txt"):
-                completed.add(os.path.splitext(f)[0])
+def inside_roots(path, roots):
+    """`path` with symlinks resolved if it lies inside one of `roots` (already resolved), else None."""
+    real = os.path.realpath(path)
+    return real if any(os.path.commonpath([real, root]) == root for root in roots) else None
 
-    all_images = [f for f in os.listdir(server_state.image_folder) 
-                  if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-    
-    assigned = set(server_state.in_progress.values())
-    selected = None
+def pool_path(image_name):
+    """Path of a pool image named by a client; the pool is flat, so anything but a bare file name is a 400."""
+    if not image_name or image_name in (".", "..") or os.path.basename(image_name) != image_name:
+        raise HTTPException(400, f"Invalid image name: {image_name!r}")
+    return os.path.join(server_state.image_folder, image_name)
 
-    if user_name in server_state.in_progress:
-        base = os.path.splitext(server_state.in_progress[user_name])[0]
-        if base not in completed:
-            selected = server_state.in_progress[user_name]
+def image_etag(image_name, path, meta):
+    """Strong validator of the bytes at `path`: the content hash when known, else mtime and size."""
+    if path != os.path.join(server_state.image_folder, image_name):
+        return f'"{os.path.splitext(os.path.basename(path))[0]}"' # rendition names carry the content hash
+    st = os.stat(path)
+    if meta.sha1 and meta.mtime == st.st_mtime and meta.size == st.st_size:
+        return f'"{meta.sha1}"'
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
 
-    if not selected:
-        for img in all_images:
-            base = os.path.splitext(img)[0]
-            if base not in completed and img not in assigned:
-                selected = img
-                break
-    
+def etag_matches(etag, if_none_match):
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    tags = [t[2:] if t.startswith("W/") else t for t in tags] # weak comparison
+    return "*" in tags or etag in tags
+
+def image_response(image_name, max_side=0, if_none_match=None, cache_control=IMAGE_CACHE_CONTROL):
+    """Serves a pool image, downscaled when max_side is set.
+
+    The original size is always sent along, because labels are exchanged in
+    original-image pixel coordinates. Responses carry a strong ETag: a
+    matching If-None-Match gets a bodyless 304, and Range requests are
+    answered by FileResponse.
+    """
+    meta = server_state.image_index.get(image_name)
+    path = os.path.join(server_state.image_folder, image_name)
+    if max_side > 0:
+        path = server_state.renditions.get(image_name, max(64, min(max_side, 8192)))
+    headers = {"filename": image_name, "X-Image-Width": str(meta.width), "X-Image-Height": str(meta.height),
+               "ETag": image_etag(image_name, path, meta), "Cache-Control": cache_control}
+    if etag_matches(headers["ETag"], if_none_match):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers)
+
+@server_state.app.get("/next_image_name")
+def next_image_name(user_name: str):
+    """Claims the next image like /next_image but returns only its name (front workers send the bytes)."""
+    if not server_state.image_folder:
+        return {"status": "error", "message": "Server not configured"}
+
+    selected = server_state.leases.claim(user_name)
     if not selected:
         return {"status": "done"}
 
-    server_state.in_progress[user_name] = selected
     server_state.log(f"Assigning {selected} to {user_name}")
-    return FileResponse(os.path.join(server_state.image_folder, selected), headers={"filename": selected})
+    return {"status": "ok", "image_name": selected}
+
+@server_state.app.get("/next_image")
+def next_image(user_name: str, max_side: int = 0):
+    claimed = next_image_name(user_name)
+    if claimed["status"] != "ok":
+        return claimed
+    return image_response(claimed["image_name"], max_side, cache_control="no-store") # every call hands out a different image
+
+@server_state.app.post("/heartbeat")
+def heartbeat(user_name: str = Form(...)):
+    held = server_state.leases.renew(user_name)
+    return {"status": "ok", "leases": held, "ttl": server_state.leases.ttl}
+
+@server_state.app.post("/release")
+def release(image_name: str = Form(...), user_name: str = Form(...)):
+    server_state.leases.release(image_name, user_name)
+    return {"status": "ok"}
 
 @server_state.app.get("/get_image_specific")
-def get_image_specific(filename: str):
-    file_path = os.path.join(server_state.image_folder, filename)
+def get_image_specific(filename: str, max_side: int = 0, if_none_match: Optional[str] = Header(None)):
+    file_path = pool_path(filename)
     if os.path.exists(file_path):
-        return FileResponse(file_path, headers={"filename": filename})
+        return image_response(filename, max_side, if_none_match)
     return {"status": "error", "message": "File not found"}
 
-@server_state.app.get("/get_current_labels")
-def get_current_labels(image_name: str):
-    txt_name = os.path.splitext(image_name)[0] + ".txt"
-    txt_path = os.path.join(server_state.label_folder, txt_name)
+def read_labels(image_name, size=None):
+    """Reads an image's labels and converts them to pixel xyxy boxes: [(cls, [x1, y1, x2, y2]), ...]"""
     labels = []
-    if os.path.exists(txt_path):
+    lines = server_state.labels.read(image_name)
+    if lines:
         try:
-            img_path = os.path.join(server_state.image_folder, image_name)
-            with Image.open(img_path) as img:
-                w, h = img.size
-            with open(txt_path, "r") as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) >= 5:
-                        cls_name = parts[0]
-                        cx, cy, bw, bh = map(float, parts[1:5])
-                        x1 = (cx - bw/2) * w
-                        y1 = (cy - bh/2) * h
-                        x2 = (cx + bw/2) * w
-                        y2 = (cy + bh/2) * h
-                        labels.append((cls_name, [x1, y1, x2, y2]))
+            classes, boxes = geometry.parse_yolo(lines)
+            labels = list(zip(classes, geometry.cxcywh_to_xyxy(boxes, size or server_state.image_index.size(image_name)).tolist()))
         except Exception as e:
             print(f"Error reading labels: {e}")
-    return {"labels": labels}
+    return labels
+
+@server_state.app.get("/get_current_labels")
+def get_current_labels(image_name: str):
+    pool_path(image_name)
+    return {"labels": read_labels(image_name)}
+
+@server_state.app.get("/next_batch")
+def next_batch(user_name: str, k: int = 4):
+    """Leases up to k images at once and returns everything the client needs to show them."""
+    if not server_state.image_folder:
+        return {"status": "error", "message": "Server not configured"}
+
+    k = max(1, min(k, 32))
+    images = []
+    for name in server_state.leases.claim_batch(user_name, k):
+        try:
+            size = server_state.image_index.size(name)
+        except Exception as e:
+            # Retire it for this session so it is not leased out again on every batch
+            server_state.log(f"Skipping unreadable image {name}: {e}")
+            server_state.leases.release(name, user_name, completed=True)
+            continue
+        images.append({"image_name": name, "width": size[0], "height": size[1],
+                       "labels": read_labels(name, size), "predictions": cached_predictions(name)})
+
+    if not images:
+        return {"status": "done"}
+    server_state.log(f"Leased batch of {len(images)} to {user_name}")
+    return {"status": "ok", "images": images}
+
+@server_state.app.get("/classes")
+def list_classes():
+    return {"classes": server_state.classes.listing(), "strict": server_state.classes.strict}
+
+@server_state.app.post("/classes")
+def add_class(name: str = Form(...)):
+    try:
+        class_id = server_state.classes.register(name)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return {"id": class_id, "name": name.strip()}
 
 @server_state.app.post("/submit_label")
-async def submit_label(image_name: str = Form(...), user_name: str = Form(...), labels: str = Form(...)):
+def submit_label(image_name: str = Form(...), user_name: str = Form(...), labels: str = Form(...)):
+    img_path = pool_path(image_name)
     try:
         data = json.loads(labels)
-        txt_path = os.path.join(server_state.label_folder, os.path.splitext(image_name)[0] + ".txt")
-        img_path = os.path.join(server_state.image_folder, image_name)
 
         if not os.path.exists(img_path):
              return {"status": "error", "message": "Image source not found"}
 
-        with Image.open(img_path) as img:
-            w, h = img.size
+        # Boxes dragged past the image edge are clipped; ones left with no area are dropped
+        size = server_state.image_index.size(image_name)
+        boxes = geometry.clip_xyxy([bbox for _, bbox in data], size)
+        keep = geometry.areas(boxes) > 0
+        data = [item for item, kept in zip(data, keep) if kept]
 
-        with open(txt_path, "w") as f:
-            for label, bbox in data:
-                x1, y1, x2, y2 = bbox
-                cx = ((x1 + x2) / 2) / w
-                cy = ((y1 + y2) / 2) / h
-                bw = (x2 - x1) / w
-                bh = (y2 - y1) / h
-                f.write(f"{label} {cx:.6f} {cy:.6f} {bw:.6f} {bh:.6f}\n")
+        try:
+            server_state.classes.check(label for label, _ in data)
+        except ValueError as e:
+            return {"status": "error", "message": str(e)}
+        lines = geometry.format_yolo([label for label, _ in data], geometry.xyxy_to_cxcywh(boxes[keep], size))
+
+        previous = server_state.labels.write(image_name, user_name, lines)
+        old_counts = Counter(line.split()[0] for line in previous or [])
+
+        lease = server_state.leases.release(image_name, user_name, completed=True)
+        if lease is not None and lease.user_name == user_name:
+            server_state.metrics.observe("yolo_time_to_label_seconds", time.time() - lease.claimed_at)
+        server_state.metrics.labeled(user_name)
+        server_state.classes.update_counts(old_counts, Counter(label for label, _ in data))
+        server_state.active_learning.note_submission()
 
-        if user_name in server_state.in_progress and server_state.in_progress[user_name] == image_name:
-            del server_state.in_progress[user_name]
-            
         server_state.log(f"Saved labels for {image_name} by {user_name}")
         return {"status": "success"}
     except Exception as e:
         server_state.log(f"Save error: {e}")
         raise HTTPException(500, str(e))
 
+def predict_image_name(image_name):
+    """Predictions for an image in the pool, served from the cache when possible."""
+    path = os.path.join(server_state.image_folder, image_name)
+    conf = float(server_state.conf_threshold)
+    handle = server_state.models.active
+    key = PredictionCache.key(server_state.image_index.sha1(image_name), handle.hash, conf)
+    preds = server_state.prediction_cache.get(key)
+    if preds is None:
+        preds = server_state.preannotator.lookup(image_name, handle, conf)
+        if preds is None:
+            preds = server_state.engine.infer(server_state.image_cache.get(path), conf, handle=handle)
+        server_state.prediction_cache.put(key, preds)
+    return preds
+
+def cached_predictions(image_name):
+    """Cache lookup only; None if the model has not seen this image yet."""
+    handle = server_state.models.active
+    if not handle:
+        return None
+    try:
+        key = PredictionCache.key(server_state.image_index.sha1(image_name), handle.hash, server_state.conf_threshold)
+    except OSError:
+        return None
+    preds = server_state.prediction_cache.get(key)
+    if preds is None:
+        preds = server_state.preannotator.lookup(image_name, handle, key[2])
+        if preds is not None:
+            server_state.prediction_cache.put(key, preds)
+    return preds
+
+@server_state.app.get("/training/jobs")
+def training_jobs():
+    return {"jobs": server_state.training.listing()}
+
+@server_state.app.post("/training/jobs")
+def submit_training_job(epochs: int = Form(100), batch: int = Form(16), imgsz: int = Form(640)):
+    if not server_state.image_folder:
+        raise HTTPException(400, "Server not configured")
+    return server_state.training.submit(epochs, batch, imgsz)
+
+@server_state.app.post("/training/jobs/{job_id}/cancel")
+def cancel_training_job(job_id: str):
+    if not server_state.training.cancel(job_id):
+        raise HTTPException(404, "No such queued or running job")
+    return {"status": "cancelled"}
+
+@server_state.app.get("/training/jobs/{job_id}/events")
+async def training_job_events(job_id: str):
+    """Server-sent events: one `epoch` event per finished epoch, then a final `status` event."""
+    if server_state.training.get(job_id) is None:
+        raise HTTPException(404, "No such job")
+
+    async def stream():
+        sent, status = 0, None
+        while True:
+            job = server_state.training.get(job_id)
+            for m in job["metrics"][sent:]:
+                yield f"event: epoch\ndata: {json.dumps(m)}\n\n"
+            sent = len(job["metrics"])
+            if job["status"] != status:
+                status = job["status"]
+                yield f"event: status\ndata: {json.dumps({k: job[k] for k in ('status', 'model', 'error')})}\n\n"
+            if status in ("completed", "failed", "cancelled"):
+                return
+            await asyncio.sleep(1)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@server_state.app.get("/models")
+def list_models():
+    return server_state.models.listing()
+
+@server_state.app.post("/models/promote")
+def promote_model(path: str = Form(...), check_holdout: bool = Form(True), force: bool = Form(False), wait: bool = Form(False)):
+    """Loads, warms up and validates a checkpoint in the background; poll /models for the outcome, or `wait` for it.
+
+    Checkpoints are pickles, so only files inside the model roots are loaded.
+    """
+    if inside_roots(path, server_state.model_roots) is None:
+        raise HTTPException(403, f"Model must be inside one of: {', '.join(server_state.model_roots)}")
+    if not os.path.exists(path):
+        raise HTTPException(404, f"No such model file: {path}")
+    future = server_state.load_model(path, check_holdout, force)
+    if not wait:
+        return {"status": "loading", "path": path}
+    try:
+        handle = future.result()
+    except ModelRejected as e:
+        raise HTTPException(409, str(e))
+    except Exception as e:
+        raise HTTPException(500, str(e))
+    return {"status": "success", "active": handle.info()}
+
+@server_state.app.post("/models/rollback")
+def rollback_model(version: Optional[int] = Form(None)):
+    try:
+        handle = server_state.models.rollback(version).result()
+    except KeyError as e:
+        raise HTTPException(404, f"Unknown version: {e}")
+    except Exception as e:
+        raise HTTPException(500, str(e))
+    return {"status": "success", "active": handle.info()}
+
+@server_state.app.get("/active_learning")
+def active_learning_stats():
+    return server_state.active_learning.stats()
+
+@server_state.app.post("/active_learning")
+def configure_active_learning(enabled: Optional[bool] = Form(None), retrain_every: Optional[int] = Form(None),
+                              method: Optional[str] = Form(None)):
+    al = server_state.active_learning
+    if method is not None:
+        try:
+            al.set_method(method)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+    if enabled is not None:
+        al.enabled = enabled
+    if retrain_every is not None:
+        al.retrain_every = max(0, retrain_every)
+    al.wakeup.set()
+    return al.stats()
+
+@server_state.app.get("/preannotate")
+def preannotate_progress():
+    return server_state.preannotator.stats()
+
+@server_state.app.post("/preannotate")
+def start_preannotation():
+    """Runs the active model over every unlabeled image in the background; poll GET /preannotate."""
+    try:
+        server_state.preannotator.start()
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+    return server_state.preannotator.stats()
+
+@server_state.app.post("/preannotate/cancel")
+def cancel_preannotation():
+    server_state.preannotator.cancel()
+    return {"status": "stopping"}
+
+@server_state.app.get("/label_store")
+def label_store_stats():
+    return server_state.labels.stats()
+
+@server_state.app.get("/labels/history")
+def label_history(image_name: str):
+    pool_path(image_name)
+    return {"image_name": image_name, "versions": server_state.labels.history(image_name)}
+
+@server_state.app.get("/labels/by_class")
+def labels_by_class(name: str):
+    """Base names of the labeled images that contain at least one box of class `name`."""
+    images = server_state.labels.images_with_class(name)
+    return {"class": name, "count": len(images), "images": images}
+
+@server_state.app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(server_state.metrics.render(), media_type="text/plain; version=0.0.4")
+
+@server_state.app.get("/inference_stats")
+def inference_stats():
+    return {"engine": server_state.engine.stats(), "cache": server_state.prediction_cache.stats()}
+
+DASHBOARD_INFERENCE = [("decode (pool)", "yolo_image_decode_seconds", {"source": "pool"}),
+                       ("decode (upload)", "yolo_image_decode_seconds", {"source": "upload"}),
+                       ("queue wait (interactive)", "yolo_inference_queue_wait_seconds", {"priority": "interactive"}),
+                       ("queue wait (background)", "yolo_inference_queue_wait_seconds", {"priority": "background"}),
+                       ("preprocess / image", "yolo_inference_stage_seconds", {"stage": "preprocess"}),
+                       ("forward / image", "yolo_inference_stage_seconds", {"stage": "inference"}),
+                       ("postprocess / image", "yolo_inference_stage_seconds", {"stage": "postprocess"}),
+                       ("model call / batch", "yolo_inference_batch_seconds", {})]
+
+@server_state.app.get("/metrics/summary")
+def metrics_summary():
+    """The numbers behind the control panel's dashboard, as JSON."""
+    m = server_state.metrics
+
+    def hist(name, **labels):
+        n, total, p50, p95 = m.histogram(name, **labels)
+        return {"count": n, "sum": total, "p50": p50, "p95": p95}
+    series = sorted(m.series("yolo_http_request_duration_seconds"), key=lambda l: (l["route"], l["method"]))
+    return {"requests": [dict(labels, **hist("yolo_http_request_duration_seconds", **labels)) for labels in series],
+            "inference": [dict(hist(name, **labels), title=title) for title, name, labels in DASHBOARD_INFERENCE],
+            "time_to_label": hist("yolo_time_to_label_seconds"),
+            "pool": server_state.work_queue.stats(), "leases": len(server_state.leases.leased_images()),
+            "inference_queue": server_state.engine.queue.qsize(), "label_writes_queued": server_state.labels.pending.qsize(),
+            "labeled_last_hour": dict(m.labeled_last_hour().most_common())}
+
+@server_state.app.get("/logs")
+def server_logs(since: int = 0):
+    return {"lines": [[seq, t.isoformat(timespec="seconds"), msg] for seq, t, msg in server_state.logs_since(since)]}
+
+@server_state.app.get("/config")
+def runtime_config():
+    return {"image_folder": server_state.image_folder, "model_path": server_state.model_path,
+            "label_backend": server_state.labels.NAME, "conf_threshold": server_state.conf_threshold,
+            "preinference": server_state.preinference.enabled, "strict_classes": server_state.classes.strict,
+            "training_threads": server_state.training.threads, "export_roots": server_state.export_roots,
+            "model_roots": server_state.model_roots}
+
+@server_state.app.post("/config")
+def update_runtime_config(conf_threshold: Optional[float] = Form(None), preinference: Optional[bool] = Form(None),
+                          strict_classes: Optional[bool] = Form(None), training_threads: Optional[int] = Form(None)):
+    """Settings that can change while serving; folders and the label store are fixed at startup."""
+    if conf_threshold is not None:
+        server_state.conf_threshold = min(max(conf_threshold, 0.01), 1.0)
+    if preinference is not None:
+        server_state.preinference.enabled = preinference
+    if strict_classes is not None:
+        server_state.classes.strict = strict_classes
+    if training_threads is not None:
+        server_state.training.threads = max(1, training_threads)
+    return runtime_config()
+
+@server_state.app.post("/export")
+def export_dataset(path: str = Form(...), link_mode: str = Form("auto")):
+    """Syncs the labeled dataset into `path` on the server's file system (inside one of the export roots)."""
+    if not server_state.image_folder:
+        raise HTTPException(400, "Server not configured")
+    path = inside_roots(path, server_state.export_roots)
+    if path is None:
+        raise HTTPException(403, f"Export path must be inside one of: {', '.join(server_state.export_roots)}")
+    try:
+        yaml_path, count, changed = server_state.exporter.sync(path, link_mode)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except OSError as e:
+        raise HTTPException(500, str(e))
+    return {"path": path, "yaml": yaml_path, "images": count, "changed": changed}
+
+def decode_upload(data):
+    started = time.perf_counter()
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    server_state.metrics.observe("yolo_image_decode_seconds", time.perf_counter() - started, source="upload")
+    return img
+
 @server_state.app.post("/predict")
-async def predict(file: UploadFile):
-    if not server_state.model:
+async def predict(file: Optional[UploadFile] = None, image_name: Optional[str] = Form(None)):
+    """Either upload an image, or name one from the pool so nothing has to be sent."""
+    if not server_state.models.active:
         return {"error": "No model loaded"}
-    
+
+    if image_name is not None:
+        if not os.path.exists(pool_path(image_name)):
+            raise HTTPException(404, f"Unknown image: {image_name}")
+        try:
+            return {"predictions": await run_in_threadpool(predict_image_name, image_name)}
+        except EngineBusy as e:
+            raise HTTPException(503, str(e))
+    if file is None:
+        raise HTTPException(422, "Send either 'file' or 'image_name'")
+
     img_data = await file.read()
-    img = Image.open(io.BytesIO(img_data))
     
     # Use CURRENT model AND Confidence
     conf = float(server_state.conf_threshold)
-    results = server_state.model(img, conf=conf)
-    
-    preds = []
-    for r in results:
-        for box in r.boxes:
-            preds.append((server_state.model.names[int(box.cls[0])], box.xyxy[0].tolist()))
+    handle = server_state.models.active
+    key = PredictionCache.key(hashlib.sha1(img_data).hexdigest(), handle.hash, conf)
+    preds = server_state.prediction_cache.get(key)
+    if preds is None:
+        img = await run_in_threadpool(decode_upload, img_data)
+        try:
+            preds = await asyncio.wrap_future(server_state.engine.submit(img, conf, handle=handle))
+        except EngineBusy as e:
+            raise HTTPException(503, str(e))
+        server_state.prediction_cache.put(key, preds)
     return {"predictions": preds}
 
+# --- HEADLESS ENTRY POINT ---
+
+DEFAULT_CONFIG = {
+    "image_folder": "",
+    "model": "yolov8x.pt",
+    "host": "0.0.0.0",
+    "port": 8000,
+    "workers": 1,
+    "internal_port": 8001, # the state-owning process listens here (loopback only) when workers > 1
+    "conf_threshold": 0.25,
+    "label_backend": "files",
+    "strict_classes": False,
+    "preinference": True,
+    "prediction_cache_files": 200000, # predictions kept on disk across restarts; 0 keeps them in memory only
+    "active_learning": {"enabled": True, "retrain_every": 200, "method": "least_confidence"},
+    "training": {"threads": 0, "nice": 10}, # 0 threads: half the cores
+    "export_roots": [], # folders /export may write into; empty: the image folder only
+    "model_roots": [], # folders /models/promote may load from; empty: the image folder and the startup model's folder
+}
+
+def load_config(path=None, **overrides):
+    """DEFAULT_CONFIG, overlaid with a YAML (.yaml/.yml) or TOML (.toml) file and then with `overrides` that are not None."""
+    config = json.loads(json.dumps(DEFAULT_CONFIG)) # deep copy
+    loaded = {}
+    if path:
+        with open(path, "rb") as f:
+            loaded = tomllib.load(f) if path.endswith(".toml") else (yaml.safe_load(f) or {})
+    loaded.update({k: v for k, v in overrides.items() if v is not None})
+    unknown = set(loaded) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown config keys: {', '.join(sorted(unknown))}")
+    for key, value in loaded.items():
+        if isinstance(DEFAULT_CONFIG[key], dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    if not config["image_folder"] or not os.path.isdir(config["image_folder"]):
+        raise ValueError(f"image_folder is not a folder: {config['image_folder']!r}")
+    if config["label_backend"] not in LABEL_BACKENDS:
+        raise ValueError(f"label_backend must be one of {list(LABEL_BACKENDS)}")
+    if not isinstance(config["prediction_cache_files"], int) or config["prediction_cache_files"] < 0:
+        raise ValueError("prediction_cache_files must be a non-negative integer")
+    for key in ("export_roots", "model_roots"):
+        if not isinstance(config[key], list):
+            raise ValueError(f"{key} must be a list of folders")
+    return config
+
+def create_app(config=None):
+    """App factory: starts the server state from `config` (default: the file named by $YOLO_SERVER_CONFIG).
+
+    Usable directly with `uvicorn server:create_app --factory`, single worker.
+    """
+    server_state.start(config or load_config(os.environ.get("YOLO_SERVER_CONFIG")))
+    return server_state.app
+
+class PrimaryProxy:
+    """Relays a front worker's requests to the process that owns the server state.
+
+    Bodies are passed through as sent, compressed or not, and server-sent
+    event streams are relayed chunk by chunk.
+    """
+    HOP_BY_HOP = {"connection", "keep-alive", "transfer-encoding", "content-length", "te", "trailer", "upgrade", "host"}
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.local = threading.local() # one keep-alive session per threadpool thread
+
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def get(self, path, **params):
+        r = self.session().get(self.base_url + path, params=params, timeout=30)
+        r.raise_for_status()
+        return r.json()
+
+    def forward(self, method, path, query, headers, body):
+        headers = {k: v for k, v in headers.items() if k.lower() not in self.HOP_BY_HOP}
+        headers.setdefault("accept-encoding", "identity") # else requests would ask for gzip on the client's behalf
+        r = self.session().request(method, self.base_url + path + (f"?{query}" if query else ""), headers=headers,
+                                   data=body, stream=True, timeout=(5, None))
+        reply = {k: v for k, v in r.headers.items() if k.lower() not in self.HOP_BY_HOP}
+        if r.headers.get("content-type", "").startswith("text/event-stream"):
+            def relay():
+                with r:
+                    yield from r.raw.stream(4096, decode_content=False)
+            return StreamingResponse(relay(), status_code=r.status_code, headers=reply)
+        with r:
+            return Response(r.raw.read(decode_content=False), status_code=r.status_code, headers=reply)
+
+def create_worker_app():
+    """App factory for the front workers started by `serve` when workers > 1.
+
+    A worker holds no state of its own: it sends image bytes itself (from the
+    shared image index and rendition folder) and forwards everything else to
+    the primary process on the loopback port.
+    """
+    config = json.loads(os.environ["YOLO_WORKER_CONFIG"])
+    server_state.set_folder(config["image_folder"])
+    cache = os.path.join(server_state.label_folder, ".cache")
+    server_state.image_index.open(server_state.image_folder, os.path.join(cache, "image_index.sqlite"))
+    server_state.renditions.open(os.path.join(cache, "renditions"))
+    proxy = PrimaryProxy(f"http://127.0.0.1:{config['internal_port']}")
+    app = FastAPI()
+
+    @app.get("/next_image")
+    def worker_next_image(user_name: str, max_side: int = 0):
+        claimed = proxy.get("/next_image_name", user_name=user_name)
+        if claimed["status"] != "ok":
+            return claimed
+        return image_response(claimed["image_name"], max_side, cache_control="no-store")
+
+    app.get("/get_image_specific")(get_image_specific)
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+    async def forward(request: Request):
+        body = await request.body()
+        return await run_in_threadpool(proxy.forward, request.method, request.url.path, request.url.query, request.headers, body)
+
+    return app
+
+def serve(config):
+    """Runs the server without a display: one process owns the state; with workers > 1 it sits behind front workers."""
+    if config["workers"] <= 1:
+        uvicorn.run(create_app(config), host=config["host"], port=config["port"], log_level="warning")
+        return
+    app = create_app(config)
+    primary = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=config["internal_port"], log_level="warning"))
+    threading.Thread(target=primary.run, daemon=True).start()
+    os.environ["YOLO_WORKER_CONFIG"] = json.dumps(config) # inherited by the spawned workers
+    server_state.log(f"Serving on {config['host']}:{config['port']} with {config['workers']} workers")
+    uvicorn.run("server:create_worker_app", factory=True, host=config["host"], port=config["port"],
+                workers=config["workers"], log_level="warning")
+
 # --- 2. GUI IMPLEMENTATION ---
 
+class PanelError(Exception):
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+
+class PanelAPI:
+    """The control panel's connection to a server: every call runs off the Tk thread and reports back on it."""
+    def __init__(self, root, base_url):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.pool = ThreadPoolExecutor(max_workers=4)
+
+    def _request(self, method, path, timeout, kwargs):
+        r = self.session.request(method, self.base_url + path, timeout=timeout, **kwargs)
+        if r.status_code >= 400:
+            try:
+                detail = r.json().get("detail", r.text)
+            except ValueError:
+                detail = r.text
+            raise PanelError(r.status_code, detail)
+        return r.json()
+
+    def call(self, method, path, on_done=None, on_error=None, timeout=30, **kwargs):
+        """on_error defaults to an error box; pass `lambda e: None` for background polling."""
+        def finished(future):
+            error = future.exception()
+            if error is None:
+                if on_done:
+                    self.root.after(0, lambda: on_done(future.result()))
+            else:
+                handler = on_error or (lambda e: messagebox.showerror("Error", str(e)))
+                self.root.after(0, lambda: handler(error))
+        self.pool.submit(self._request, method, path, timeout, kwargs).add_done_callback(finished)
+
 class ServerGUI:
-    def __init__(self, root):
+    def __init__(self, root, connect=None):
         self.root = root
         self.root.title("YOLO Server Control Panel")
         self.root.geometry("950x750")
+        self.api = None # set once a server is running (local) or on start (--connect)
+        self.local_server = False
+        self._conf_job = None
         
-        server_state.log_callback = self.append_log
 
         # --- Top Section: Config ---
         config_frame = tk.LabelFrame(root, text="Server Configuration", padx=10, pady=10)
@@ -189,12 +3145,14 @@ class ServerGUI:
         # 1. Image Folder
         tk.Label(config_frame, text="Images Folder:").grid(row=0, column=0, sticky="w")
         self.folder_var = tk.StringVar()
-        tk.Entry(config_frame, textvariable=self.folder_var, width=40).grid(row=0, column=1, padx=5)
-        tk.Button(config_frame, text="Browse", command=self.select_folder).grid(row=0, column=2)
+        self.folder_entry = tk.Entry(config_frame, textvariable=self.folder_var, width=40)
+        self.folder_entry.grid(row=0, column=1, padx=5)
+        self.browse_btn = tk.Button(config_frame, text="Browse", command=self.select_folder)
+        self.browse_btn.grid(row=0, column=2)
 
         # 2. Model Selection
         tk.Label(config_frame, text="Model Path:").grid(row=1, column=0, sticky="w")
-        self.model_var = tk.StringVar(value="yolov8x.pt")
+        self.model_var = tk.StringVar(value=DEFAULT_CONFIG["model"])
         self.model_entry = tk.Entry(config_frame, textvariable=self.model_var, width=40)
         self.model_entry.grid(row=1, column=1, padx=5)
         
@@ -203,16 +3161,29 @@ class ServerGUI:
         
         self.switch_btn = tk.Button(config_frame, text="Switch Model", bg="lightblue", command=self.switch_model)
         self.switch_btn.grid(row=1, column=3, padx=2)
+        tk.Button(config_frame, text="Rollback", command=self.rollback_model).grid(row=0, column=3, padx=2)
 
         # 3. Confidence Slider
         tk.Label(config_frame, text="AI Confidence:").grid(row=2, column=0, sticky="w")
         self.conf_scale = tk.Scale(config_frame, from_=0.05, to=1.0, resolution=0.05, orient=tk.HORIZONTAL, length=300, command=self.update_conf)
-        self.conf_scale.set(0.25)
+        self.conf_scale.set(DEFAULT_CONFIG["conf_threshold"])
         self.conf_scale.grid(row=2, column=1, columnspan=2, sticky="w", pady=5)
+        self.preinfer_var = tk.BooleanVar(value=DEFAULT_CONFIG["preinference"])
+        tk.Checkbutton(config_frame, text="Pre-inference", variable=self.preinfer_var, command=self.toggle_preinference).grid(row=2, column=3, sticky="w")
+        self.strict_var = tk.BooleanVar(value=DEFAULT_CONFIG["strict_classes"])
+        tk.Checkbutton(config_frame, text="Strict classes", variable=self.strict_var, command=self.toggle_strict).grid(row=3, column=3, sticky="w")
+
+        tk.Label(config_frame, text="Label store:").grid(row=4, column=0, sticky="w")
+        self.backend_var = tk.StringVar(value=DEFAULT_CONFIG["label_backend"])
+        backend_frame = tk.Frame(config_frame)
+        backend_frame.grid(row=4, column=1, columnspan=2, sticky="w")
+        self.backend_radios = [tk.Radiobutton(backend_frame, text=name, value=name, variable=self.backend_var) for name in LABEL_BACKENDS]
+        for radio in self.backend_radios:
+            radio.pack(side=tk.LEFT)
 
         # 4. IP Address Display (NEW)
-        ip_addr = self.get_local_ip()
-        tk.Label(config_frame, text=f"Server IP: {ip_addr}", fg="blue", font=("Arial", 11, "bold")).grid(row=3, column=0, columnspan=3, sticky="w", pady=5)
+        self.address_lbl = tk.Label(config_frame, text=f"Server IP: {self.get_local_ip()}", fg="blue", font=("Arial", 11, "bold"))
+        self.address_lbl.grid(row=3, column=0, columnspan=3, sticky="w", pady=5)
 
         # 5. Start Server (Spans 4 rows now)
         self.start_btn = tk.Button(config_frame, text="START SERVER", bg="lightgreen", font=("Arial", 10, "bold"), command=self.start_server_thread)
@@ -227,6 +3198,13 @@ class ServerGUI:
         self.notebook.add(self.log_tab, text="Server Logs")
         self.log_text = scrolledtext.ScrolledText(self.log_tab, height=15)
         self.log_text.pack(fill=tk.BOTH, expand=True)
+        self.log_seq = 0
+
+        # Dashboard
+        self.dash_tab = tk.Frame(self.notebook)
+        self.notebook.add(self.dash_tab, text="Dashboard")
+        self.dash_text = tk.Text(self.dash_tab, font=("Courier", 10), state=tk.DISABLED)
+        self.dash_text.pack(fill=tk.BOTH, expand=True)
 
         # Tab 2: Export
         self.export_tab = tk.Frame(self.notebook)
@@ -238,6 +3216,9 @@ class ServerGUI:
         self.notebook.add(self.train_tab, text="Training")
         self.setup_training_tab()
 
+        if connect:
+            self.connect(connect)
+
     def get_local_ip(self):
         """Helper to get the local IP address."""
         try:
@@ -250,131 +3231,247 @@ class ServerGUI:
         except Exception:
             return "127.0.0.1"
 
+    def connect(self, base_url):
+        """Attaches the panel to a running server; from here on every action goes through its HTTP API."""
+        self.api = PanelAPI(self.root, base_url)
+        for widget in [self.folder_entry, self.browse_btn, self.start_btn] + self.backend_radios:
+            widget.config(state=tk.DISABLED)
+        self.start_btn.config(text="RUNNING...")
+        self.address_lbl.config(text=f"Server: {base_url}")
+        self.api.call("GET", "/config", on_done=self.config_received)
+        self.api.call("GET", "/active_learning", on_done=self.active_learning_received)
+        self.drain_logs()
+        self.refresh_dashboard()
+        self.refresh_training_jobs()
+
+    def config_received(self, config):
+        self.folder_var.set(config["image_folder"])
+        self.model_var.set(config["model_path"])
+        self.backend_var.set(config["label_backend"])
+        self.conf_scale.set(config["conf_threshold"])
+        self.preinfer_var.set(config["preinference"])
+        self.strict_var.set(config["strict_classes"])
+        self.threads_ent.delete(0, tk.END)
+        self.threads_ent.insert(0, str(config["training_threads"]))
+
+    def active_learning_received(self, al):
+        self.al_var.set(al["enabled"])
+        self.al_every_ent.delete(0, tk.END)
+        self.al_every_ent.insert(0, str(al["retrain_every"]))
+        self.al_method_var.set(al["method"])
+
+    MAX_LOG_LINES = 5000
+
     def append_log(self, msg):
+        """Panel-side messages; the server's own log arrives through drain_logs."""
         self.log_text.insert(tk.END, f"[{datetime.now().strftime('%H:%M:%S')}] {msg}\n")
         self.log_text.see(tk.END)
 
+    def drain_logs(self):
+        self.api.call("GET", "/logs", params={"since": self.log_seq}, on_done=self.logs_received,
+                      on_error=lambda e: self.root.after(2000, self.drain_logs))
+
+    def logs_received(self, reply):
+        entries = reply["lines"]
+        if entries:
+            self.log_seq = entries[-1][0]
+            self.log_text.insert(tk.END, "".join(f"[{t[11:19]}] {msg}\n" for _, t, msg in entries))
+            excess = int(self.log_text.index("end-1c").split(".")[0]) - self.MAX_LOG_LINES
+            if excess > 0:
+                self.log_text.delete("1.0", f"{excess + 1}.0")
+            self.log_text.see(tk.END)
+        self.root.after(500, self.drain_logs)
+
+    def refresh_dashboard(self):
+        self.api.call("GET", "/metrics/summary", on_done=self.show_dashboard,
+                      on_error=lambda e: self.root.after(2000, self.refresh_dashboard))
+
+    def show_dashboard(self, d):
+        fmt = lambda v: f"{'-':>8}" if v is None else f"{v * 1000:8.1f}"
+        lines = ["REQUESTS                                   count    p50 ms    p95 ms"]
+        for r in d["requests"]:
+            lines.append(f"  {r['method']:5} {r['route']:34} {r['count']:6} {fmt(r['p50'])}  {fmt(r['p95'])}")
+        lines += ["", "INFERENCE                                  count    p50 ms    p95 ms"]
+        for r in d["inference"]:
+            lines.append(f"  {r['title']:40} {r['count']:6} {fmt(r['p50'])}  {fmt(r['p95'])}")
+        ttl = d["time_to_label"]
+        lines += ["", f"QUEUES  pool {d['pool']}",
+                  f"        leases {d['leases']}   inference queue {d['inference_queue']}   label writes queued {d['label_writes_queued']}",
+                  "", f"ANNOTATORS (last hour)    time to label: median {ttl['p50'] or 0:.0f} s, "
+                      f"mean {ttl['sum'] / max(ttl['count'], 1):.0f} s over {ttl['count']} images"]
+        for user, count in d["labeled_last_hour"].items():
+            lines.append(f"  {user:24} {count:5} images/h")
+        self.dash_text.config(state=tk.NORMAL)
+        self.dash_text.delete("1.0", tk.END)
+        self.dash_text.insert("1.0", "\n".join(lines))
+        self.dash_text.config(state=tk.DISABLED)
+        self.root.after(1000, self.refresh_dashboard)
+
     def select_folder(self):
         path = filedialog.askdirectory()
         if path:
             self.folder_var.set(path)
-            server_state.image_folder = path
-            server_state.label_folder = os.path.join(path, "labels_collected")
-            os.makedirs(server_state.label_folder, exist_ok=True)
             self.append_log(f"Root: {path}")
 
+    def require_server(self):
+        if not self.api:
+            messagebox.showerror("Error", "Start the server first.")
+        return self.api is not None
+
     def update_conf(self, val):
-        server_state.conf_threshold = float(val)
+        if not self.api:
+            return # read on START SERVER
+        if self._conf_job:
+            self.root.after_cancel(self._conf_job)
+        self._conf_job = self.root.after(300, lambda: self.api.call("POST", "/config", data={"conf_threshold": val}))
+
+    def toggle_preinference(self):
+        if self.api:
+            self.api.call("POST", "/config", data={"preinference": self.preinfer_var.get()})
+
+    def toggle_strict(self):
+        if self.api:
+            self.api.call("POST", "/config", data={"strict_classes": self.strict_var.get()})
 
     # --- Model Management ---
 
     def browse_model_file(self):
-        filename = filedialog.askopenfilename(filetypes=[("YOLO Models", "*.pt")])
+        filename = filedialog.askopenfilename(filetypes=[("YOLO Models", "*.pt")],
+                                              initialdir=server_state.model_roots[-1] if self.local_server else None)
         if filename:
             self.model_var.set(filename)
 
-    def switch_model(self):
+    def allow_local(self, roots, folder):
+        """On an in-process server the panel is the operator's own machine, so a folder picked here joins `roots`."""
+        real = os.path.realpath(folder)
+        if self.local_server and inside_roots(real, roots) is None:
+            roots.append(real)
+
+    def switch_model(self, force=False):
         path = self.model_var.get()
-        if not path or not os.path.exists(path):
-            messagebox.showerror("Error", "File not found or invalid path.")
+        if not path or not self.require_server():
             return
+        self.allow_local(server_state.model_roots, os.path.dirname(os.path.abspath(path)))
         
-        success = server_state.load_model(path)
-        if success:
+        self.switch_btn.config(state=tk.DISABLED, text="Loading...")
+        self.api.call("POST", "/models/promote", data={"path": path, "force": force, "wait": True}, timeout=None,
+                      on_done=lambda r: self.model_switched(path, None), on_error=lambda e: self.model_switched(path, e))
+
+    def model_switched(self, path, error):
+        self.switch_btn.config(state=tk.NORMAL, text="Switch Model")
+        if error is None:
             messagebox.showinfo("Success", f"Server is now using:\n{os.path.basename(path)}")
+        elif getattr(error, "status", None) == 409:
+            if messagebox.askyesno("Model Rejected", f"{error}\n\nSwitch to it anyway?"):
+                self.switch_model(force=True)
         else:
-            messagebox.showerror("Error", "Failed to load model. Check logs.")
+            messagebox.showerror("Error", f"Failed to load model: {error}")
+
+    def rollback_model(self):
+        if not self.require_server():
+            return
+        def failed(e):
+            if getattr(e, "status", None) == 404:
+                messagebox.showinfo("Rollback", "No earlier model version to roll back to.")
+            else:
+                messagebox.showerror("Error", str(e))
+        self.api.call("POST", "/models/rollback", timeout=None, on_done=lambda r: self.model_var.set(r["active"]["path"]), on_error=failed)
 
     def start_server_thread(self):
-        if not server_state.image_folder:
+        if not self.folder_var.get():
             messagebox.showerror("Error", "Select Image Folder first.")
             return
-        
-        initial_model = self.model_var.get() or "yolov8x.pt"
-        if os.path.exists(initial_model):
-            server_state.load_model(initial_model)
-        else:
-            self.append_log("Warning: Initial model file not found. Server started without model.")
+        try:
+            config = load_config(image_folder=self.folder_var.get(), model=self.model_var.get() or DEFAULT_CONFIG["model"],
+                                 label_backend=self.backend_var.get(), conf_threshold=self.conf_scale.get(),
+                                 preinference=self.preinfer_var.get(), strict_classes=self.strict_var.get(),
+                                 training={"threads": max(1, int(self.threads_ent.get()))},
+                                 active_learning={"enabled": self.al_var.get(), "retrain_every": max(0, int(self.al_every_ent.get())),
+                                                  "method": self.al_method_var.get()})
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
 
-        self.start_btn.config(state=tk.DISABLED, text="RUNNING...")
-        threading.Thread(target=lambda: uvicorn.run(server_state.app, host="0.0.0.0", port=8000, log_level="error"), daemon=True).start()
+        # Index sync, journal recovery and the class bootstrap can take minutes on a large pool
+        startup = Future()
+        def run_start():
+            try:
+                server_state.start(config)
+                startup.set_result(None)
+            except Exception as e:
+                startup.set_exception(e)
+        threading.Thread(target=run_start, daemon=True).start()
+        self.start_btn.config(state=tk.DISABLED, text="STARTING...")
+        self.wait_for_startup(startup, config)
+
+    def wait_for_startup(self, startup, config):
+        """Starts uvicorn once `server_state.start` has finished on its worker thread."""
+        if not startup.done():
+            self.root.after(100, lambda: self.wait_for_startup(startup, config))
+            return
+        if startup.exception():
+            self.start_btn.config(text="FAILED")
+            messagebox.showerror("Error", f"Server startup failed: {startup.exception()}")
+            return
+        self.local_server = True
+        server = uvicorn.Server(uvicorn.Config(server_state.app, host=config["host"], port=config["port"], log_level="error"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        self.wait_until_serving(server, thread, f"http://127.0.0.1:{config['port']}", time.time() + 30)
+
+    def wait_until_serving(self, server, thread, base_url, deadline):
+        """Connects the panel once uvicorn accepts requests, so its first calls do not race the startup."""
+        if server.started:
+            self.connect(base_url)
+            self.address_lbl.config(text=f"Server IP: {self.get_local_ip()}")
+        elif not thread.is_alive() or time.time() > deadline:
+            self.start_btn.config(text="FAILED")
+            messagebox.showerror("Error", f"The server did not start on {base_url} (port in use?).")
+        else:
+            self.root.after(100, lambda: self.wait_until_serving(server, thread, base_url, deadline))
 
     # --- Export ---
     def setup_export_tab(self):
         f = tk.Frame(self.export_tab, padx=20, pady=20)
         f.pack(fill=tk.BOTH)
         tk.Label(f, text="Export Labeled Dataset", font=("Arial", 14, "bold")).pack(pady=10)
-        tk.Button(f, text="Export Now", bg="lightblue", font=("Arial", 12), command=self.export_data).pack(pady=20)
+        tk.Label(f, text="Re-exporting to the same folder only syncs what changed.", fg="gray").pack()
+
+        mode_frame = tk.Frame(f)
+        mode_frame.pack(pady=10)
+        tk.Label(mode_frame, text="Images:").pack(side=tk.LEFT)
+        self.export_mode_var = tk.StringVar(value="auto")
+        for mode, text in [("auto", "Hardlink (fallback: copy)"), ("symlink", "Symlink (no image bytes)"), ("copy", "Copy")]:
+            tk.Radiobutton(mode_frame, text=text, variable=self.export_mode_var, value=mode).pack(side=tk.LEFT)
+
+        self.export_btn = tk.Button(f, text="Export Now", bg="lightblue", font=("Arial", 12), command=self.export_data)
+        self.export_btn.pack(pady=20)
 
     def export_data(self):
-        if not server_state.image_folder: return
-        export_dir = filedialog.askdirectory(title="Select Folder to Export To")
+        if not self.require_server(): return
+        if self.local_server:
+            export_dir = filedialog.askdirectory(title="Select Folder to Export To", initialdir=server_state.export_roots[0])
+        else: # the export lands on the server's file system, so a local dialog would be misleading
+            export_dir = simpledialog.askstring("Export", "Folder on the server to export to:")
         if not export_dir: return
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        target_path = os.path.join(export_dir, f"dataset_export_{ts}")
-        try:
-            self.create_dataset_structure(target_path)
-            messagebox.showinfo("Success", f"Exported to:\n{target_path}")
-            self.append_log(f"Exported dataset to {target_path}")
-        except Exception as e:
-            messagebox.showerror("Failed", str(e))
+        self.allow_local(server_state.export_roots, export_dir)
+        target_path = os.path.join(export_dir, "dataset_export")
+        self.export_btn.config(state=tk.DISABLED, text="Exporting...")
 
-    def create_dataset_structure(self, target_path):
-        os.makedirs(os.path.join(target_path, "images"), exist_ok=True)
-        os.makedirs(os.path.join(target_path, "labels"), exist_ok=True)
-        
-        classes = set()
-        file_pairs = [] 
-
-        if not os.path.exists(server_state.label_folder):
-             return "", 0
+        def finished(r=None, error=None):
+            self.export_btn.config(state=tk.NORMAL, text="Export Now")
+            if error:
+                messagebox.showerror("Failed", str(error))
+            else:
+                messagebox.showinfo("Success", f"Exported {r['images']} images ({r['changed']} files updated) to:\n{r['path']}")
 
-        for txt_file in os.listdir(server_state.label_folder):
-            if not txt_file.endswith(".txt"): continue
-            txt_full = os.path.join(server_state.label_folder, txt_file)
-            base_name = os.path.splitext(txt_file)[0]
-            
-            img_full = None
-            for ext in [".jpg", ".png", ".jpeg"]:
-                potential = os.path.join(server_state.image_folder, base_name + ext)
-                if os.path.exists(potential):
-                    img_full = potential
-                    break
-            
-            if img_full:
-                file_pairs.append((img_full, txt_full))
-                with open(txt_full, 'r') as f:
-                    for line in f:
-                        parts = line.split()
-                        if parts: classes.add(parts[0])
-
-        class_list = sorted(list(classes))
-        
-        count = 0
-        for img_p, txt_p in file_pairs:
-            fname = os.path.basename(img_p)
-            tname = os.path.basename(txt_p)
-            shutil.copy(img_p, os.path.join(target_path, "images", fname))
-            with open(txt_p, 'r') as source_t:
-                with open(os.path.join(target_path, "labels", tname), 'w') as dest_t:
-                    for line in source_t:
-                        parts = line.split()
-                        if parts[0] in class_list:
-                            idx = class_list.index(parts[0])
-                            dest_t.write(f"{idx} " + " ".join(parts[1:]) + "\n")
-            count += 1
-        
-        yaml_content = {'path': os.path.abspath(target_path), 'train': 'images', 'val': 'images', 'nc': len(class_list), 'names': class_list}
-        yaml_path = os.path.join(target_path, "data.yaml")
-        with open(yaml_path, 'w') as yf:
-            yaml.dump(yaml_content, yf)
-            
-        return yaml_path, count
+        self.api.call("POST", "/export", data={"path": target_path, "link_mode": self.export_mode_var.get()}, timeout=None,
+                      on_done=finished, on_error=lambda e: finished(error=e))
 
     # --- Training ---
     def setup_training_tab(self):
         f = tk.Frame(self.train_tab, padx=20, pady=20)
-        f.pack(fill=tk.BOTH)
+        f.pack(fill=tk.BOTH, expand=True)
         tk.Label(f, text="Train New Model on Server", font=("Arial", 14, "bold")).pack(pady=10)
         
         grid = tk.Frame(f)
@@ -383,69 +3480,113 @@ class ServerGUI:
         self.epochs_ent = tk.Entry(grid, width=5); self.epochs_ent.insert(0,"100"); self.epochs_ent.grid(row=0,column=1)
         tk.Label(grid, text="Batch:").grid(row=0, column=2); 
         self.batch_ent = tk.Entry(grid, width=5); self.batch_ent.insert(0,"16"); self.batch_ent.grid(row=0,column=3)
+        tk.Label(grid, text="Threads:").grid(row=0, column=4)
+        self.threads_ent = tk.Entry(grid, width=4); self.threads_ent.insert(0, str(server_state.training.threads)); self.threads_ent.grid(row=0, column=5)
+
+        al = tk.Frame(f)
+        al.pack(pady=5)
+        defaults = DEFAULT_CONFIG["active_learning"]
+        self.al_var = tk.BooleanVar(value=defaults["enabled"])
+        tk.Checkbutton(al, text="Auto-retrain every", variable=self.al_var, command=self.update_active_learning).pack(side=tk.LEFT)
+        self.al_every_ent = tk.Entry(al, width=5); self.al_every_ent.insert(0, str(defaults["retrain_every"])); self.al_every_ent.pack(side=tk.LEFT)
+        tk.Label(al, text="labels, hand out first by").pack(side=tk.LEFT)
+        self.al_method_var = tk.StringVar(value=defaults["method"])
+        ttk.Combobox(al, textvariable=self.al_method_var, values=ActiveLearning.METHODS, state="readonly", width=16).pack(side=tk.LEFT)
+        tk.Button(al, text="Apply", command=self.update_active_learning).pack(side=tk.LEFT, padx=5)
 
-        self.train_btn = tk.Button(f, text="Start Training", bg="orange", font=("Arial", 12), command=self.start_training_process)
-        self.train_btn.pack(pady=20)
+        btns = tk.Frame(f)
+        btns.pack(pady=10)
+        self.train_btn = tk.Button(btns, text="Queue Training", bg="orange", font=("Arial", 12), command=self.start_training_process)
+        self.train_btn.pack(side=tk.LEFT, padx=5)
+        tk.Button(btns, text="Cancel Selected", font=("Arial", 12), command=self.cancel_training_job).pack(side=tk.LEFT, padx=5)
+        self.preannotate_btn = tk.Button(btns, text="Pre-annotate Pool", font=("Arial", 12), command=self.toggle_preannotation)
+        self.preannotate_btn.pack(side=tk.LEFT, padx=5)
+        self.preannotate_lbl = tk.Label(f, text="", fg="gray")
+        self.preannotate_lbl.pack()
+        self.preannotate_status = "idle"
+
+        self.jobs_tree = ttk.Treeview(f, columns=("status", "progress", "metrics"), height=8)
+        self.jobs_tree.heading("#0", text="Job")
+        self.jobs_tree.heading("status", text="Status")
+        self.jobs_tree.heading("progress", text="Epoch")
+        self.jobs_tree.heading("metrics", text="Last epoch metrics")
+        self.jobs_tree.column("status", width=90); self.jobs_tree.column("progress", width=70); self.jobs_tree.column("metrics", width=420)
+        self.jobs_tree.pack(fill=tk.BOTH, expand=True)
         self.train_status = tk.Label(f, text="Ready", fg="gray")
         self.train_status.pack()
+        self.job_status = {} # id -> last status seen, to notice jobs finishing
 
     def start_training_process(self):
-        if not server_state.image_folder:
-            messagebox.showerror("Error", "No image folder selected.")
+        if not self.require_server():
             return
 
         try:
             epochs = int(self.epochs_ent.get())
             batch = int(self.batch_ent.get())
+            threads = max(1, int(self.threads_ent.get()))
         except ValueError:
-            messagebox.showerror("Error", "Epochs and Batch must be numbers.")
+            messagebox.showerror("Error", "Epochs, Batch and Threads must be numbers.")
             return
 
-        self.train_btn.config(state=tk.DISABLED, text="Training in Progress...")
-        self.train_status.config(text="Preparing Dataset...", fg="blue")
-        
-        threading.Thread(target=self.run_training_logic, args=(epochs, batch)).start()
+        def queued(job):
+            self.train_status.config(text=f"Queued {job['id']}", fg="blue")
+        self.api.call("POST", "/config", data={"training_threads": threads},
+                      on_done=lambda r: self.api.call("POST", "/training/jobs", data={"epochs": epochs, "batch": batch}, on_done=queued))
 
-    def run_training_logic(self, epochs, batch):
+    def toggle_preannotation(self):
+        if not self.require_server():
+            return
+        self.api.call("POST", "/preannotate/cancel" if self.preannotate_status == "running" else "/preannotate")
+
+    def update_active_learning(self):
+        if not self.api:
+            return # read on START SERVER
         try:
-            ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            train_dir = os.path.join(server_state.image_folder, f"server_train_{ts}")
-            
-            self.append_log(f"Preparing data in: {train_dir}")
-            yaml_path, count = self.create_dataset_structure(train_dir)
-            
-            if count == 0:
-                self.append_log("No labeled data found.")
-                self.root.after(0, lambda: self.reset_train_ui("No Data"))
-                return
+            retrain_every = max(0, int(self.al_every_ent.get()))
+        except ValueError:
+            messagebox.showerror("Error", "Retrain interval must be a number.")
+            return
+        self.api.call("POST", "/active_learning", data={"enabled": self.al_var.get(), "retrain_every": retrain_every,
+                                                        "method": self.al_method_var.get()})
 
-            self.append_log(f"Starting training ({epochs} epochs)...")
-            
-            base_model = server_state.model_path if server_state.model_path else "yolov8x.pt"
-            self.append_log(f"Base model: {os.path.basename(base_model)}")
-            
-            train_model = YOLO(base_model)
-            results = train_model.train(data=yaml_path, epochs=epochs, batch=batch, imgsz=640)
-            
-            new_model_path = ""
-            if hasattr(results, 'save_dir'):
-                new_model_path = os.path.join(results.save_dir, "weights", "best.pt")
-            
-            self.append_log(f"TRAINING COMPLETE.")
-            self.append_log(f"New Model: {new_model_path}")
+    def cancel_training_job(self):
+        for job_id in self.jobs_tree.selection():
+            self.api.call("POST", f"/training/jobs/{job_id}/cancel")
 
-            self.root.after(0, lambda: self.training_finished_ui(new_model_path))
+    def refresh_training_jobs(self):
+        self.api.call("GET", "/training/jobs", on_done=self.show_training_jobs, on_error=lambda e: None)
+        self.api.call("GET", "/preannotate", on_done=self.show_preannotation, on_error=lambda e: None)
+        self.root.after(1000, self.refresh_training_jobs)
 
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            self.append_log(f"Training Error: {e}")
-            self.root.after(0, lambda: self.reset_train_ui("Error"))
+    def show_training_jobs(self, reply):
+        for job in reply["jobs"]:
+            last = job["metrics"][-1] if job["metrics"] else {}
+            progress = f"{last.get('epoch', 0)}/{job['epochs']}"
+            metrics = "  ".join(f"{k.split('/')[-1]}={v:.3f}" for k, v in list(last.get("metrics", {}).items())[:5])
+            values = (job["status"], progress, job["error"] or metrics)
+            if self.jobs_tree.exists(job["id"]):
+                self.jobs_tree.item(job["id"], values=values)
+            else:
+                self.jobs_tree.insert("", tk.END, iid=job["id"], text=job["id"], values=values)
+            previous = self.job_status.get(job["id"])
+            self.job_status[job["id"]] = job["status"]
+            if previous and previous != job["status"] and job["status"] in ("completed", "failed", "cancelled"):
+                self.training_finished_ui(job)
 
-    def training_finished_ui(self, new_model_path):
-        self.reset_train_ui("Training Complete")
+    def show_preannotation(self, p):
+        self.preannotate_status = p["status"]
+        if p["status"] != "idle":
+            self.preannotate_lbl.config(text=f"Pre-annotation {p['status']}: {p['done']}/{p['total']} images, "
+                                             f"{p['images_per_sec']} img/s" + (f", ETA {p['eta_sec']} s" if p["status"] == "running" and p["eta_sec"] is not None else ""))
+        self.preannotate_btn.config(text="Stop Pre-annotation" if p["status"] == "running" else "Pre-annotate Pool")
+
+    def training_finished_ui(self, job):
+        self.train_status.config(text=f"{job['id']}: {job['status']}", fg="black")
+        new_model_path = job.get("model")
         
-        if new_model_path and os.path.exists(new_model_path):
+        if job.get("auto"):
+            return # promoted by the active-learning loop if it passes validation
+        if job["status"] == "completed" and new_model_path:
             ans = messagebox.askyesno("Training Complete", 
                 f"Training finished successfully!\n\nNew model saved at:\n{new_model_path}\n\nDo you want to switch to this model now?")
             
@@ -453,11 +3594,33 @@ class ServerGUI:
                 self.model_var.set(new_model_path)
                 self.switch_model()
 
-    def reset_train_ui(self, status_text):
-        self.train_btn.config(state=tk.NORMAL, text="Start Training")
-        self.train_status.config(text=status_text, fg="black")
+def main():
+    parser = argparse.ArgumentParser(description="YOLO Team Labeler server. Without a command, opens the control panel.")
+    commands = parser.add_subparsers(dest="command")
+    serve_cmd = commands.add_parser("serve", help="run without a display")
+    serve_cmd.add_argument("-c", "--config", help="YAML or TOML config file (keys as in DEFAULT_CONFIG)")
+    serve_cmd.add_argument("--images", dest="image_folder", help="images folder (overrides the config file)")
+    serve_cmd.add_argument("--model")
+    serve_cmd.add_argument("--host")
+    serve_cmd.add_argument("--port", type=int)
+    serve_cmd.add_argument("--workers", type=int, help="HTTP worker processes in front of the state-owning process")
+    panel_cmd = commands.add_parser("panel", help="open the control panel")
+    panel_cmd.add_argument("--connect", metavar="URL", help="manage a running server, e.g. http://labelbox:8000")
+    args = parser.parse_args()
 
-if __name__ == "__main__":
+    if args.command == "serve":
+        try:
+            config = load_config(args.config, image_folder=args.image_folder, model=args.model, host=args.host,
+                                 port=args.port, workers=args.workers)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        serve(config)
+        return
+    if tk is None:
+        parser.error("tkinter is not installed; use `serve`")
     root = tk.Tk()
-    app = ServerGUI(root)
-    root.mainloop()
\ No newline at end of file
+    ServerGUI(root, connect=getattr(args, "connect", None))
+    root.mainloop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from server import ActiveLearning
+
+
+class FakeTraining:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = []
+        self.on_finished = []
+
+    def submit(self, epochs, batch, auto=False):
+        with self.lock:
+            self.jobs.append({"status": "queued", "auto": auto})
+
+    def listing(self):
+        with self.lock:
+            return list(self.jobs)
+
+
+class FakeQueue:
+    def __init__(self, names):
+        self.names = list(names)
+
+    def pending_images(self):
+        return list(self.names)
+
+    def prioritize(self, scores):
+        pass
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    monkeypatch.setattr(server.server_state, "log", lambda message: None)
+    monkeypatch.setattr(server.server_state, "training", FakeTraining())
+    monkeypatch.setattr(server.server_state, "work_queue", FakeQueue(f"{i:04d}.jpg" for i in range(100)))
+    monkeypatch.setattr(ActiveLearning, "_run", lambda self: None)
+    return SimpleNamespace(db=str(tmp_path / "al" / "active_learning.sqlite"))
+
+
+def test_concurrent_submissions_crossing_the_threshold_queue_one_job(state):
+    al = ActiveLearning(retrain_every=50)
+    al.open(state.db)
+    threads = [threading.Thread(target=al.note_submission) for _ in range(16)]
+    al.since_retrain = 49
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(server.server_state.training.jobs) == 1
+    assert al.since_retrain == 15
+
+
+def test_counter_reset_survives_a_restart(state):
+    al = ActiveLearning(retrain_every=3)
+    al.open(state.db)
+    for _ in range(4):
+        al.note_submission()
+    assert al.since_retrain == 1
+    restarted = ActiveLearning(retrain_every=3)
+    restarted.open(state.db)
+    assert restarted.since_retrain == 1
+
+
+def test_reopening_registers_the_training_callback_once(state):
+    al = ActiveLearning()
+    al.open(state.db)
+    al.open(state.db)
+    assert server.server_state.training.on_finished == [al.training_finished]
+
+
+def test_todo_walks_the_queue_once_per_model(state):
+    al = ActiveLearning()
+    al.open(state.db)
+    handle = SimpleNamespace(hash="v1")
+    seen = []
+    while True:
+        todo = al._todo(handle, 32)
+        if not todo:
+            break
+        seen += todo
+        al.scored.update((name, handle.hash) for name in todo)
+    assert seen == server.server_state.work_queue.names
+    assert al._todo(SimpleNamespace(hash="v2"), 32) == seen[:32]
@@ -0,0 +1,48 @@
+import json
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from server import ClassRegistry
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(server.server_state, "log", lambda message: None)
+    reg = ClassRegistry()
+    reg.path = str(tmp_path / "classes.json")
+    return reg
+
+
+def test_new_classes_get_ids_in_submission_order(registry):
+    registry.check(["zero", "cat", "dog", "cat", "zero"])
+    registry.check(["bird", "dog"])
+    assert registry.names() == ["zero", "cat", "dog", "bird"]
+
+
+def test_strict_mode_rejects_unknown_names_without_registering(registry):
+    registry.strict = True
+    with pytest.raises(ValueError, match="Unknown classes: zebra, ant"):
+        registry.check(["zebra", "ant", "zebra"])
+    assert registry.names() == []
+
+
+def test_counts_are_saved_lazily_and_recounted_after_a_crash(tmp_path, monkeypatch):
+    monkeypatch.setattr(server.server_state, "log", lambda message: None)
+    monkeypatch.setattr(server.server_state, "labels", SimpleNamespace(class_counts=lambda: Counter(cat=3, dog=1)))
+    reg = ClassRegistry(save_interval=60)
+    reg.open(str(tmp_path))
+    reg.update_counts(Counter(), Counter(cat=1))
+    assert json.loads((tmp_path / "classes.json").read_text())["classes"][0]["count"] == 3
+    assert (tmp_path / "classes.json.dirty").exists()
+
+    restarted = ClassRegistry()
+    restarted.open(str(tmp_path)) # the timer never fired: counts come from the labels again
+    assert restarted.listing() == [{"id": 0, "name": "cat", "count": 3}, {"id": 1, "name": "dog", "count": 1}]
+    assert not (tmp_path / "classes.json.dirty").exists()
+
+    reg.flush()
+    assert not (tmp_path / "classes.json.dirty").exists()
+    assert json.loads((tmp_path / "classes.json").read_text())["classes"][0]["count"] == 4
@@ -0,0 +1,47 @@
+"""Background inference must never take the queue room reserved for interactive requests."""
+import threading
+import time
+import types
+
+import pytest
+
+from server import EngineBusy, InferenceEngine
+
+
+class SlowModel:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def __call__(self, images, conf):
+        self.release.wait(5)
+        return [types.SimpleNamespace(boxes=[], speed={}) for _ in images]
+
+
+class Handle:
+    """A served model version, as the engine sees it (hashable, like ModelVersion)."""
+    def __init__(self, model):
+        self.model, self.names, self.version = model, {}, 1
+
+
+def test_bulk_background_work_leaves_room_for_interactive():
+    model = SlowModel()
+    handle = Handle(model)
+    engine = InferenceEngine(max_batch=1, max_wait=0, max_queue=4, max_background=2)
+    engine.start()
+    futures = []
+    producers = [threading.Thread(target=lambda: futures.append(engine.submit("img", 0.25, InferenceEngine.BACKGROUND, handle)),
+                                  daemon=True) for _ in range(20)]
+    for t in producers:
+        t.start()
+    time.sleep(0.3) # one batch is running, the background slots are full, the other producers block
+
+    interactive = [engine.submit("img", 0.25, InferenceEngine.INTERACTIVE, handle) for _ in range(4)]
+    with pytest.raises(EngineBusy):
+        engine.submit("img", 0.25, InferenceEngine.INTERACTIVE, handle)
+
+    model.release.set()
+    assert all(f.result(timeout=5) == [] for f in interactive)
+    for t in producers:
+        t.join(timeout=10)
+    assert len(futures) == 20 and all(f.result(timeout=10) == [] for f in futures)
+    engine.stop()
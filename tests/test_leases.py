@@ -0,0 +1,124 @@
+"""Concurrent stress test for LeaseManager: no image is handed out twice while it is leased."""
+import random
+import threading
+import time
+
+import server
+from server import LeaseManager, WorkQueue
+
+
+def make_pool(n):
+    queue = WorkQueue()
+    queue.images = {f"img{i:04d}.jpg" for i in range(n)}
+    queue.pending.update((img, None) for img in sorted(queue.images))
+    return queue
+
+
+def record_hand_outs(queue):
+    """Logs every pop/requeue; both only happen under the lease manager's lock, so the log is ordered."""
+    events = []
+    pop, requeue = queue.pop_pending, queue.requeue
+
+    def logged_pop():
+        img = pop()
+        if img is not None:
+            events.append(("out", img))
+        return img
+
+    def logged_requeue(img):
+        requeue(img)
+        events.append(("back", img))
+
+    queue.pop_pending, queue.requeue = logged_pop, logged_requeue
+    return events
+
+
+def check_consistent(leases):
+    with leases.lock, leases.work_queue.lock:
+        held = [img for imgs in leases.by_user.values() for img in imgs]
+        assert len(held) == len(set(held)) == len(leases.leases)
+        for img, lease in leases.leases.items():
+            assert img in leases.by_user[lease.user_name]
+            assert img not in leases.work_queue.pending
+
+
+def test_concurrent_lease_renew_expire_release(monkeypatch):
+    monkeypatch.setattr(server.server_state, "log", lambda message: None)
+    queue = make_pool(400)
+    events = record_hand_outs(queue)
+    leases = LeaseManager(queue, ttl=0.05, reap_interval=0.01)
+    leases.start()
+    stop = threading.Event()
+    errors = []
+
+    def annotator(user):
+        rng = random.Random(user)
+        try:
+            while not stop.is_set():
+                action = rng.random()
+                if action < 0.3:
+                    img = leases.claim(user)
+                    if img is None:
+                        return
+                elif action < 0.5:
+                    leases.claim_batch(user, rng.randint(1, 6))
+                elif action < 0.65:
+                    leases.renew(user)
+                else:
+                    held = leases.renew(user)
+                    if held:
+                        img = rng.choice(held)
+                        leases.release(img, user, completed=action < 0.9) # some finished, some given back
+                if rng.random() < 0.05:
+                    time.sleep(0.06) # stall past the ttl so the reaper takes the leases back
+        except Exception as e:
+            errors.append(e)
+
+    def checker():
+        while not stop.is_set():
+            try:
+                check_consistent(leases)
+            except AssertionError as e:
+                errors.append(e)
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=annotator, args=(f"user{i}",)) for i in range(16)]
+    threads.append(threading.Thread(target=checker))
+    for t in threads:
+        t.start()
+    time.sleep(3)
+    stop.set()
+    for t in threads:
+        t.join(timeout=10)
+    leases.stop()
+
+    assert not errors, errors[:3]
+    check_consistent(leases)
+    outstanding = set()
+    for kind, img in events:
+        if kind == "out":
+            assert img not in outstanding, f"{img} handed out twice while leased"
+            outstanding.add(img)
+        else:
+            outstanding.discard(img)
+    assert sum(kind == "out" for kind, _ in events) > 400 # expiries and give-backs were exercised
+
+
+def test_expired_lease_goes_to_next_user(monkeypatch):
+    monkeypatch.setattr(server.server_state, "log", lambda message: None)
+    leases = LeaseManager(make_pool(3), ttl=0.01)
+    first = leases.claim("ann")
+    time.sleep(0.02)
+    assert leases.claim("bob") != first
+    assert leases.reap() == [first]
+    assert leases.claim("cid") == first
+    assert leases.holder(first) == "cid"
+
+
+def test_completed_image_is_never_handed_out_again():
+    queue = make_pool(2)
+    leases = LeaseManager(queue)
+    img = leases.claim("ann")
+    leases.release(img, "ann", completed=True)
+    assert leases.claim("bob") != img
+    assert leases.claim("cid") is None
@@ -0,0 +1,49 @@
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+import server
+from server import ModelRegistry
+
+
+class FakeEngine:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, img, conf, priority, handle):
+        self.submitted.append(priority)
+        future = Future()
+        future.set_result([("cat", [0, 0, 10, 10])])
+        return future
+
+
+def serving_model(images, **kwargs):
+    raise AssertionError("the serving model was called outside the engine thread")
+
+
+@pytest.fixture
+def state(monkeypatch):
+    labeled = [f"{i:03d}.jpg" for i in range(20)]
+    monkeypatch.setattr(server.server_state, "engine", FakeEngine())
+    monkeypatch.setattr(server.server_state, "image_cache", SimpleNamespace(get=lambda path: Image.new("RGB", (20, 20))))
+    monkeypatch.setattr(server.server_state, "labels", SimpleNamespace(read=lambda name: ["cat 0.25 0.25 0.5 0.5"]))
+    monkeypatch.setattr(server.server_state, "work_queue", SimpleNamespace(labeled_images=lambda: list(labeled)))
+    return labeled
+
+
+def test_serving_handle_is_scored_through_the_engine(state):
+    registry = ModelRegistry()
+    handle = SimpleNamespace(model=serving_model, names={0: "cat"})
+    holdout = registry.holdout()
+    result = registry.score(handle, holdout, serving=True)
+    assert server.server_state.engine.submitted == [server.InferenceEngine.BACKGROUND] * len(holdout)
+    assert result["f1"] == 1.0
+
+
+def test_holdout_leaves_most_labels_for_training(state):
+    registry = ModelRegistry(holdout_size=32)
+    holdout = registry.holdout()
+    assert len(holdout) == 4 and set(holdout) <= set(state)
+    assert registry.holdout() == holdout
@@ -0,0 +1,47 @@
+import json
+import time
+
+import pytest
+
+client = pytest.importorskip("client")
+
+
+class Reply:
+    def __init__(self, status_code, body):
+        self.status_code, self.text = status_code, body
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+
+class Transport:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.sent = []
+
+    def post(self, path, data, gzip_data=False):
+        self.sent.append(data["image_name"])
+        return self.replies.pop(0)
+
+
+def drain(outbox, timeout=5):
+    deadline = time.time() + timeout
+    while outbox.size() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_non_json_client_error_is_parked_not_retried(tmp_path):
+    transport = Transport([Reply(413, "<html>Request Entity Too Large</html>"), Reply(200, '{"status": "success"}')])
+    messages = []
+    outbox = client.SubmissionOutbox(str(tmp_path), transport, on_status=messages.append)
+    outbox.put({"image_name": "a.jpg", "user_name": "u", "labels": "[]"})
+    outbox.put({"image_name": "b.jpg", "user_name": "u", "labels": "[]"})
+    drain(outbox)
+    outbox.stop()
+    assert transport.sent == ["a.jpg", "b.jpg"]
+    assert len(list((tmp_path / "failed").iterdir())) == 1
+    assert "rejected" in messages[0]
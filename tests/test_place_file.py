@@ -0,0 +1,20 @@
+import server
+from server import place_file
+
+
+def test_copy_mode_without_fcntl_copies(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "fcntl", None)
+    src, dst = tmp_path / "a.jpg", tmp_path / "b.jpg"
+    src.write_bytes(b"pixels")
+    assert place_file(str(src), str(dst), "copy") == "copy"
+    assert dst.read_bytes() == b"pixels"
+
+
+def test_rendition_eviction_without_fcntl(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "fcntl", None)
+    cache = server.RenditionCache(max_bytes=10)
+    cache.open(str(tmp_path / "renditions"))
+    for name in ("a.jpg", "b.jpg"):
+        (tmp_path / "renditions" / name).write_bytes(b"x" * 8)
+    cache._evict()
+    assert cache.stats()["bytes"] <= 10
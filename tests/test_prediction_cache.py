@@ -0,0 +1,29 @@
+import os
+
+from server import PredictionCache
+
+
+def test_disk_tier_is_bounded(tmp_path):
+    cache = PredictionCache(max_entries=2)
+    cache.open(str(tmp_path), 8)
+    for i in range(20):
+        cache.put(PredictionCache.key(f"{i:040x}", "a" * 40, 0.25), [["cat", [0, 0, 1, 1]]])
+    files = [f for _, _, fs in os.walk(tmp_path) for f in fs]
+    assert len(files) <= 8
+    assert cache.get(PredictionCache.key(f"{19:040x}", "a" * 40, 0.25)) == [["cat", [0, 0, 1, 1]]]
+
+
+def test_prune_drops_unknown_models(tmp_path):
+    cache = PredictionCache()
+    cache.open(str(tmp_path), 100)
+    for model in ("a" * 40, "b" * 40):
+        cache.put(PredictionCache.key("0" * 40, model, 0.25), [])
+    cache.prune(["b" * 40])
+    assert os.listdir(tmp_path) == ["b" * 16]
+
+
+def test_disk_tier_can_be_disabled(tmp_path):
+    cache = PredictionCache()
+    cache.open(str(tmp_path / "predictions"), 0)
+    cache.put(PredictionCache.key("0" * 40, "a" * 40, 0.25), [])
+    assert not (tmp_path / "predictions").exists()
@@ -0,0 +1,35 @@
+"""Two RenditionCache instances stand in for the primary and a front worker sharing one folder."""
+import os
+
+from PIL import Image
+
+import server
+from server import ImageIndex, RenditionCache
+
+
+def test_processes_share_one_lru_and_size_cap(tmp_path, monkeypatch):
+    images = tmp_path / "images"
+    images.mkdir()
+    names = [f"img{i}.png" for i in range(12)]
+    for i, name in enumerate(names):
+        Image.effect_noise((600, 400), 40 + i).convert("RGB").save(images / name)
+    index = ImageIndex()
+    index.open(str(images), str(tmp_path / "index.sqlite"))
+    monkeypatch.setattr(server.server_state, "image_folder", str(images))
+    monkeypatch.setattr(server.server_state, "image_index", index)
+
+    folder = str(tmp_path / "renditions")
+    primary, worker = RenditionCache(), RenditionCache()
+    primary.open(folder)
+    worker.open(folder)
+    first = worker.get(names[0], 200)
+    rendition_size = os.path.getsize(first)
+    primary.max_bytes = worker.max_bytes = 4 * rendition_size
+
+    for name in names[1:]:
+        assert os.path.exists(primary.get(name, 200))
+    assert not os.path.exists(first) # evicted by the other process
+
+    again = worker.get(names[0], 200) # rebuilt instead of a dangling path
+    assert again == first and os.path.exists(again)
+    assert primary.stats()["bytes"] <= 4 * rendition_size * 1.2
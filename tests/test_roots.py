@@ -0,0 +1,69 @@
+"""Endpoints that take a server-side path only accept paths inside the configured roots."""
+import os
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+@pytest.fixture
+def roots(tmp_path, monkeypatch):
+    images = tmp_path / "images"
+    images.mkdir()
+    monkeypatch.setattr(server.server_state, "image_folder", str(images))
+    monkeypatch.setattr(server.server_state, "export_roots", [os.path.realpath(images)])
+    return tmp_path
+
+
+def test_export_outside_roots_is_refused(roots):
+    outside = roots / "elsewhere"
+    for path in (str(outside), str(roots / "images" / ".." / "elsewhere")):
+        with pytest.raises(HTTPException) as e:
+            server.export_dataset(path, "auto")
+        assert e.value.status_code == 403
+    assert not outside.exists()
+
+
+def test_export_through_a_symlink_out_of_the_root_is_refused(roots):
+    os.symlink(roots, roots / "images" / "escape")
+    with pytest.raises(HTTPException) as e:
+        server.export_dataset(str(roots / "images" / "escape" / "out"), "auto")
+    assert e.value.status_code == 403
+
+
+def test_inside_roots():
+    assert server.inside_roots("/data/exports/a/../b", ["/data/exports"]) == "/data/exports/b"
+    assert server.inside_roots("/data/exportsX", ["/data/exports"]) is None
+
+
+def test_promote_outside_model_roots_is_refused(roots, monkeypatch):
+    monkeypatch.setattr(server.server_state, "model_roots", [os.path.realpath(roots / "images")])
+    checkpoint = roots / "evil.pt"
+    checkpoint.write_bytes(b"not loaded")
+    with pytest.raises(HTTPException) as e:
+        server.promote_model(str(checkpoint), True, False, False)
+    assert e.value.status_code == 403
+
+
+def test_image_names_cannot_leave_the_pool(roots):
+    (roots / "secret.txt").write_text("cat 0.5 0.5 0.1 0.1\n")
+    for name in ("../secret.txt", "/etc/passwd", "..", ""):
+        for call in (lambda: server.get_image_specific(name, 0, None), lambda: server.get_current_labels(name),
+                     lambda: server.submit_label(name, "u", "[]"), lambda: server.label_history(name)):
+            with pytest.raises(HTTPException) as e:
+                call()
+            assert e.value.status_code == 400
+    assert server.pool_path("a.jpg") == os.path.join(str(roots / "images"), "a.jpg")
+
+
+def test_local_panel_choices_join_the_roots(roots):
+    panel = server.ServerGUI.__new__(server.ServerGUI)
+    chosen, export_roots = roots / "exports", [os.path.realpath(roots / "images")]
+    panel.local_server = False
+    panel.allow_local(export_roots, str(chosen))
+    assert export_roots == [os.path.realpath(roots / "images")] # a remote server keeps its configured roots
+    panel.local_server = True
+    for _ in range(2):
+        panel.allow_local(export_roots, str(chosen))
+    assert export_roots == [os.path.realpath(roots / "images"), os.path.realpath(chosen)]
@@ -0,0 +1,49 @@
+"""Training job body, run by server.py in a separate process.
+
+Kept out of server.py so the job does not run against the server's state or
+its serving model. The spawned process still re-runs server.py as
+__mp_main__ when the server was started as `python server.py` (FastAPI and Tk
+imports, an idle ServerState); next to ultralytics that cost is small.
+"""
+import os
+import traceback
+
+
+def limit_resources(threads, nice):
+    """Called before torch is imported so the thread settings take effect."""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+
+
+def run_training_job(job, events):
+    """Trains one job and reports progress as dicts on the `events` queue.
+
+    Events: {"type": "epoch", ...metrics}, then {"type": "done", "model": path}
+    or {"type": "error", "message": str}.
+    """
+    try:
+        limit_resources(job["threads"], job["nice"])
+        import torch
+        torch.set_num_threads(job["threads"])
+        from ultralytics import YOLO
+
+        model = YOLO(job["base_model"])
+
+        def on_fit_epoch_end(trainer):
+            metrics = {k: round(float(v), 5) for k, v in (trainer.metrics or {}).items()}
+            if trainer.tloss is not None:
+                for name, value in zip(trainer.loss_names, trainer.tloss.tolist() if hasattr(trainer.tloss, "tolist") else [trainer.tloss]):
+                    metrics[f"train/{name}"] = round(float(value), 5)
+            events.put({"type": "epoch", "epoch": trainer.epoch + 1, "epochs": trainer.epochs, "metrics": metrics})
+
+        model.add_callback("on_fit_epoch_end", on_fit_epoch_end)
+        results = model.train(data=job["data"], epochs=job["epochs"], batch=job["batch"], imgsz=job["imgsz"],
+                              workers=min(job["threads"], 8), project=job["project"], name=job["id"], exist_ok=True)
+
+        save_dir = getattr(results, "save_dir", None) or getattr(model.trainer, "save_dir", "")
+        events.put({"type": "done", "model": os.path.join(str(save_dir), "weights", "best.pt")})
+    except Exception as e:
+        traceback.print_exc()
+        events.put({"type": "error", "message": str(e)})